@@ -0,0 +1,223 @@
+"""
+Пакетное предсказание по загруженному файлу (/predict/batch).
+
+Файл (CSV или Arrow IPC) читается кусками по BATCH_CHUNK_ROWS строк, куски
+оцениваются в отдельном пуле процессов, не более BATCH_INFLIGHT кусков на
+запрос одновременно. Память не зависит от размера файла: в ней только
+читаемый кусок и куски в работе. Результаты уходят NDJSON-строками по мере
+готовности кусков, поэтому порядок строк не гарантирован — у каждой есть
+номер row (с 1, без заголовка). Ошибка в строке не останавливает файл:
+вместо предсказания в ответе поле error.
+
+Каждая строка — полная заявка: поля анкеты (person_age, person_income в
+KZT/мес, person_home_ownership, person_emp_length) и поля /predict/
+(loan_amount, currency, loan_intent, ...). Признаки собираются той же
+features.application_row, что и в /predict/.
+
+Arrow читается через pyarrow (есть в requirements.txt).
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Iterator
+
+import pandas as pd
+
+from features import PERSON_FIELDS, application_row
+from process_pool import BoundedProcessPool, PoolBusy
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_CHUNK_ROWS = int(os.getenv("BATCH_CHUNK_ROWS", "2000"))
+# Сколько кусков одного запроса может оцениваться одновременно
+BATCH_INFLIGHT = int(os.getenv("BATCH_INFLIGHT", str(BATCH_WORKERS)))
+# Сколько кусков всех запросов может ждать пул, сверх этого — 503 / ошибка куска
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", str(BATCH_WORKERS * 4)))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "120"))
+
+
+class BatchFormatError(ValueError):
+    pass
+
+
+def detect_format(filename: str = None, content_type: str = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".arrow", ".feather", ".ipc", ".arrows")) or "arrow" in (content_type or ""):
+        return "arrow"
+    if name.endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    raise BatchFormatError("Не удалось определить формат: укажите format=csv или format=arrow")
+
+
+def _records(frame: pd.DataFrame) -> list:
+    # Пустые ячейки — None, как отсутствующие поля в JSON /predict/
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def _arrow_batches(file):
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+    except ImportError:
+        raise BatchFormatError("Для Arrow-файлов на сервере нужен пакет pyarrow")
+    try:
+        reader = ipc.open_file(file)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        # Не файловый формат — пробуем потоковый (.arrows)
+        file.seek(0)
+        try:
+            batches = iter(ipc.open_stream(file))
+        except pa.ArrowInvalid as e:
+            raise BatchFormatError(f"Не Arrow IPC: {e}")
+    return batches
+
+
+def open_chunks(file, fmt: str, size: int = BATCH_CHUNK_ROWS) -> Iterator[list]:
+    """
+    Итератор кусков (списков dict) по size строк. Заголовок/схема читаются
+    сразу, так что битый файл даёт BatchFormatError до начала ответа.
+    """
+    if fmt == "csv":
+        try:
+            reader = pd.read_csv(file, chunksize=size, encoding="utf-8-sig")
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            raise BatchFormatError(f"Не удалось прочитать CSV: {e}")
+        return (_records(frame) for frame in reader)
+    if fmt == "arrow":
+        return _rechunk(_arrow_batches(file), size)
+    raise BatchFormatError(f"Неизвестный формат: {fmt}")
+
+
+def _rechunk(batches, size: int) -> Iterator[list]:
+    # Record batch-и бывают любого размера: собираем куски ровно по size строк
+    buffer = []
+    for batch in batches:
+        buffer.extend(_records(batch.to_pandas()))
+        while len(buffer) >= size:
+            yield buffer[:size]
+            buffer = buffer[size:]
+    if buffer:
+        yield buffer
+
+
+# --- воркер пула ---
+
+_pipeline = None
+
+
+def _init_worker():
+    import inference  # noqa: F401
+
+
+def _compiled_pipeline(version: int):
+    """
+    Модель версии version. Воркер, форкнутый после загрузки модели (serve.py),
+    берёт унаследованную; иначе загружает свою и перезагружает при смене версии.
+    """
+    global _pipeline
+    from resources import resources
+
+    if resources.ready and resources.version == version:
+        return resources.compiled_model
+    if _pipeline is None or _pipeline[0] != version:
+        from inference import CompiledPipeline
+        from pycaret.classification import load_model
+
+        _pipeline = (version, CompiledPipeline(load_model(resources.model_name)))
+    return _pipeline[1]
+
+
+def score_chunk(version: int, first_row: int, records: list, usd_to_kzt: float) -> list:
+    """Результаты для куска: {row, prediction_label, prediction_score} или {row, error}."""
+    results, rows, valid = [], [], []
+    for offset, data in enumerate(records):
+        result = {"row": first_row + offset}
+        try:
+            rows.append(application_row(data, {field: data.get(field) for field in PERSON_FIELDS}, usd_to_kzt))
+            valid.append(offset)
+        except (KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        results.append(result)
+
+    if rows:
+        try:
+            labels, scores = _compiled_pipeline(version).predict(pd.DataFrame(rows))
+        except Exception as e:
+            for offset in valid:
+                results[offset]["error"] = f"Ошибка прогноза: {e}"
+        else:
+            for offset, label, score in zip(valid, labels, scores):
+                results[offset]["prediction_label"] = int(label)
+                results[offset]["prediction_score"] = round(float(score), 4)
+    return results
+
+
+class BatchPool(BoundedProcessPool):
+    """Пул процессов для /predict/batch: большие файлы не занимают event loop и батчер /predict/."""
+
+    def __init__(self, workers: int = BATCH_WORKERS, queue_size: int = BATCH_QUEUE_SIZE, timeout: float = BATCH_TIMEOUT):
+        super().__init__(workers, queue_size, timeout, initializer=_init_worker)
+
+    @property
+    def busy(self) -> bool:
+        return self.pending >= self.queue_size
+
+    async def score(self, version: int, first_row: int, records: list, usd_to_kzt: float) -> list:
+        try:
+            return await self.run(score_chunk, version, first_row, records, usd_to_kzt)
+        except PoolBusy:
+            error = "Пул пакетных предсказаний перегружен или не уложился в таймаут, отправьте эти строки повторно"
+            return [{"row": first_row + offset, "error": error} for offset in range(len(records))]
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+async def stream_predictions(pool: BatchPool, chunks: Iterator[list], version: int, usd_to_kzt: float,
+                             inflight: int = BATCH_INFLIGHT, on_chunk=None):
+    """
+    NDJSON: строки результатов по мере готовности кусков, последней —
+    итог {total, scored, errors, seconds} (и error, если файл оборвался).
+    on_chunk(results) вызывается для каждого готового куска (метрики).
+    """
+    start = time.perf_counter()
+    total = failed = 0
+    next_row = 1
+    read_error = None
+    exhausted = False
+    pending = set()
+    try:
+        while True:
+            while not exhausted and len(pending) < inflight:
+                try:
+                    records = await asyncio.to_thread(next, chunks, None)
+                except Exception as e:
+                    records, read_error = None, f"Ошибка чтения файла после строки {next_row - 1}: {e}"
+                if records is None:
+                    exhausted = True
+                    break
+                pending.add(asyncio.create_task(pool.score(version, next_row, records, usd_to_kzt)))
+                next_row += len(records)
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                results = task.result()
+                total += len(results)
+                failed += sum("error" in result for result in results)
+                if on_chunk is not None:
+                    on_chunk(results)
+                yield "".join(_line(result) for result in results)
+    finally:
+        # Клиент отключился: куски, которые ещё ждут пул, больше не нужны
+        for task in pending:
+            task.cancel()
+
+    trailer = {"total": total, "scored": total - failed, "errors": failed,
+               "seconds": round(time.perf_counter() - start, 3)}
+    if read_error:
+        trailer["error"] = read_error
+    yield _line(trailer)
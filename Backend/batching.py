@@ -0,0 +1,146 @@
+"""
+Микробатчинг инференса для /predict/.
+
+Запросы кладут свои строки в очередь и ждут результат. Фоновая задача
+собирает строки, пока не наберётся INFERENCE_BATCH_SIZE или не пройдёт
+INFERENCE_BATCH_WAIT_MS с первой строки пачки, и оценивает всю пачку одним
+вызовом модели в отдельном потоке. Пока пачка считается, копится следующая.
+"""
+import asyncio
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import BASE_FEATURES
+
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "64"))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "5"))
+# Сколько запросов может ждать в очереди, сверх этого — 503
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "1024"))
+
+
+class QueueFull(Exception):
+    """Очередь инференса переполнена."""
+
+
+class _Request:
+    __slots__ = ("rows", "future", "enqueued_at")
+
+    def __init__(self, rows, future):
+        self.rows = rows
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceBatcher:
+    def __init__(self, score_fn, max_batch_size: int = INFERENCE_BATCH_SIZE,
+                 max_wait_ms: float = INFERENCE_BATCH_WAIT_MS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        """score_fn(frame) -> (labels, scores), вызывается в потоке."""
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue_size = queue_size
+        self._queue = None
+        self._task = None
+        # Счётчики для stats()
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.rejected = 0
+        self.largest_batch = 0
+        self._wait_total = 0.0
+        self._score_total = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, rows: list):
+        """Оценивает строки (словари с BASE_FEATURES) в составе общей пачки. Возвращает (labels, scores)."""
+        self.start()
+        request = _Request(rows, asyncio.get_running_loop().create_future())
+        try:
+            self._queue.put_nowait(request)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFull()
+        return await request.future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        size = len(batch[0].rows)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                # asyncio.wait, а не wait_for: при отмене по таймауту элемент остаётся в очереди
+                getter = asyncio.ensure_future(self._queue.get())
+                done, _ = await asyncio.wait({getter}, timeout=timeout)
+                if not done:
+                    getter.cancel()
+                    break
+                request = getter.result()
+            else:
+                request = self._queue.get_nowait()
+            batch.append(request)
+            size += len(request.rows)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            rows = [row for request in batch for row in request.rows]
+            try:
+                frame = pd.DataFrame(rows, columns=BASE_FEATURES)
+                labels, scores = await asyncio.to_thread(self.score_fn, frame)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            self.batches += 1
+            self.requests += len(batch)
+            self.rows += len(rows)
+            self.largest_batch = max(self.largest_batch, len(rows))
+            self._score_total += finished - started
+            offset = 0
+            for request in batch:
+                self._wait_total += started - request.enqueued_at
+                end = offset + len(request.rows)
+                # Клиент мог отключиться, пока запрос ждал пачку
+                if not request.future.done():
+                    request.future.set_result((np.asarray(labels[offset:end]), np.asarray(scores[offset:end])))
+                offset = end
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_size": self.queue_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "requests": self.requests,
+            "rows": self.rows,
+            "rejected": self.rejected,
+            "largest_batch": self.largest_batch,
+            "avg_batch_size": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "avg_wait_ms": round(self._wait_total / self.requests * 1000, 3) if self.requests else 0.0,
+            "avg_score_ms": round(self._score_total / self.batches * 1000, 3) if self.batches else 0.0,
+        }
@@ -0,0 +1,588 @@
+"""
+Бенчмарки бэкенда.
+
+    python benchmarks.py index [--csv credit_risk_dataset.csv] [--queries 500]
+    python benchmarks.py parity [--model my_pipeline] [--rows 2000]
+    python benchmarks.py login-flood --url http://localhost:8000 --username u --password p
+    python benchmarks.py startup [--port 8765] [--runs 3]
+    python benchmarks.py dataset [--csv credit_risk_dataset.csv] [--workers 4]
+    python benchmarks.py throughput --url http://localhost:8000 --username u --password p [--endpoint predict]
+    python benchmarks.py batching [--model my_pipeline] [--concurrency 64] [--wait-ms 5]
+    python benchmarks.py prediction-cache [--model my_pipeline] [--rows 5000]
+
+Если CSV нет рядом, используется синтетический датасет той же схемы.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from credit_index import CreditIndex
+from features import BASE_FEATURES
+
+
+def synthetic_dataset(rows: int = 32581, seed: int = 42) -> pd.DataFrame:
+    """Датасет со схемой credit_risk_dataset.csv и похожими распределениями."""
+    rng = np.random.default_rng(seed)
+    income = np.round(rng.lognormal(mean=11.0, sigma=0.5, size=rows))
+    loan_amnt = np.round(rng.uniform(500, 35000, size=rows))
+    emp_length = rng.integers(0, 30, size=rows).astype(float)
+    emp_length[rng.random(rows) < 0.03] = np.nan
+    int_rate = np.round(rng.uniform(5.4, 23.2, size=rows), 2)
+    int_rate[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        "person_age": rng.integers(20, 70, size=rows),
+        "person_income": income,
+        "person_home_ownership": rng.choice(["RENT", "MORTGAGE", "OWN", "OTHER"], size=rows, p=[0.5, 0.41, 0.08, 0.01]),
+        "person_emp_length": emp_length,
+        "loan_intent": rng.choice(["EDUCATION", "MEDICAL", "VENTURE", "PERSONAL", "DEBTCONSOLIDATION", "HOMEIMPROVEMENT"], size=rows),
+        "loan_grade": rng.choice(list("ABCDEFG"), size=rows, p=[0.33, 0.32, 0.2, 0.11, 0.03, 0.007, 0.003]),
+        "loan_amnt": loan_amnt,
+        "loan_int_rate": int_rate,
+        "loan_status": (rng.random(rows) < 0.22).astype(int),
+        "loan_percent_income": np.round(loan_amnt / income, 2),
+        "cb_person_default_on_file": rng.choice(["N", "Y"], size=rows, p=[0.82, 0.18]),
+        "cb_person_cred_hist_length": rng.integers(2, 30, size=rows),
+    })
+
+
+def load_dataset(csv_path: str) -> pd.DataFrame:
+    if os.path.exists(csv_path):
+        df = pd.read_csv(csv_path)
+    else:
+        print(f"[i] {csv_path} не найден, используется синтетический датасет")
+        df = synthetic_dataset()
+    df["loan_status"] = pd.to_numeric(df["loan_status"], errors="coerce")
+    return df
+
+
+def _timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_index(args):
+    df = load_dataset(args.csv)
+
+    start = time.perf_counter()
+    index = CreditIndex(df)
+    build_time = time.perf_counter() - start
+
+    # Профили клиентов берём из самого датасета
+    rng = np.random.default_rng(0)
+    profiles = df.dropna(subset=["person_age", "person_income"]).sample(args.queries, random_state=0, replace=True)
+    queries = [
+        (row.person_home_ownership, row.person_age - 5, row.person_age + 5, row.person_income * 0.8 * rng.uniform(1.0, 1.25), row.person_income * rng.uniform(1.0, 1.25))
+        for row in profiles.itertuples()
+    ]
+
+    def scan(q):
+        ownership, age_min, age_max, income_min, income_max = q
+        return df[
+            (df["loan_status"] == 0) &
+            (df["person_home_ownership"] == ownership) &
+            (df["person_emp_length"].notnull()) &
+            (df["person_age"].between(age_min, age_max)) &
+            (df["person_income"].between(income_min, income_max))
+        ]
+
+    def lookup(q):
+        ownership, age_min, age_max, income_min, income_max = q
+        return index.find_similar(0, ownership, age_min, age_max, income_min, income_max)
+
+    sizes = []
+    for q in queries:
+        expected, actual = scan(q), lookup(q)
+        if not expected.index.equals(actual.index):
+            raise AssertionError(f"Индекс расходится с полным сканом для {q}")
+        sizes.append(len(actual))
+
+    scan_time = _timed(lambda: [scan(q) for q in queries], args.repeat) / len(queries)
+    lookup_time = _timed(lambda: [lookup(q) for q in queries], args.repeat) / len(queries)
+    sample_scan = _timed(lambda: df[df["loan_status"] == 1].sample(1), 200)
+    sample_index = _timed(lambda: index.sample(1), 200)
+
+    print(f"Строк в датасете:          {len(df)}")
+    print(f"Построение индекса:        {build_time * 1000:.1f} мс")
+    print(f"Средний размер ответа:     {np.mean(sizes):.1f} (макс. {max(sizes)})")
+    print(f"/find-credits/ полный скан: {scan_time * 1e6:.0f} мкс/запрос")
+    print(f"/find-credits/ индекс:      {lookup_time * 1e6:.0f} мкс/запрос  (x{scan_time / lookup_time:.1f})")
+    print(f"/sample_credit/ скан:       {sample_scan * 1e6:.0f} мкс/запрос")
+    print(f"/sample_credit/ индекс:     {sample_index * 1e6:.0f} мкс/запрос  (x{sample_scan / sample_index:.1f})")
+
+
+def bench_parity(args):
+    from pycaret.classification import load_model, predict_model
+    from features import add_engineered_features
+    from inference import CompiledPipeline, check_parity
+
+    pipeline = load_model(args.model)
+    compiled = CompiledPipeline(pipeline)
+    raw = load_dataset(args.csv)[BASE_FEATURES].sample(args.rows, random_state=0, replace=True).reset_index(drop=True)
+
+    rows = check_parity(pipeline, raw)
+    print(f"Паритет с predict_model: {rows} строк, метки и скоры совпадают")
+
+    one_row = raw.iloc[[0]]
+    pycaret_time = _timed(lambda: predict_model(pipeline, data=add_engineered_features(one_row.copy()), verbose=False), args.repeat)
+    compiled_time = _timed(lambda: compiled.predict(one_row.copy()), args.repeat)
+    print(f"predict_model, 1 строка:    {pycaret_time * 1000:.2f} мс")
+    print(f"CompiledPipeline, 1 строка: {compiled_time * 1000:.2f} мс  (x{pycaret_time / compiled_time:.1f})")
+
+
+def percentiles(samples) -> dict:
+    """p50/p95/p99 в миллисекундах."""
+    values = np.asarray(samples) * 1000
+    if not len(values):
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+async def _probe_latency(client, path: str, duration: float, interval: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def _login_flood(client, username: str, password: str, deadline: float, codes: dict):
+    while time.perf_counter() < deadline:
+        response = await client.post("/token/", data={"username": username, "password": password})
+        codes[response.status_code] = codes.get(response.status_code, 0) + 1
+
+
+async def _run_login_flood(args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        await client.get("/currency-rates/")  # прогрев курса
+
+        quiet = await _probe_latency(client, "/currency-rates/", args.duration, args.interval)
+
+        codes = {}
+        deadline = time.perf_counter() + args.duration
+        flood = [asyncio.create_task(_login_flood(client, args.username, args.password, deadline, codes)) for _ in range(args.concurrency)]
+        loaded = await _probe_latency(client, "/currency-rates/", args.duration, args.interval)
+        await asyncio.gather(*flood)
+
+    print(f"/currency-rates/ без нагрузки:  {percentiles(quiet)}")
+    print(f"/currency-rates/ во время флуда: {percentiles(loaded)}")
+    print(f"Ответы /token/ за {args.duration:.0f} c при {args.concurrency} клиентах: {codes}")
+
+
+def bench_login_flood(args):
+    asyncio.run(_run_login_flood(args))
+
+
+def _wait_for(client, path: str, deadline: float, ok=lambda r: True):
+    """Опрашивает path, пока не придёт подходящий ответ. Возвращает (момент ответа, статус)."""
+    import httpx
+
+    while time.perf_counter() < deadline:
+        try:
+            response = client.get(path)
+            if ok(response):
+                return time.perf_counter(), response.status_code
+        except httpx.TransportError:
+            pass
+        time.sleep(0.02)
+    return None, None
+
+
+def bench_startup(args):
+    """
+    Время от запуска uvicorn до первых ответов: /healthz, /currency-rates/
+    и /readyz (модель и датасет загружены). Каждый запуск — отдельный процесс.
+    """
+    import httpx
+
+    import_cmd = [sys.executable, "-c", "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"]
+    import_time = float(subprocess.run(import_cmd, capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1])
+    print(f"import main:               {import_time * 1000:.0f} мс")
+
+    url = f"http://127.0.0.1:{args.port}"
+    for run in range(args.runs):
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            with httpx.Client(base_url=url, timeout=30) as client:
+                deadline = started + args.timeout
+                results = {}
+                for path, ok in (
+                    ("/healthz", lambda r: r.status_code == 200),
+                    ("/currency-rates/", lambda r: True),
+                    ("/readyz", lambda r: r.status_code == 200),
+                ):
+                    answered_at, status = _wait_for(client, path, deadline, ok)
+                    results[path] = (None if answered_at is None else answered_at - started, status)
+        finally:
+            server.terminate()
+            server.wait()
+
+        line = ", ".join(
+            f"{path} {'—' if t is None else f'{t * 1000:.0f} мс'} ({status})" for path, (t, status) in results.items()
+        )
+        print(f"запуск {run + 1}: {line}")
+
+
+_DATASET_CHILD = """
+import json, sys, time
+import pandas as pd
+from credit_index import CreditIndex
+from dataset import load_credit_dataset
+start = time.perf_counter()
+if sys.argv[1] == "csv":
+    df = pd.read_csv(sys.argv[2])
+    df["loan_status"] = pd.to_numeric(df["loan_status"], errors="coerce")
+else:
+    df = load_credit_dataset(sys.argv[2])
+CreditIndex(df)
+print(json.dumps({"seconds": time.perf_counter() - start}), flush=True)
+sys.stdin.readline()
+"""
+
+
+def _memory_kb(pid: int) -> dict:
+    """RSS и PSS процесса из /proc (PSS делит общие страницы между процессами)."""
+    result = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                result[key.lower()] = int(value.split()[0])
+    return result
+
+
+def bench_dataset(args):
+    """
+    Загрузка датасета из CSV против memory-mapped снимка: время до готового
+    CreditIndex и память. Запускается --workers процессов одновременно, как
+    воркеры uvicorn, и у каждого снимаются RSS и PSS.
+    """
+    import json
+
+    from dataset import build_snapshot
+
+    if not os.path.exists(args.csv):
+        synthetic_dataset().to_csv(args.csv, index=False)
+        print(f"[i] {args.csv} не найден, записан синтетический датасет")
+    build_snapshot(args.csv)
+
+    for mode in ("csv", "snapshot"):
+        children = [
+            subprocess.Popen([sys.executable, "-c", _DATASET_CHILD, mode, args.csv], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            for _ in range(args.workers)
+        ]
+        seconds = [json.loads(child.stdout.readline())["seconds"] for child in children]
+        memory = [_memory_kb(child.pid) for child in children]
+        for child in children:
+            child.communicate("\n")
+
+        print(
+            f"{mode:9s} загрузка {np.mean(seconds) * 1000:7.0f} мс, "
+            f"RSS {np.mean([m['rss'] for m in memory]) / 1024:6.1f} МБ/процесс, "
+            f"PSS суммарно {sum(m['pss'] for m in memory) / 1024:6.1f} МБ на {args.workers} процессов"
+        )
+
+
+PROFILE = {"person_age": 30, "person_income": 300000, "person_home_ownership": "RENT", "person_emp_length": 5}
+PREDICT_REQUEST = {
+    "loan_intent": "EDUCATION", "loan_grade": "B", "loan_amount": 5000, "loan_int_rate": 11.5,
+    "currency": "USD", "cb_person_default_on_file": "N", "cb_person_cred_hist_length": 4,
+}
+
+
+async def _throughput_client(client, endpoint: str, deadline: float, latencies: list, codes: dict):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if endpoint == "predict":
+            response = await client.post("/predict/", json=PREDICT_REQUEST)
+        else:
+            response = await client.post("/find-credits/", json=PROFILE)
+        latencies.append(time.perf_counter() - start)
+        codes[response.status_code] = codes.get(response.status_code, 0) + 1
+
+
+async def _run_throughput(args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        token = (await client.post("/token/", data={"username": args.username, "password": args.password})).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        await client.post("/personal-data/", json=PROFILE)
+        await client.get("/currency-rates/")
+
+        latencies, codes = [], {}
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(
+            _throughput_client(client, args.endpoint, deadline, latencies, codes) for _ in range(args.concurrency)
+        ))
+
+    print(f"/{args.endpoint}/: {len(latencies) / args.duration:.1f} запросов/с при {args.concurrency} клиентах")
+    print(f"задержка: {percentiles(latencies)}, ответы: {codes}")
+
+
+def bench_throughput(args):
+    """
+    Пропускная способность CPU-нагруженных эндпоинтов. Запускать против
+    serve.py с разным WEB_CONCURRENCY, чтобы увидеть масштабирование по ядрам.
+    """
+    asyncio.run(_run_throughput(args))
+
+
+async def _run_batching(args):
+    from batching import InferenceBatcher
+    from inference import CompiledPipeline
+    from pycaret.classification import load_model
+
+    compiled = CompiledPipeline(load_model(args.model))
+    rows = load_dataset(args.csv)[BASE_FEATURES].sample(args.requests, random_state=0, replace=True).to_dict(orient="records")
+
+    async def concurrent(request):
+        queue = list(rows)
+        latencies = []
+
+        async def client():
+            while queue:
+                row = queue.pop()
+                start = time.perf_counter()
+                await request(row)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        return len(latencies) / (time.perf_counter() - start), latencies
+
+    async def one_by_one():
+        # Как раньше: каждый запрос — отдельный вызов модели в threadpool
+        async def request(row):
+            return await asyncio.to_thread(compiled.predict, pd.DataFrame([row], columns=BASE_FEATURES))
+        return await concurrent(request)
+
+    async def batched():
+        batcher = InferenceBatcher(compiled.predict, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+        batcher.start()
+        try:
+            return await concurrent(lambda row: batcher.predict([row])), batcher.stats()
+        finally:
+            await batcher.stop()
+
+    plain_rps, plain_lat = await one_by_one()
+    (batched_rps, batched_lat), stats = await batched()
+    print(f"по одному: {plain_rps:8.1f} строк/с, {percentiles(plain_lat)}")
+    print(f"пачками:   {batched_rps:8.1f} строк/с, {percentiles(batched_lat)}")
+    print(f"батчер: {stats}")
+
+
+def bench_batching(args):
+    """Микробатчинг против поштучного инференса при --concurrency одновременных запросах."""
+    asyncio.run(_run_batching(args))
+
+
+def bench_prediction_cache(args):
+    """Повторная оценка одного профиля по тем же кредитам: без кэша, холодный и тёплый кэш."""
+    from inference import CompiledPipeline
+    from prediction_cache import PredictionCache
+    from pycaret.classification import load_model
+    from scoring import build_candidate_features
+
+    compiled = CompiledPipeline(load_model(args.model))
+    candidates = load_dataset(args.csv).sample(args.rows, random_state=0, replace=True)
+
+    class Profile:
+        person_age = 30
+        person_home_ownership = "RENT"
+        person_emp_length = 5.0
+
+    def features():
+        return build_candidate_features(candidates, Profile, 40000.0)
+
+    cache = PredictionCache(maxsize=args.rows * 2)
+    expected = compiled.predict(features())
+    cold = compiled.predict(features()), cache.predict(compiled, features(), version=1)
+    for labels, scores in cold:
+        assert np.array_equal(labels, expected[0]) and np.array_equal(scores, expected[1]), "кэш меняет предсказания"
+
+    for name, fn in [("без кэша", lambda: compiled.predict(features())),
+                     ("тёплый кэш", lambda: cache.predict(compiled, features(), version=1))]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        print(f"{name:10s}: {np.median(timings) * 1000:8.2f} мс на {args.rows} строк")
+    print(f"кэш: {cache.stats()}")
+
+
+def bench_offers(args):
+    """BEST полным перебором против каталога: совпадение ответов и задержка."""
+    from types import SimpleNamespace
+
+    from offers import OfferCatalog
+    from resources import Resources
+    from scoring import best_per_intent, score_similar_credits
+
+    resources = Resources(args.model, args.csv)
+    resources.load()
+    catalog = OfferCatalog()
+    catalog.build(resources)
+    index, model = resources.credit_index, resources.compiled_model
+    clients = index.df.dropna(subset=["person_emp_length"]).sample(args.clients, random_state=0)
+
+    full_times, catalog_times, mismatches = [], [], 0
+    for row in clients.itertuples():
+        client = SimpleNamespace(person_age=int(row.person_age), person_home_ownership=row.person_home_ownership,
+                                 person_emp_length=int(row.person_emp_length))
+        income = float(row.person_income)
+        def candidates():
+            return index.find_similar(0, client.person_home_ownership, client.person_age - 5, client.person_age + 5,
+                                      income * 0.8, income)
+
+        start = time.perf_counter()
+        expected = best_per_intent(score_similar_credits(model, candidates(), client, income, args.rate))
+        full_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        candidates()  # эндпоинт ищет окно до выбора пути
+        offers = catalog.best_offers(model, resources, client, income, args.rate)
+        if offers is None:
+            offers = best_per_intent(score_similar_credits(model, candidates(), client, income, args.rate))
+        catalog_times.append(time.perf_counter() - start)
+        mismatches += offers != expected
+
+    print(f"полный перебор: {percentiles(full_times)}")
+    print(f"каталог:        {percentiles(catalog_times)}")
+    print(f"расхождений: {mismatches} из {len(clients)}; каталог: {catalog.stats()}")
+
+
+def bench_knn(args):
+    """k-NN по KD-дереву против окна CreditIndex: время запроса и размер ответа."""
+    from knn import CreditKNN
+
+    df = load_dataset(args.csv)
+    start = time.perf_counter()
+    knn = CreditKNN(df)
+    print(f"KD-дерево: {len(knn.positions)} строк за {(time.perf_counter() - start) * 1000:.1f} мс")
+    index = CreditIndex(df)
+    clients = df.dropna(subset=["person_emp_length"]).sample(args.clients, random_state=0)
+
+    knn_times, window_times, window_sizes = [], [], []
+    for row in clients.itertuples():
+        start = time.perf_counter()
+        knn.nearest(row.person_age, row.person_income, row.person_emp_length, row.person_home_ownership, args.k)
+        knn_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        window = index.similar_positions(0, row.person_home_ownership, row.person_age - 5, row.person_age + 5,
+                                         row.person_income * 0.8, row.person_income)
+        window_times.append(time.perf_counter() - start)
+        window_sizes.append(len(window))
+
+    print(f"knn (k={args.k}): {percentiles(knn_times)}")
+    print(f"окно:       {percentiles(window_times)}")
+    sizes = np.asarray(window_sizes)
+    print(f"размер окна: min {sizes.min()}, p50 {int(np.median(sizes))}, max {sizes.max()}, пустых {int((sizes == 0).sum())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бэкенда")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="Полный скан df против CreditIndex")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--queries", type=int, default=500)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_index)
+
+    p = sub.add_parser("parity", help="CompiledPipeline против predict_model: паритет и задержка")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--model", default="my_pipeline")
+    p.add_argument("--rows", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=100)
+    p.set_defaults(func=bench_parity)
+
+    p = sub.add_parser("login-flood", help="Задержка /currency-rates/ во время потока логинов")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--username", required=True)
+    p.add_argument("--password", required=True)
+    p.add_argument("--concurrency", type=int, default=50)
+    p.add_argument("--duration", type=float, default=10)
+    p.add_argument("--interval", type=float, default=0.05)
+    p.set_defaults(func=bench_login_flood)
+
+    p = sub.add_parser("startup", help="Время от запуска uvicorn до ответа /currency-rates/ и готовности")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--timeout", type=float, default=120)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("dataset", help="CSV против memory-mapped снимка: время загрузки и память")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=bench_dataset)
+
+    p = sub.add_parser("throughput", help="Запросов в секунду для /predict/ или /find-credits/")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--username", required=True)
+    p.add_argument("--password", required=True)
+    p.add_argument("--endpoint", choices=["predict", "find-credits"], default="predict")
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--duration", type=float, default=15)
+    p.set_defaults(func=bench_throughput)
+
+    p = sub.add_parser("batching", help="InferenceBatcher против поштучного вызова модели")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--model", default="my_pipeline")
+    p.add_argument("--requests", type=int, default=3000)
+    p.add_argument("--concurrency", type=int, default=64)
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--wait-ms", type=float, default=5)
+    p.set_defaults(func=bench_batching)
+
+    p = sub.add_parser("prediction-cache", help="Оценка кандидатов с кэшем предсказаний и без")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--model", default="my_pipeline")
+    p.add_argument("--rows", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_prediction_cache)
+
+    p = sub.add_parser("offers", help="filter_type=BEST: полный перебор против каталога предложений")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--model", default="my_pipeline")
+    p.add_argument("--clients", type=int, default=300)
+    p.add_argument("--rate", type=float, default=450.0, help="курс USD->KZT")
+    p.set_defaults(func=bench_offers)
+
+    p = sub.add_parser("knn", help="k-NN поиск похожих кредитов против окна CreditIndex")
+    p.add_argument("--csv", default="credit_risk_dataset.csv")
+    p.add_argument("--clients", type=int, default=2000)
+    p.add_argument("--k", type=int, default=20)
+    p.set_defaults(func=bench_knn)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
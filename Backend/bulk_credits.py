@@ -0,0 +1,255 @@
+"""
+Массовая загрузка и выгрузка кредитной истории.
+
+Импорт: CSV или NDJSON разбирается пачками по BULK_CHUNK_ROWS строк, пачки
+заливаются во временную таблицу credits_staging (на PostgreSQL — через
+COPY), затем одним INSERT ... SELECT ... ON CONFLICT (hash) DO NOTHING
+переносятся в credits. Уникальность hash проверяет сама БД в этом одном
+запросе, дубликаты и строки с несуществующим user_id пропускаются. Всё
+выполняется в одной транзакции: импорт либо применяется целиком, либо нет.
+
+Экспорт: COPY (SELECT ...) TO STDOUT в CSV, отдаётся потоком по мере чтения.
+
+На других БД (SQLite для разработки) вместо COPY используется executemany,
+остальная логика та же.
+
+    python bulk_credits.py import credits.csv
+    python bulk_credits.py import credits.ndjson --format ndjson
+    python bulk_credits.py export credits.csv
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+from typing import AsyncIterator, Iterable, Iterator
+
+from sqlalchemy import text
+
+from models import async_engine
+
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "10000"))
+# Сколько ошибок разбора возвращать в ответе (считаются все)
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "100"))
+
+COLUMNS = ("user_id", "loan_amount", "interest_rate", "term_months", "status", "hash")
+DEFAULT_STATUS = "на рассмотрении"
+STAGING_TABLE = "credits_staging"
+
+_STAGING_DDL = f"""
+CREATE TEMPORARY TABLE {STAGING_TABLE} (
+    user_id INTEGER,
+    loan_amount DOUBLE PRECISION,
+    interest_rate DOUBLE PRECISION,
+    term_months INTEGER,
+    status VARCHAR,
+    hash VARCHAR NOT NULL
+)
+"""
+_EXISTING_USER = "s.user_id IS NULL OR EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id)"
+_MERGE = f"""
+INSERT INTO credits ({", ".join(COLUMNS)})
+SELECT {", ".join("s." + c for c in COLUMNS)} FROM {STAGING_TABLE} s
+WHERE {_EXISTING_USER}
+ON CONFLICT (hash) DO NOTHING
+"""
+_UNKNOWN_USERS = f"SELECT count(*) FROM {STAGING_TABLE} s WHERE NOT ({_EXISTING_USER})"
+_EXPORT = f"SELECT id, {', '.join(COLUMNS)} FROM credits ORDER BY id"
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+def detect_format(filename: str = None, content_type: str = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    raise BulkFormatError("Не удалось определить формат: укажите format=csv или format=ndjson")
+
+
+def _optional_int(value):
+    return None if value in (None, "") else int(float(value))
+
+
+def to_record(item: dict) -> tuple:
+    """Строка входного файла -> кортеж в порядке COLUMNS. Лишние поля игнорируются."""
+    credit_hash = str(item.get("hash") or "").strip()
+    if not credit_hash:
+        raise ValueError("пустой hash")
+    return (
+        _optional_int(item.get("user_id")),
+        float(item["loan_amount"]),
+        float(item["interest_rate"]),
+        _optional_int(item["term_months"]),
+        str(item.get("status") or DEFAULT_STATUS),
+        credit_hash,
+    )
+
+
+def iter_items(lines: Iterable[str], fmt: str) -> Iterator[tuple]:
+    """
+    (номер строки, dict) для каждой записи файла. Файл не в UTF-8 или
+    нечитаемый CSV — BulkFormatError: такой файл не импортируется целиком.
+    """
+    line_num = 0
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(lines)
+            for item in reader:
+                line_num = reader.line_num
+                yield line_num, item
+        elif fmt == "ndjson":
+            for line_num, line in enumerate(lines, start=1):
+                if line.strip():
+                    try:
+                        yield line_num, json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield line_num, e
+        else:
+            raise BulkFormatError(f"Неизвестный формат: {fmt}")
+    except UnicodeDecodeError as e:
+        raise BulkFormatError(f"Файл не в кодировке UTF-8 (после строки {line_num}): {e}")
+    except csv.Error as e:
+        raise BulkFormatError(f"Не удалось прочитать CSV после строки {line_num}: {e}")
+
+
+def iter_batches(lines: Iterable[str], fmt: str, size: int = BULK_CHUNK_ROWS) -> Iterator[tuple]:
+    """Пачки (records, errors); errors — [(номер строки, текст ошибки)]."""
+    records, errors = [], []
+    for line_num, item in iter_items(lines, fmt):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            records.append(to_record(item))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            errors.append((line_num, f"{type(e).__name__}: {e}"))
+        if len(records) >= size:
+            yield records, errors
+            records, errors = [], []
+    if records or errors:
+        yield records, errors
+
+
+async def _copy_batch(conn, records: list):
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        # asyncpg-соединение уже внутри транзакции SQLAlchemy
+        await raw.driver_connection.copy_records_to_table(STAGING_TABLE, records=records, columns=COLUMNS)
+    else:
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        await conn.exec_driver_sql(f"INSERT INTO {STAGING_TABLE} ({', '.join(COLUMNS)}) VALUES ({placeholders})", records)
+
+
+async def import_credits(lines: Iterable[str], fmt: str, engine=async_engine) -> dict:
+    """
+    Загружает кредиты из строк CSV/NDJSON. Разбор идёт в пуле потоков,
+    чтобы не держать event loop на больших файлах. Если файл не читается
+    (BulkFormatError), транзакция откатывается и ничего не импортируется.
+    """
+    batches = iter_batches(lines, fmt)
+    received, invalid, errors = 0, 0, []
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        await conn.exec_driver_sql(_STAGING_DDL)
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            records, batch_errors = batch
+            invalid += len(batch_errors)
+            errors.extend(batch_errors[:BULK_MAX_ERRORS - len(errors)])
+            if records:
+                await _copy_batch(conn, records)
+                received += len(records)
+
+        inserted = (await conn.exec_driver_sql(_MERGE)).rowcount
+        unknown_users = (await conn.exec_driver_sql(_UNKNOWN_USERS)).scalar()
+        await conn.exec_driver_sql(f"DROP TABLE {STAGING_TABLE}")
+
+    return {
+        "received": received,
+        "inserted": inserted,
+        "duplicates": received - inserted - unknown_users,
+        "unknown_user": unknown_users,
+        "invalid": invalid,
+        "errors": [{"line": line, "error": error} for line, error in errors],
+    }
+
+
+async def export_credits(engine=async_engine) -> AsyncIterator[bytes]:
+    """CSV с заголовком по всей таблице credits, кусками по мере чтения."""
+    async with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            raw = await conn.get_raw_connection()
+            chunks: asyncio.Queue = asyncio.Queue(maxsize=16)
+            done = object()
+
+            async def copy():
+                try:
+                    await raw.driver_connection.copy_from_query(_EXPORT, output=chunks.put, format="csv", header=True)
+                finally:
+                    await chunks.put(done)
+
+            task = asyncio.create_task(copy())
+            try:
+                while (chunk := await chunks.get()) is not done:
+                    yield chunk
+                await task
+            finally:
+                task.cancel()
+            return
+
+        result = await conn.stream(text(_EXPORT))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(("id",) + COLUMNS)
+        async for rows in result.partitions(BULK_CHUNK_ROWS):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+
+async def _cli_import(path: str, fmt: str):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        stats = await import_credits(f, fmt)
+    await async_engine.dispose()
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+async def _cli_export(path: str):
+    out = sys.stdout.buffer if path == "-" else open(path, "wb")
+    try:
+        async for chunk in export_credits():
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт/экспорт кредитной истории")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="загрузить CSV/NDJSON в credits")
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=["csv", "ndjson"])
+    p_export = sub.add_parser("export", help="выгрузить credits в CSV")
+    p_export.add_argument("path", nargs="?", default="-")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        try:
+            asyncio.run(_cli_import(args.path, args.format or detect_format(args.path)))
+        except BulkFormatError as e:
+            sys.exit(f"[⚠️] {e}")
+    else:
+        asyncio.run(_cli_export(args.path))
+
+
+if __name__ == "__main__":
+    main()
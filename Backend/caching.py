@@ -0,0 +1,120 @@
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением по размеру и необязательным TTL.
+    Считает попадания, промахи и вытеснения.
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def get_many(self, keys) -> list:
+        """get для списка ключей под одной блокировкой; для отсутствующих — None."""
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is not None:
+                    value, expires_at = item
+                    if expires_at is None or expires_at > now:
+                        self._data.move_to_end(key)
+                        self.hits += 1
+                        values.append(value)
+                        continue
+                    del self._data[key]
+                self.misses += 1
+                values.append(None)
+        return values
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def discard_where(self, predicate) -> int:
+        """Удаляет все записи, для значений которых predicate(value) истинно."""
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class SharedGenerations:
+    """
+    Счётчики поколений в общей памяти процессов, по одному на корзину
+    целочисленных ключей. Запись кэша запоминает поколение своего ключа и
+    считается устаревшей, как только bump(key) увеличит его в любом процессе.
+
+    Память общая для процессов, форкнутых после создания объекта (воркеры
+    serve.py); для независимо запущенных процессов счётчики свои.
+    """
+
+    def __init__(self, slots: int = 4096):
+        self._counters = multiprocessing.Array("Q", slots)
+        # Чтение без блокировки: 64-битное слово читается целиком
+        self._values = self._counters.get_obj()
+
+    def _slot(self, key: int) -> int:
+        return int(key) % len(self._values)
+
+    def get(self, key: int) -> int:
+        return self._values[self._slot(key)]
+
+    def bump(self, key: int):
+        with self._counters.get_lock():
+            self._values[self._slot(key)] += 1
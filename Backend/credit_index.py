@@ -0,0 +1,79 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+
+class CreditIndex:
+    """
+    Индекс по датасету кредитов, строится один раз при старте.
+
+    Строки разбиты на партиции по (loan_status, person_home_ownership),
+    внутри партиции отсортированы по (person_age, person_income).
+    Диапазоны по возрасту и доходу находятся бинарным поиском,
+    поэтому стоимость запроса зависит от размера ответа, а не датасета.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._by_status = {}
+        self._partitions = {}
+
+        statuses = df["loan_status"].to_numpy()
+        for status in pd.unique(statuses[~pd.isna(statuses)]):
+            self._by_status[int(status)] = np.flatnonzero(statuses == status)
+
+        # Для поиска похожих нужны только строки с известным стажем и возрастом
+        usable = df[df["person_emp_length"].notnull() & df["person_age"].notnull() & df["loan_status"].notnull()]
+        for (status, ownership), part in usable.groupby(["loan_status", "person_home_ownership"], sort=False, observed=True):
+            ages = part["person_age"].to_numpy(dtype=float)
+            incomes = part["person_income"].to_numpy(dtype=float)
+            order = np.lexsort((incomes, ages))
+            ages, incomes = ages[order], incomes[order]
+            positions = df.index.get_indexer(part.index)[order]
+
+            group_ages, group_starts = np.unique(ages, return_index=True)
+            group_ends = np.append(group_starts[1:], len(ages))
+            self._partitions[(int(status), ownership)] = (group_ages, group_starts, group_ends, incomes, positions)
+
+    def home_ownerships(self, loan_status: int) -> list:
+        return [ownership for status, ownership in self._partitions if status == loan_status]
+
+    def bounds(self, loan_status: int, home_ownership: str):
+        """(мин. возраст, макс. возраст, мин. доход, макс. доход) в партиции."""
+        group_ages, _, _, incomes, _ = self._partitions[(loan_status, home_ownership)]
+        return group_ages[0], group_ages[-1], incomes.min(), incomes.max()
+
+    def find_similar(self, loan_status: int, home_ownership: str, age_min, age_max, income_min, income_max) -> pd.DataFrame:
+        """Аналог маски between(...) по возрасту и доходу; порядок строк как в исходном df."""
+        positions = self.similar_positions(loan_status, home_ownership, age_min, age_max, income_min, income_max)
+        return self.df.iloc[positions]
+
+    def similar_positions(self, loan_status: int, home_ownership: str, age_min, age_max, income_min, income_max) -> np.ndarray:
+        """Позиции (iloc) строк find_similar по возрастанию."""
+        partition = self._partitions.get((loan_status, home_ownership))
+        if partition is None:
+            return np.empty(0, dtype=np.intp)
+
+        group_ages, group_starts, group_ends, incomes, positions = partition
+        first = np.searchsorted(group_ages, age_min, side="left")
+        last = np.searchsorted(group_ages, age_max, side="right")
+
+        chunks = []
+        for start, end in zip(group_starts[first:last], group_ends[first:last]):
+            group_incomes = incomes[start:end]
+            lo = start + np.searchsorted(group_incomes, income_min, side="left")
+            hi = start + np.searchsorted(group_incomes, income_max, side="right")
+            if hi > lo:
+                chunks.append(positions[lo:hi])
+
+        if not chunks:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(chunks))
+
+    def sample(self, loan_status: int):
+        """Случайная строка с заданным loan_status (None, если таких нет)."""
+        positions = self._by_status.get(loan_status)
+        if positions is None or len(positions) == 0:
+            return None
+        return self.df.iloc[positions[random.randrange(len(positions))]]
@@ -0,0 +1,143 @@
+"""
+Бинарный снимок датасета кредитов.
+
+CSV один раз переводится в каталог с .npy-файлом на каждую колонку:
+строковые колонки хранятся как категориальные коды (int8), целые —
+в минимальном подходящем типе. Дробные колонки остаются float64, чтобы
+входы модели и ответы API не менялись.
+
+На старте файлы открываются через np.load(mmap_mode="r"), поэтому CSV не
+парсится, а все процессы на машине читают одну копию из page cache.
+
+    python dataset.py [--csv credit_risk_dataset.csv] [--out credit_dataset]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CREDIT_SNAPSHOT_DIR = os.getenv("CREDIT_SNAPSHOT_DIR", "credit_dataset")
+SNAPSHOT_VERSION = 1
+META_FILE = "meta.json"
+
+
+def _source_stamp(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _compact_column(series: pd.Series):
+    """(массив, описание колонки) для записи в снимок."""
+    if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series.dtype):
+        categorical = pd.Categorical(series)
+        codes = np.asarray(categorical.codes)
+        if len(categorical.categories) < np.iinfo(np.int8).max:
+            codes = codes.astype(np.int8)
+        return codes, {"kind": "categorical", "categories": [str(c) for c in categorical.categories]}
+
+    values = series.to_numpy()
+    if pd.api.types.is_integer_dtype(series.dtype):
+        values = pd.to_numeric(series, downcast="integer").to_numpy()
+    return values, {"kind": "numeric"}
+
+
+def build_snapshot(csv_path: str, out_dir: str = CREDIT_SNAPSHOT_DIR) -> str:
+    """
+    Собирает снимок из CSV. Пишет во временный каталог и подменяет
+    out_dir одним переименованием, чтобы параллельные процессы не увидели
+    недописанный снимок.
+    """
+    df = pd.read_csv(csv_path)
+    df["loan_status"] = pd.to_numeric(df["loan_status"], errors="coerce")
+
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=".snapshot-", dir=parent)
+    columns = []
+    for name in df.columns:
+        values, info = _compact_column(df[name])
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), values, allow_pickle=False)
+        columns.append({"name": name, "dtype": str(values.dtype), **info})
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "rows": len(df),
+        "source": os.path.basename(csv_path),
+        "source_stamp": _source_stamp(csv_path),
+        "columns": columns,
+    }
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # Процессы, уже открывшие старый снимок, продолжают читать свои файлы
+    old_dir = None
+    if os.path.isdir(out_dir):
+        old_dir = f"{out_dir}.old-{os.getpid()}"
+        try:
+            os.replace(out_dir, old_dir)
+        except OSError:
+            old_dir = None
+    try:
+        os.replace(tmp_dir, out_dir)
+    except OSError:
+        # Другой процесс успел положить свой снимок раньше
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"✅ Снимок датасета собран: {out_dir} ({len(df)} строк)")
+    return out_dir
+
+
+def _read_meta(snapshot_dir: str):
+    try:
+        with open(os.path.join(snapshot_dir, META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_is_fresh(csv_path: str, snapshot_dir: str = CREDIT_SNAPSHOT_DIR) -> bool:
+    """Снимок есть, формат текущий и собран из этой версии CSV (если CSV рядом)."""
+    meta = _read_meta(snapshot_dir)
+    if meta is None or meta.get("version") != SNAPSHOT_VERSION:
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return meta.get("source_stamp") == _source_stamp(csv_path)
+
+
+def open_snapshot(snapshot_dir: str = CREDIT_SNAPSHOT_DIR) -> pd.DataFrame:
+    """DataFrame поверх memory-mapped колонок снимка (только для чтения, без копий)."""
+    meta = _read_meta(snapshot_dir)
+    if meta is None:
+        raise FileNotFoundError(f"Снимок датасета не найден: {snapshot_dir}")
+
+    data = {}
+    for column in meta["columns"]:
+        values = np.load(os.path.join(snapshot_dir, f"{column['name']}.npy"), mmap_mode="r", allow_pickle=False)
+        if column["kind"] == "categorical":
+            values = pd.Categorical.from_codes(values, categories=pd.Index(column["categories"], dtype=object))
+        data[column["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def load_credit_dataset(csv_path: str, snapshot_dir: str = CREDIT_SNAPSHOT_DIR) -> pd.DataFrame:
+    """Открывает снимок, при необходимости пересобрав его из CSV."""
+    if not snapshot_is_fresh(csv_path, snapshot_dir):
+        build_snapshot(csv_path, snapshot_dir)
+    return open_snapshot(snapshot_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка бинарного снимка датасета кредитов")
+    parser.add_argument("--csv", default=os.getenv("CREDIT_CSV_PATH", "credit_risk_dataset.csv"))
+    parser.add_argument("--out", default=CREDIT_SNAPSHOT_DIR)
+    args = parser.parse_args()
+    build_snapshot(args.csv, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
-from models import Base, engine, SessionLocal, User
+import asyncio
+
+from migrations import upgrade
+from models import engine, SessionLocal, User, async_engine, AsyncSessionLocal
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
 
@@ -8,10 +13,9 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
-# Функция для создания таблиц в базе данных
+# Функция для создания таблиц в базе данных: применяет недостающие миграции
 def create_tables():
-    Base.metadata.create_all(bind=engine)
-    print("Таблицы успешно созданы!")
+    upgrade(engine)
 
 # Функция для добавления администратора
 def create_admin():
@@ -35,6 +39,59 @@ def create_admin():
 
     session.close()
 
+# Асинхронный вариант для старта приложения: ожидание БД не блокирует event loop
+async def wait_for_db(max_attempts: int = 10, delay: int = 2):
+    print("⏳ Проверка готовности БД...")
+    for attempt in range(max_attempts):
+        try:
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            print("✅ База данных готова к подключению")
+            return
+        except (OperationalError, OSError):
+            print(f"⏳ Попытка {attempt + 1}/{max_attempts} неудачна, пробуем снова через {delay} сек...")
+            await asyncio.sleep(delay)
+    raise RuntimeError("❌ Не удалось подключиться к базе данных. Проверь настройки и доступность PostgreSQL.")
+
+
+async def create_admin_async(hash_fn):
+    """То же, что create_admin; hash_fn — корутина хеширования (пул bcrypt)."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(User.id).where(User.username == "admin"))
+        if result.first():
+            print("Администратор уже существует!")
+            return
+        session.add(User(
+            username="admin",
+            password=await hash_fn("admin"),
+            is_admin=True,
+            email="admin@example.com",
+            email_confirmed=True
+        ))
+        await session.commit()
+        print("Администратор успешно создан!")
+
+
+_bootstrapped = False
+
+
+async def bootstrap_db(hash_fn):
+    """
+    Один раз на старте: дождаться БД, применить миграции и создать администратора.
+    Воркеры serve.py наследуют флаг от мастера и пропускают этот шаг.
+    """
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    await wait_for_db()
+    try:
+        # Миграции идут через синхронный движок: CREATE INDEX CONCURRENTLY нужен autocommit
+        await asyncio.to_thread(upgrade, engine)
+        await create_admin_async(hash_fn)
+    except Exception as e:
+        print(f"[⚠️] Ошибка инициализации БД: {e}")
+    _bootstrapped = True
+
 # Запуск скрипта
 if __name__ == "__main__":
     create_tables()
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+# Исходные признаки заявки, в порядке обучения пайплайна
+BASE_FEATURES = [
+    "person_age",
+    "person_income",
+    "person_home_ownership",
+    "person_emp_length",
+    "loan_intent",
+    "loan_grade",
+    "loan_amnt",
+    "loan_int_rate",
+    "loan_percent_income",
+    "cb_person_default_on_file",
+    "cb_person_cred_hist_length",
+]
+
+# Признаки, которые досчитываются перед подачей в пайплайн
+ENGINEERED_FEATURES = [
+    "loan_to_income_ratio",
+    "loan_to_emp_length_ratio",
+    "int_rate_to_loan_amt_ratio",
+    "adjusted_age",
+]
+
+MODEL_FEATURES = BASE_FEATURES + ENGINEERED_FEATURES
+
+# Целевая колонка датасета; на инференсе её нет
+TARGET = "loan_status"
+
+
+def add_engineered_features(frame: pd.DataFrame) -> pd.DataFrame:
+    """Досчитывает инженерные признаки сразу для всех строк (изменяет frame)."""
+    loan_amnt = frame["loan_amnt"].to_numpy(dtype=float)
+    frame["loan_to_income_ratio"] = loan_amnt / frame["person_income"].to_numpy(dtype=float)
+    frame["loan_to_emp_length_ratio"] = loan_amnt / (frame["person_emp_length"].to_numpy(dtype=float) + 1)
+    frame["int_rate_to_loan_amt_ratio"] = frame["loan_int_rate"].to_numpy(dtype=float) / loan_amnt
+    frame["adjusted_age"] = np.log1p(frame["person_age"].to_numpy(dtype=float))
+    return frame
+
+
+# Поля анкеты клиента (PersonalData): доход в KZT в месяц
+PERSON_FIELDS = ["person_age", "person_income", "person_home_ownership", "person_emp_length"]
+
+
+def application_row(data: dict, person: dict, usd_to_kzt: float) -> dict:
+    """
+    Строка BASE_FEATURES для заявки, как её собирает /predict/: доход клиента
+    из KZT/мес в USD/год, сумма кредита (loan_amount или loan_amnt) из
+    currency в USD. ValueError без суммы или с currency не USD/KZT.
+    """
+    annual_income_usd = person["person_income"] * 12 / usd_to_kzt
+    loan_amount = data.get("loan_amount") or data.get("loan_amnt")
+    if loan_amount is None:
+        raise ValueError("нужна сумма кредита loan_amount")
+
+    currency = str(data.get("currency") or "").upper()
+    if currency == "KZT":
+        annual_loan_usd = loan_amount / usd_to_kzt
+    elif currency == "USD":
+        annual_loan_usd = loan_amount
+    else:
+        raise ValueError("currency должен быть USD или KZT")
+
+    return {
+        "person_age": person["person_age"],
+        "person_income": annual_income_usd,
+        "person_home_ownership": person["person_home_ownership"],
+        "person_emp_length": person["person_emp_length"],
+        "loan_intent": data.get("loan_intent"),
+        "loan_grade": data.get("loan_grade"),
+        "loan_amnt": annual_loan_usd,
+        "loan_int_rate": data.get("loan_int_rate"),
+        "loan_percent_income": annual_loan_usd / annual_income_usd,
+        "cb_person_default_on_file": data.get("cb_person_default_on_file", "N"),
+        "cb_person_cred_hist_length": data.get("cb_person_cred_hist_length", 1),
+    }
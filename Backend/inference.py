@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from features import ENGINEERED_FEATURES, MODEL_FEATURES, TARGET, add_engineered_features
+
+
+class CompiledPipeline:
+    """
+    Облегчённый инференс по обученному пайплайну pycaret без predict_model.
+
+    Шаги препроцессинга вызываются напрямую (без копирования данных,
+    проверок колонок и логирования predict_model), а обученная модель
+    получает готовую numpy-матрицу.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        # train-only шаги (например, балансировка) на инференсе не применяются
+        self.steps = [step for _, step in pipeline.steps[:-1] if not getattr(step, "_train_only", False)]
+        self.estimator = pipeline.named_steps["trained_model"]
+        # pycaret обучает пайплайн на данных вместе с целевой колонкой, и она есть в feature_names_in_
+        self.feature_names = [name for name in getattr(pipeline, "feature_names_in_", MODEL_FEATURES) if name != TARGET]
+        # Инженерные признаки считаются, только если пайплайн на них обучен (my_pipeline.pkl — нет)
+        self.engineered = any(name in ENGINEERED_FEATURES for name in self.feature_names)
+        self.classes = np.asarray(self.estimator.classes_)
+
+    def model_input(self, raw: pd.DataFrame) -> pd.DataFrame:
+        """Сырые заявки -> колонки, которые получает пайплайн, в порядке его обучения."""
+        if self.engineered:
+            raw = add_engineered_features(raw)
+        return raw[self.feature_names]
+
+    def transform_input(self, X: pd.DataFrame) -> pd.DataFrame:
+        for step in self.steps:
+            X = step.transform(X)
+        return X
+
+    def transform(self, raw: pd.DataFrame) -> pd.DataFrame:
+        """Сырые заявки -> признаки на входе модели (аналог pipeline.transform)."""
+        return self.transform_input(self.model_input(raw))
+
+    def predict_proba(self, raw: pd.DataFrame) -> np.ndarray:
+        return self.estimator.predict_proba(np.asarray(self.transform(raw), dtype=float))
+
+    def predict(self, raw: pd.DataFrame):
+        """Возвращает (labels, scores) так же, как prediction_label/prediction_score у predict_model."""
+        return self.predict_input(self.model_input(raw))
+
+    def predict_input(self, X: pd.DataFrame):
+        """predict по уже посчитанному model_input."""
+        proba = self.estimator.predict_proba(np.asarray(self.transform_input(X), dtype=float))
+        best = proba.argmax(axis=1)
+        return self.classes[best], np.round(proba[np.arange(len(best)), best], 4)
+
+
+def check_parity(pipeline, raw: pd.DataFrame) -> int:
+    """
+    Сверяет CompiledPipeline с predict_model на одних и тех же заявках.
+    Возвращает число строк; при расхождении бросает AssertionError.
+    """
+    from pycaret.classification import predict_model
+
+    labels, scores = CompiledPipeline(pipeline).predict(raw.copy())
+    reference = predict_model(pipeline, data=add_engineered_features(raw.copy()), verbose=False)
+
+    expected_labels = reference["prediction_label"].to_numpy()
+    expected_scores = reference["prediction_score"].to_numpy(dtype=float)
+
+    mismatched = np.flatnonzero(labels != expected_labels)
+    if len(mismatched):
+        raise AssertionError(f"Метки расходятся в {len(mismatched)} строках, например {mismatched[:5].tolist()}")
+    if not np.allclose(scores, expected_scores, rtol=0, atol=1e-9):
+        worst = np.abs(scores - expected_scores).max()
+        raise AssertionError(f"Скоры расходятся, максимальная разница {worst}")
+    return len(raw)
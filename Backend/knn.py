@@ -0,0 +1,73 @@
+"""
+Поиск k ближайших кредитов для /find-credits/?mode=knn.
+
+Вместо жёстких фильтров по возрасту, доходу и типу жилья (окно, размер
+которого скачет от нуля до тысяч строк) берутся ровно k погашенных
+кредитов, заёмщики которых ближе всего к клиенту. Признаки заёмщика
+нормируются (z-оценка; доход в логарифме), тип жилья кодируется one-hot
+с весом KNN_OWNERSHIP_WEIGHT: другой тип жилья — это примерно такое же
+расхождение, как KNN_OWNERSHIP_WEIGHT стандартных отклонений по возрасту.
+
+Индекс — KD-дерево (scipy cKDTree), строится один раз вместе с CreditIndex.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+KNN_K_DEFAULT = int(os.getenv("KNN_K_DEFAULT", "20"))
+KNN_K_MAX = int(os.getenv("KNN_K_MAX", "500"))
+KNN_OWNERSHIP_WEIGHT = float(os.getenv("KNN_OWNERSHIP_WEIGHT", "1.0"))
+
+NUMERIC_FEATURES = ["person_age", "person_income", "person_emp_length"]
+
+
+class CreditKNN:
+    def __init__(self, df: pd.DataFrame, loan_status: int = 0, ownership_weight: float = KNN_OWNERSHIP_WEIGHT):
+        self.df = df
+        self.ownership_weight = ownership_weight
+
+        usable = (
+            (df["loan_status"] == loan_status)
+            & df[NUMERIC_FEATURES].notnull().all(axis=1)
+            & (df["person_income"] > 0)
+        ).to_numpy()
+        self.positions = np.flatnonzero(usable)
+        numeric = self._numeric(
+            df["person_age"].to_numpy(dtype=float)[usable],
+            df["person_income"].to_numpy(dtype=float)[usable],
+            df["person_emp_length"].to_numpy(dtype=float)[usable],
+        )
+        self.mean = numeric.mean(axis=0)
+        self.std = numeric.std(axis=0)
+        self.std[self.std == 0] = 1.0
+
+        ownership = df["person_home_ownership"].to_numpy()[usable].astype(str)
+        self.ownerships = sorted(set(ownership.tolist()))
+        one_hot = (ownership[:, None] == np.array(self.ownerships)[None, :]).astype(float)
+        self.tree = cKDTree(np.hstack([(numeric - self.mean) / self.std, one_hot * self.ownership_weight]))
+
+    @staticmethod
+    def _numeric(age, income, emp_length) -> np.ndarray:
+        return np.column_stack([age, np.log(income), emp_length])
+
+    def _point(self, age: float, income_usd: float, emp_length: float, home_ownership: str) -> np.ndarray:
+        numeric = (self._numeric([age], [max(income_usd, 1.0)], [emp_length])[0] - self.mean) / self.std
+        # Неизвестный тип жилья одинаково далёк от всех известных
+        one_hot = np.array([ownership == home_ownership for ownership in self.ownerships], dtype=float)
+        return np.concatenate([numeric, one_hot * self.ownership_weight])
+
+    def nearest(self, age: float, income_usd: float, emp_length: float, home_ownership: str, k: int = KNN_K_DEFAULT):
+        """(позиции в df, расстояния) для k ближайших, по возрастанию расстояния."""
+        k = min(k, len(self.positions))
+        if k == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        distances, idx = self.tree.query(self._point(age, income_usd, emp_length, home_ownership), k=k)
+        return self.positions[np.atleast_1d(idx)], np.atleast_1d(distances)
+
+    def find_nearest(self, age: float, income_usd: float, emp_length: float, home_ownership: str,
+                     k: int = KNN_K_DEFAULT) -> pd.DataFrame:
+        """Строки df для k ближайших с колонкой knn_distance, от ближнего к дальнему."""
+        positions, distances = self.nearest(age, income_usd, emp_length, home_ownership, k)
+        return self.df.iloc[positions].assign(knn_distance=np.round(distances, 4))
@@ -0,0 +1,510 @@
+"""
+Нагрузочный тест сервиса с локальными заменами внешних зависимостей.
+
+Поднимает сервер (serve.py или uvicorn) на SQLite во временном каталоге или
+на переданной PostgreSQL, с заглушкой openexchangerates и SMTP-приёмником
+в этом же процессе. Регистрирует пользователя, подтверждает почту по ссылке
+из пойманного письма и гоняет смесь запросов /token/, /predict/,
+/find-credits/, /explain/image и /currency-rates/ на каждом уровне
+параллельности. Затем, уже без сервера, меряет скоринг и SHAP напрямую.
+
+Результат — p50/p95/p99 и запросов в секунду по каждому эндпоинту, плюс
+JSON-файл, который можно сравнить с прогоном на другом коммите:
+
+    python loadtest.py run [--concurrency 1,8,32] [--duration 20] [--workers 1]
+                           [--mix token=1,predict=6,find-credits=2,explain-image=1,currency-rates=4]
+                           [--database-url postgresql://...] [--out loadtest.json]
+    python loadtest.py compare old.json new.json [--threshold 10]
+"""
+import argparse
+import asyncio
+import email
+import http.server
+import json
+import os
+import platform
+import random
+import re
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from benchmarks import PREDICT_REQUEST, PROFILE, percentiles
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = "token=1,predict=6,find-credits=2,explain-image=1,currency-rates=4"
+STUB_RATES = {"USD": 1.0, "EUR": 0.92, "RUB": 90.5, "KZT": 470.0}
+
+
+# --- локальные замены внешних сервисов ---
+
+class RatesStub(http.server.ThreadingHTTPServer):
+    """Отвечает на любой GET так же, как openexchangerates /latest.json."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.requests = 0
+
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                body = json.dumps({"base": "USD", "timestamp": int(time.time()), "rates": STUB_RATES}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api/latest.json"
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Минимальный SMTP-сервер: принимает письма без авторизации и складывает их в messages."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                self.reply("220 loadtest sink")
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors="replace").strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.reply("250 loadtest sink")
+                    elif command.startswith("RCPT"):
+                        recipients.append(line.decode().split(":", 1)[1].strip().strip("<>"))
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        for chunk in iter(self.rfile.readline, b""):
+                            if chunk in (b".\r\n", b".\n"):
+                                break
+                            data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                        with sink.lock:
+                            sink.messages.append((recipients, email.message_from_bytes(b"".join(data))))
+                        recipients = []
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    elif command.startswith(("MAIL", "RSET", "NOOP")):
+                        if command.startswith("RSET"):
+                            recipients = []
+                        self.reply("250 OK")
+                    else:
+                        self.reply("502 Command not implemented")
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def find_body(self, to_email: str):
+        with self.lock:
+            for recipients, message in reversed(self.messages):
+                if to_email in recipients:
+                    return message.get_payload(decode=True).decode(message.get_content_charset() or "utf-8")
+        return None
+
+
+def _serve_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- сервер ---
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir: str, rates: RatesStub, smtp: SmtpSink):
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+        # async-URL models.py выведет из DATABASE_URL
+        env.pop("ASYNC_DATABASE_URL", None)
+    else:
+        db_path = os.path.join(workdir, "loadtest.db")
+        env["DATABASE_URL"] = f"sqlite:///{db_path}"
+        env["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    env.update({
+        "OPEN_EXCHANGE_URL": rates.url,
+        "OPEN_EXCHANGE_APP_ID": "loadtest",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_STARTTLS": "0",
+        "EMAIL_USER": "loadtest@localhost",
+        "EMAIL_PASSWORD": "",
+        "OUTBOX_POLL_INTERVAL": "0.2",
+    })
+
+    port = args.port or _free_port()
+    if args.server == "serve":
+        cmd = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    log_path = os.path.join(workdir, "server.log")
+    log = open(log_path, "w")
+    process = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}", log_path
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def wait_ready(client, process, timeout: float, log_path: str):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}, лог: {log_path}")
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Сервер не стал готов за {timeout:.0f} сек, лог: {log_path}")
+
+
+async def prepare_user(client, smtp: SmtpSink) -> dict:
+    """Регистрация, подтверждение почты по ссылке из письма, анкета и курс валют."""
+    username = f"loadtest_{os.getpid()}_{int(time.time())}"
+    password = "loadtest-password"
+    address = f"{username}@loadtest.local"
+    response = await client.post("/register/", data={"username": username, "password": password, "email": address})
+    response.raise_for_status()
+
+    deadline = time.monotonic() + 30
+    while (body := smtp.find_body(address)) is None:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Письмо с подтверждением не пришло в SMTP-приёмник")
+        await asyncio.sleep(0.1)
+    token = re.search(r"token=([\w\-.]+)", body).group(1)
+    (await client.get("/confirm-email/", params={"token": token})).raise_for_status()
+
+    response = await client.post("/token/", data={"username": username, "password": password})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    (await client.post("/personal-data/", json=PROFILE, headers=headers)).raise_for_status()
+    (await client.get("/currency-rates/")).raise_for_status()
+    return {"username": username, "password": password, "headers": headers}
+
+
+# --- нагрузка ---
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in REQUESTS:
+            raise SystemExit(f"Неизвестный эндпоинт в --mix: {name} (есть: {', '.join(REQUESTS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _explain_payload(rng: random.Random) -> dict:
+    # Небольшой набор анкет: часть картинок приходит из кэша, часть рендерится
+    variant = rng.randrange(20)
+    return {
+        "person_age": 25 + variant, "person_income": 40000 + 1000 * variant, "person_home_ownership": "RENT",
+        "person_emp_length": 5, "loan_intent": "EDUCATION", "loan_grade": "B", "loan_amnt": 5000 + 250 * variant,
+        "loan_int_rate": 11.5, "loan_percent_income": 0.12, "cb_person_default_on_file": False,
+        "cb_person_cred_hist_length": 4,
+    }
+
+
+REQUESTS = {
+    "token": lambda client, user, rng: client.post(
+        "/token/", data={"username": user["username"], "password": user["password"]}),
+    "predict": lambda client, user, rng: client.post(
+        "/predict/", json={**PREDICT_REQUEST, "loan_amount": 1000 + 500 * rng.randrange(40)}, headers=user["headers"]),
+    "find-credits": lambda client, user, rng: client.post(
+        "/find-credits/", json={**PROFILE, "person_age": 25 + rng.randrange(20)}, headers=user["headers"]),
+    "explain-image": lambda client, user, rng: client.post(
+        "/explain/image", json=_explain_payload(rng), headers=user["headers"]),
+    "currency-rates": lambda client, user, rng: client.get("/currency-rates/"),
+}
+
+
+async def run_level(client, user: dict, mix: dict, concurrency: int, duration: float, seed: int) -> dict:
+    names, weights = list(mix), list(mix.values())
+    latencies = {name: [] for name in names}
+    codes = {name: {} for name in names}
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = (await REQUESTS[name](client, user, rng)).status_code
+            except Exception as e:
+                status = e.__class__.__name__
+            latencies[name].append(time.perf_counter() - start)
+            codes[name][str(status)] = codes[name].get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name in names:
+        ok = sum(count for status, count in codes[name].items() if status.startswith("2"))
+        endpoints[name] = {
+            **percentiles(latencies[name]),
+            "throughput": round(len(latencies[name]) / elapsed, 2),
+            "errors": sum(codes[name].values()) - ok,
+            "codes": codes[name],
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {"concurrency": concurrency, "seconds": round(elapsed, 2), "requests": total,
+            "throughput": round(total / elapsed, 2), "endpoints": endpoints}
+
+
+async def run_load(args) -> list:
+    import httpx
+
+    rates, smtp = _serve_in_thread(RatesStub()), _serve_in_thread(SmtpSink())
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    process, url, log_path = start_server(args, workdir, rates, smtp)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    mix = parse_mix(args.mix)
+    results = []
+    try:
+        limits = httpx.Limits(max_connections=max(levels) + 4, max_keepalive_connections=max(levels) + 4)
+        async with httpx.AsyncClient(base_url=url, timeout=args.request_timeout, limits=limits) as client:
+            await wait_ready(client, process, args.boot_timeout, log_path)
+            user = await prepare_user(client, smtp)
+            for level in levels:
+                if args.warmup:
+                    await run_level(client, user, mix, level, args.warmup, args.seed)
+                result = await run_level(client, user, mix, level, args.duration, args.seed)
+                results.append(result)
+                print_level(result)
+    finally:
+        stop_server(process)
+        rates.shutdown()
+        smtp.shutdown()
+    print(f"[i] запросов к заглушке курсов: {rates.requests}, писем в SMTP-приёмнике: {len(smtp.messages)}")
+    return results
+
+
+# --- микробенчмарки ---
+
+def _measure(fn, repeat: int) -> dict:
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {**percentiles(timings), "ops_per_sec": round(len(timings) / sum(timings), 2)}
+
+
+def run_micro(args) -> dict:
+    """Скоринг и SHAP без HTTP: сколько стоят сами вычисления."""
+    import pandas as pd
+
+    from features import BASE_FEATURES
+    from resources import resources
+    from scoring import build_candidate_features, score_similar_credits
+
+    resources.load()
+    model = resources.compiled_model
+    df = resources.df
+    rows = df[BASE_FEATURES].sample(64, random_state=args.seed, replace=True).reset_index(drop=True)
+    candidates = df.sample(min(args.candidates, len(df)), random_state=args.seed)
+    profile = SimpleNamespace(**PROFILE)
+    explainer = resources.get_explainer()
+
+    def frame(n: int) -> pd.DataFrame:
+        return rows.iloc[:n].copy()
+
+    results = {
+        "predict_1": _measure(lambda: model.predict(frame(1)), args.micro_repeat),
+        "predict_64": _measure(lambda: model.predict(frame(64)), args.micro_repeat),
+        f"find_credits_score_{len(candidates)}": _measure(
+            lambda: score_similar_credits(model, candidates, profile, 40000.0, STUB_RATES["KZT"]), args.micro_repeat),
+        f"candidate_features_{len(candidates)}": _measure(
+            lambda: build_candidate_features(candidates, profile, 40000.0), args.micro_repeat),
+        "shap_1": _measure(lambda: explainer.shap_values(model.transform(frame(1))), args.micro_repeat),
+        "shap_32": _measure(lambda: explainer.shap_values(model.transform(frame(32))), args.micro_repeat),
+    }
+    for name, stats in results.items():
+        print(f"{name:28s} p50 {stats['p50']:8.2f}  p95 {stats['p95']:8.2f}  p99 {stats['p99']:8.2f} мс  "
+              f"{stats['ops_per_sec']:9.1f} оп/с")
+    return results
+
+
+# --- отчёт ---
+
+def print_level(result: dict):
+    print(f"\n== {result['concurrency']} клиентов: {result['throughput']:.1f} запросов/с, всего {result['requests']}")
+    print(f"{'эндпоинт':16s} {'запр/с':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'ошибок':>7s}")
+    for name, stats in result["endpoints"].items():
+        if not stats["count"]:
+            continue
+        print(f"{name:16s} {stats['throughput']:8.1f} {stats['p50']:9.2f} {stats['p95']:9.2f} {stats['p99']:9.2f} "
+              f"{stats['errors']:7d}")
+
+
+def _git(*cmd) -> str:
+    try:
+        return subprocess.run(["git", *cmd], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_meta(args) -> dict:
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD") or None,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "server": args.server,
+        "workers": args.workers,
+        "database": args.database_url.split("://", 1)[0] if args.database_url else "sqlite",
+        "mix": args.mix,
+        "duration": args.duration,
+    }
+
+
+def cmd_run(args):
+    results = {"meta": run_meta(args), "load": [], "micro": {}}
+    if not args.no_load:
+        results["load"] = asyncio.run(run_load(args))
+    if not args.no_micro:
+        print()
+        results["micro"] = run_micro(args)
+
+    out = args.out or f"loadtest-{results['meta']['commit'] or 'local'}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты сохранены в {out}")
+
+
+def _change(old, new) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def cmd_compare(args):
+    """Сравнивает два прогона: рост p95 или падение пропускной способности больше --threshold % — регрессия."""
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+
+    regressions = 0
+    old_levels = {level["concurrency"]: level for level in old.get("load", [])}
+    for level in new.get("load", []):
+        before = old_levels.get(level["concurrency"])
+        if before is None:
+            continue
+        print(f"\n== {level['concurrency']} клиентов")
+        for name, stats in level["endpoints"].items():
+            prev = before["endpoints"].get(name)
+            if not prev or not prev.get("count") or not stats.get("count"):
+                continue
+            p95, rps = _change(prev["p95"], stats["p95"]), _change(prev["throughput"], stats["throughput"])
+            flag = p95 > args.threshold or rps < -args.threshold
+            regressions += flag
+            print(f"{name:16s} p95 {prev['p95']:8.2f} -> {stats['p95']:8.2f} мс ({p95:+6.1f}%)  "
+                  f"запр/с {prev['throughput']:8.1f} -> {stats['throughput']:8.1f} ({rps:+6.1f}%)"
+                  f"{'  ⚠️' if flag else ''}")
+
+    common = [name for name in new.get("micro", {}) if name in old.get("micro", {})]
+    if common:
+        print("\n== микробенчмарки")
+    for name in common:
+        prev, stats = old["micro"][name], new["micro"][name]
+        p50 = _change(prev["p50"], stats["p50"])
+        flag = p50 > args.threshold
+        regressions += flag
+        print(f"{name:28s} p50 {prev['p50']:8.2f} -> {stats['p50']:8.2f} мс ({p50:+6.1f}%){'  ⚠️' if flag else ''}")
+
+    print(f"\nРегрессий: {regressions}")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест и микробенчмарки")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="Прогон нагрузки и микробенчмарков, результат в JSON")
+    p.add_argument("--concurrency", default="1,8,32", help="Уровни параллельности через запятую")
+    p.add_argument("--duration", type=float, default=20, help="Секунд на каждый уровень")
+    p.add_argument("--warmup", type=float, default=3, help="Прогрев перед каждым уровнем, не попадает в отчёт")
+    p.add_argument("--mix", default=DEFAULT_MIX, help="Веса эндпоинтов: имя=вес,...")
+    p.add_argument("--server", choices=["serve", "uvicorn"], default="serve")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--port", type=int, default=0)
+    p.add_argument("--database-url", default=None, help="PostgreSQL вместо временной SQLite")
+    p.add_argument("--boot-timeout", type=float, default=180)
+    p.add_argument("--request-timeout", type=float, default=60)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--candidates", type=int, default=2000, help="Кредитов в микробенчмарке /find-credits/")
+    p.add_argument("--micro-repeat", type=int, default=50)
+    p.add_argument("--no-load", action="store_true")
+    p.add_argument("--no-micro", action="store_true")
+    p.add_argument("--out", default=None)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("compare", help="Сравнение двух JSON с результатами")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10, help="Допустимое ухудшение, %%")
+    p.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
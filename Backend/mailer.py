@@ -0,0 +1,251 @@
+"""
+Исходящая почта через outbox.
+
+Обработчики только кладут письмо в таблицу email_outbox в своей транзакции.
+OutboxSender в фоне забирает пачки писем, отправляет их через одно
+переиспользуемое SMTP-соединение и повторяет неудачные попытки с backoff.
+
+Для локальной проверки подойдёт aiosmtpd:
+
+    python -m aiosmtpd -n -l localhost:8025
+    SMTP_SERVER=localhost SMTP_PORT=8025 SMTP_STARTTLS=0 uvicorn main:app
+"""
+import asyncio
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import AsyncSessionLocal, EmailOutbox
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "10"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+# Соединение закрывается, если писем не было дольше этого времени (сек)
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Флаг в Session.info: после коммита разбудить отправщика
+_WAKE_ON_COMMIT = "outbox_wake"
+
+
+def confirmation_email(confirm_url: str):
+    """Тема и текст письма с подтверждением почты."""
+    return "Подтверждение почты", f"Подтвердите email, перейдя по ссылке: {confirm_url}"
+
+
+def enqueue_email(db: AsyncSession, to_email: str, subject: str, body: str):
+    """
+    Добавляет письмо в outbox. Коммит — за вызывающим, вместе с остальными
+    изменениями; отправщик будится после коммита, когда письмо уже видно в БД.
+    """
+    db.add(EmailOutbox(to_email=to_email, subject=subject, body=body))
+    db.info[_WAKE_ON_COMMIT] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session):
+    if session.info.pop(_WAKE_ON_COMMIT, False):
+        outbox_sender.wake()
+
+
+def backoff_delay(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+class SmtpUnavailable(Exception):
+    """Не удалось подключиться к SMTP-серверу: остальные письма пачки пробовать бессмысленно."""
+
+
+class SmtpConnection:
+    """Одно авторизованное SMTP-соединение, которое переживает несколько писем."""
+
+    def __init__(self):
+        self.server = os.getenv("SMTP_SERVER")
+        self.port = int(os.getenv("SMTP_PORT", "587"))
+        self.user = os.getenv("EMAIL_USER")
+        self.password = os.getenv("EMAIL_PASSWORD")
+        self.starttls = os.getenv("SMTP_STARTTLS", "1") == "1"
+        self.sender = os.getenv("EMAIL_FROM", self.user)
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        smtp = None
+        try:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+            if self.starttls:
+                smtp.starttls()
+            if self.password:
+                smtp.login(self.user, self.password)
+        except (smtplib.SMTPException, OSError) as e:
+            if smtp is not None:
+                smtp.close()
+            raise SmtpUnavailable(str(e) or e.__class__.__name__) from e
+        self._smtp = smtp
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._smtp = None
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def send(self, to_email: str, subject: str, body: str):
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = to_email
+
+        # Одна попытка переподключиться, если сервер закрыл простаивающее соединение
+        for attempt in range(2):
+            if self._smtp is None:
+                self._connect()
+            try:
+                self._smtp.sendmail(msg["From"], [to_email], msg.as_string())
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def send_batch(self, messages):
+        """
+        Отправляет пачку [(id, to, subject, body)]. Возвращает ({id: ошибка
+        или None}, ошибка подключения или None). Если подключиться не удалось,
+        пачка прерывается: письма без результата не отправлялись.
+        """
+        results = {}
+        for message_id, to_email, subject, body in messages:
+            try:
+                self.send(to_email, subject, body)
+                results[message_id] = None
+            except SmtpUnavailable as e:
+                return results, str(e)
+            except (smtplib.SMTPException, OSError) as e:
+                results[message_id] = str(e) or e.__class__.__name__
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self.close()
+        return results, None
+
+
+class OutboxSender:
+    """Фоновая задача, которая разбирает email_outbox пачками."""
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.connection = SmtpConnection()
+        self._task = None
+        self._event = None
+        # Неудачные подключения подряд и когда пробовать снова
+        self._connect_failures = 0
+        self._retry_at = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._event = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.connection.close)
+
+    def wake(self):
+        if self._event is not None:
+            self._event.set()
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[⚠️] Ошибка отправки писем: {e}")
+                processed = 0
+
+            # Полная пачка — скорее всего, есть ещё письма
+            if processed >= self.batch_size:
+                continue
+
+            await asyncio.to_thread(self.connection.close_if_idle)
+            try:
+                await asyncio.wait_for(self._event.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+
+    async def process_batch(self) -> int:
+        if time.monotonic() < self._retry_at:
+            # SMTP недоступен: не берём письма под блокировку, пока не пройдёт пауза
+            return 0
+        async with AsyncSessionLocal() as db:
+            now = datetime.utcnow()
+            result = await db.execute(
+                select(EmailOutbox)
+                .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+                .order_by(EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.scalars().all()
+            if not rows:
+                return 0
+
+            messages = [(row.id, row.to_email, row.subject, row.body) for row in rows]
+            results, unavailable = await asyncio.to_thread(self.connection.send_batch, messages)
+            if unavailable is None:
+                self._connect_failures = 0
+            else:
+                self._connect_failures += 1
+                delay = backoff_delay(self._connect_failures)
+                self._retry_at = time.monotonic() + delay
+                print(f"[⚠️] SMTP недоступен ({unavailable}), {len(rows) - len(results)} писем отложено на {delay:.0f} сек")
+
+            now = datetime.utcnow()
+            for row in rows:
+                if row.id not in results:
+                    # Письмо не отправлялось: попытка не засчитывается, ждём сервер
+                    row.last_error = f"SMTP недоступен: {unavailable}"[:500]
+                    row.next_attempt_at = now + timedelta(seconds=backoff_delay(self._connect_failures))
+                    continue
+                error = results[row.id]
+                row.attempts += 1
+                if error is None:
+                    row.status = "sent"
+                    row.sent_at = now
+                    row.last_error = None
+                else:
+                    row.last_error = error[:500]
+                    if row.attempts >= OUTBOX_MAX_ATTEMPTS:
+                        row.status = "failed"
+                    else:
+                        row.next_attempt_at = now + timedelta(seconds=backoff_delay(row.attempts))
+            await db.commit()
+            # После сбоя подключения — пауза, а не следующая пачка сразу
+            return len(rows) if unavailable is None else 0
+
+
+outbox_sender = OutboxSender()
@@ -1,74 +1,121 @@
 import os
+import asyncio
 import io
 import base64
+import hashlib
+import itertools
+import json
 import random
 from datetime import datetime, date, timedelta
 import time
+from typing import List, Optional
+from dataclasses import dataclass
 
 import httpx
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import shap
 
 from dotenv import load_dotenv
 from jose import JWTError, jwt, ExpiredSignatureError
-from passlib.context import CryptContext
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import OperationalError
-from sqlalchemy import text
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, select, delete
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Depends, Form, Query, Body
+from fastapi import FastAPI, HTTPException, Depends, Form, Query, Body, Response, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
-from fastapi import BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from models import SessionLocal, AsyncSessionLocal, User, PersonalData, Credit, ExchangeRate, engine, async_engine
+from features import PERSON_FIELDS, application_row
+from scoring import ScoringError, score_similar_credits, iter_scored_chunks, best_per_intent
+from resources import resources
+from caching import LRUCache, SharedGenerations
+from render_pool import RenderPool
+from process_pool import PoolBusy
+from passwords import PasswordPool
+from rates import RateHolder, lock_rate_fetch, save_rate
+from mailer import outbox_sender, enqueue_email, confirmation_email
+from pagination import PAGE_LIMIT_MAX, fetch_page, stream_ndjson
+from batching import InferenceBatcher, QueueFull
+from prediction_cache import PredictionCache
+from offers import OfferCatalog
+from knn import KNN_K_DEFAULT, KNN_K_MAX
+import metrics
+from metrics import MetricsMiddleware, SHAP_DURATION, RENDER_DURATION, query_budget
+from request_context import RequestContext, load_context
+from batch_predict import BatchPool, BatchFormatError, open_chunks, stream_predictions
+from batch_predict import detect_format as detect_batch_format
+from bulk_credits import BulkFormatError, detect_format, export_credits, import_credits
+
+from db_init import bootstrap_db
 
-from pycaret.classification import load_model, predict_model
-from scipy.special import expit
-import shap
+OPEN_EXCHANGE_APP_ID = os.getenv("OPEN_EXCHANGE_APP_ID")
+# Подменяется на локальную заглушку в loadtest.py
+OPEN_EXCHANGE_URL = os.getenv("OPEN_EXCHANGE_URL", "https://openexchangerates.org/api/latest.json")
+# Последний курс валют в памяти процесса
+rate_holder = RateHolder()
+
+# Пул рендера SHAP-картинок и кэш готовых изображений
+render_pool = RenderPool()
+# Пул для bcrypt, изолированный от остальных эндпоинтов
+password_pool = PasswordPool()
+# Отдельный пул для /predict/batch
+batch_pool = BatchPool()
+explain_image_cache = LRUCache(maxsize=int(os.getenv("EXPLAIN_IMAGE_CACHE_SIZE", "256")))
+# Предсказания по одинаковым строкам признаков; сбрасывается при смене модели и курса
+prediction_cache = PredictionCache()
+rate_holder.add_listener(prediction_cache.clear)
+# Готовые ответы filter_type=BEST по корзинам клиентов; перестраивается при смене модели
+offer_catalog = OfferCatalog()
+
+
+def scoring_model():
+    """Текущая модель за кэшем предсказаний."""
+    return prediction_cache.bind(resources.compiled_model, resources.version)
+
+
+# Одиночные запросы /predict/ оцениваются общими пачками; в очередь попадают только промахи кэша
+inference_batcher = InferenceBatcher(
+    lambda frame: prediction_cache.predict(resources.compiled_model, frame, resources.version, lookup=False)
+)
 
-from models import SessionLocal, User, PersonalData, Credit, ExchangeRate
-from email.mime.text import MIMEText
-import smtplib
 
-from db_init import create_tables, create_admin
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Пулы форкаются первыми, пока в процессе нет потоков и загруженной модели
+    render_pool.start()
+    password_pool.start()
+    batch_pool.start()
+    await bootstrap_db(password_pool.hash)
+    # Модель и датасет догружаются в фоне, готовность видна в /readyz
+    resources.load_in_background()
+    outbox_sender.start()
+    inference_batcher.start()
+    metrics_task = asyncio.create_task(metrics.flush_periodically()) if metrics.METRICS_DIR else None
+    yield
+    if metrics_task is not None:
+        metrics_task.cancel()
+        metrics.flush()
+    await inference_batcher.stop()
+    await outbox_sender.stop()
+    render_pool.shutdown()
+    password_pool.shutdown()
+    batch_pool.shutdown()
 
 
-def wait_for_db(max_attempts: int = 10, delay: int = 2):
-    print("⏳ Проверка готовности БД...")
-    for attempt in range(max_attempts):
-        try:
-            db = SessionLocal()
-            db.execute(text("SELECT 1"))
-            db.close()
-            print("✅ База данных готова к подключению")
-            return
-        except OperationalError:
-            print(f"⏳ Попытка {attempt + 1}/{max_attempts} неудачна, пробуем снова через {delay} сек...")
-            time.sleep(delay)
-    raise RuntimeError("❌ Не удалось подключиться к базе данных. Проверь настройки и доступность PostgreSQL.")
-
-wait_for_db()
-
-from db_init import create_tables, create_admin
-try:
-    create_tables()
-    create_admin()
-except Exception as e:
-    print(f"[⚠️] Ошибка инициализации БД: {e}")
-
-csv_path = "credit_risk_dataset.csv"
-# Загружаем модель один раз при старте
-model = load_model("my_pipeline")  # замените на актуальное имя вашей модели
-catboost_model = model.named_steps['trained_model']
-
-df = pd.read_csv(csv_path)
-OPEN_EXCHANGE_APP_ID = os.getenv("OPEN_EXCHANGE_APP_ID")
-
 # Настройка FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+
+def require_model():
+    """Эндпоинты с моделью отвечают 503, пока она загружается."""
+    if not resources.ready:
+        raise HTTPException(status_code=503, detail="Модель ещё загружается, повторите позже")
+
 
 # Настройка CORS
 app.add_middleware(
@@ -77,7 +124,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After-Id"],
 )
+# Метрики снаружи CORS: в задержку входит вся обработка запроса
+app.add_middleware(MetricsMiddleware)
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine, "async")
 
 
 CONFIRM_SECRET = "your_confirm_secret"
@@ -86,7 +138,6 @@ SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -99,6 +150,33 @@ def get_db():
         db.close()
 
 
+# Асинхронная сессия для эндпоинтов на async def
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@app.get("/healthz")
+async def liveness():
+    """Процесс жив и обслуживает event loop. pid показывает, какой воркер ответил."""
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@app.get("/readyz")
+async def readiness(db: AsyncSession = Depends(get_async_db)):
+    """Готов принимать весь трафик: БД отвечает, модель и датасет загружены."""
+    try:
+        await db.execute(text("SELECT 1"))
+        database = True
+    except Exception:
+        database = False
+    ready = database and resources.ready
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "database": database, **resources.status()}
+    )
+
+
 # Pydantic-схемы
 class UserCreate(BaseModel):
     username: str
@@ -155,16 +233,132 @@ class CreditRequest(BaseModel):
     hash: str  # ✅ обязательно
 
 # Утилиты для работы с пользователями
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int, *options):
+    result = await db.execute(select(User).where(User.id == user_id).options(*options))
+    return result.scalars().first()
+
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_pool.verify(plain_password, hashed_password)
+    except PoolBusy:
+        raise HTTPException(status_code=503, detail="Сервис авторизации перегружен, повторите позже")
+
+
+async def get_password_hash(password):
+    try:
+        return await password_pool.hash(password)
+    except PoolBusy:
+        raise HTTPException(status_code=503, detail="Сервис авторизации перегружен, повторите позже")
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Снимок пользователя для авторизации, не привязан к сессии БД."""
+    id: int
+    username: str
+    is_admin: bool
+    email: Optional[str]
+    email_confirmed: bool
+
+
+# Кэш "токен -> пользователь", чтобы не декодировать JWT и не ходить в БД на каждый запрос
+user_cache = LRUCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")), ttl=float(os.getenv("USER_CACHE_TTL", "30")))
+# Поколения пользователей, общие для воркеров serve.py: удаление или смена прав
+# в одном воркере сразу делает недействительными записи user_cache во всех
+user_generations = SharedGenerations(int(os.getenv("USER_CACHE_SLOTS", "4096")))
+
 
+def invalidate_user(user_id: int):
+    """Сбрасывает кэш всех токенов пользователя после изменения его данных, во всех воркерах."""
+    user_generations.bump(user_id)
+    user_cache.discard_where(lambda entry: entry[0].id == user_id)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
 
+def cached_user(token: str) -> Optional[CurrentUser]:
+    cached = user_cache.get(token)
+    if cached is not None:
+        user, expires_at, generation = cached
+        if expires_at > time.time() and generation == user_generations.get(user.id):
+            return user
+        user_cache.pop(token)
+    return None
+
+
+def decode_access_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Токен истек. Выполните повторный вход.")
+    except JWTError:
+        raise HTTPException(status_code=403, detail="Ошибка аутентификации")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+    if not payload.get("sub"):
+        raise HTTPException(status_code=403, detail="Недопустимый токен")
+    return payload
+
+
+def remember_user(token: str, payload: dict, user: Optional[User]) -> CurrentUser:
+    if not user:
+        raise HTTPException(status_code=403, detail="Пользователь не найден")
+
+    snapshot = CurrentUser(
+        id=user.id,
+        username=user.username,
+        is_admin=user.is_admin,
+        email=user.email,
+        email_confirmed=user.email_confirmed
+    )
+    user_cache.set(token, (snapshot, payload["exp"], user_generations.get(user.id)))
+    return snapshot
+
+
+async def current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> CurrentUser:
+    user = cached_user(token)
+    if user is not None:
+        return user
+
+    payload = decode_access_token(token)
+    return remember_user(token, payload, await get_user_by_username(db, payload["sub"]))
+
+
+def request_context(with_rate: bool):
+    """
+    Зависимость: текущий пользователь, его анкета и (если with_rate) курс
+    валют одним SQL-запросом. Пользователь из кэша токенов тоже сверяется
+    с БД в этом же запросе, отдельного запроса за ним нет.
+    """
+    async def dependency(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> RequestContext:
+        user = cached_user(token)
+        if user is not None:
+            context = await load_context(db, rate_holder, user_id=user.id, with_rate=with_rate)
+            if context.user is None:
+                invalidate_user(user.id)
+                raise HTTPException(status_code=403, detail="Пользователь не найден")
+        else:
+            payload = decode_access_token(token)
+            context = await load_context(db, rate_holder, username=payload["sub"], with_rate=with_rate)
+            user = remember_user(token, payload, context.user)
+        context.user = user
+        return context
+
+    return dependency
+
+
+# Контекст /personal-data/ и /predict/: пользователь (снимок CurrentUser) и его анкета
+personal_context = request_context(with_rate=False)
+scoring_context = request_context(with_rate=True)
+
+
+async def current_admin(user: CurrentUser = Depends(current_user)) -> CurrentUser:
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+    return user
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -190,27 +384,11 @@ class CreditExplanation(BaseModel):
     cb_person_default_on_file: bool
     cb_person_cred_hist_length: int
 
-def send_email(to_email: str, confirm_url: str):
-    msg = MIMEText(f"Подтвердите email, перейдя по ссылке: {confirm_url}")
-    msg["Subject"] = "Подтверждение почты"
-    msg["From"] = os.getenv("EMAIL_USER")
-    msg["To"] = to_email
-
-    with smtplib.SMTP(os.getenv("SMTP_SERVER"), int(os.getenv("SMTP_PORT"))) as server:
-        server.starttls()
-        server.login(os.getenv("EMAIL_USER"), os.getenv("EMAIL_PASSWORD"))
-        server.sendmail(msg["From"], [msg["To"]], msg.as_string())
-
-
 # Эндпоинты
 
 @app.post("/send-confirmation/")
-def send_confirmation(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
-
-    if not user or not user.email:
+async def send_confirmation(user: CurrentUser = Depends(current_user), db: AsyncSession = Depends(get_async_db)):
+    if not user.email:
         raise HTTPException(status_code=404, detail="Email не указан")
 
     confirm_token = jwt.encode(
@@ -220,112 +398,119 @@ def send_confirmation(token: str = Depends(oauth2_scheme), db: Session = Depends
     )
 
     confirm_url = f"http://localhost:8000/confirm-email/?token={confirm_token}"  # заменить на прод URL
-    send_email(user.email, confirm_url)
+    enqueue_email(db, user.email, *confirmation_email(confirm_url))
+    await db.commit()
 
     return {"message": f"Письмо отправлено на {user.email}"}
 
 @app.get("/confirm-email/")
-def confirm_email(token: str, db: Session = Depends(get_db)):
+async def confirm_email(token: str, db: AsyncSession = Depends(get_async_db)):
     try:
         payload = jwt.decode(token, CONFIRM_SECRET, algorithms=[ALGORITHM])
         username = payload.get("sub")
-        user = get_user_by_username(db, username)
+        user = await get_user_by_username(db, username)
         if not user:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
 
         user.email_confirmed = True
-        db.commit()
+        await db.commit()
+        invalidate_user(user.id)
         return {"message": "Email успешно подтвержден!"}
     except JWTError:
         raise HTTPException(status_code=400, detail="Неверный или просроченный токен")
 
 @app.get("/email-status/")
-def check_email_status(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=403, detail="Недопустимый токен")
-
-        user = get_user_by_username(db, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-        return {
-            "email": user.email,
-            "email_confirmed": user.email_confirmed
-        }
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Ошибка аутентификации")
+async def check_email_status(user: CurrentUser = Depends(current_user)):
+    return {
+        "email": user.email,
+        "email_confirmed": user.email_confirmed
+    }
 
 
 @app.post("/update-email/")
-def update_email(
-    background_tasks: BackgroundTasks,
+async def update_email(
     new_email: str = Form(...),
-    db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(get_async_db),
+    current: CurrentUser = Depends(current_user)
 ):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-
-    user = get_user_by_username(db, username)
+    user = await get_user_by_id(db, current.id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
     user.email = new_email
     user.email_confirmed = False
-    db.commit()
 
-    # Отправляем новое письмо подтверждения
+    # Письмо подтверждения уходит в outbox в той же транзакции
     confirm_token = jwt.encode(
         {"sub": user.username, "email": new_email, "exp": datetime.utcnow() + timedelta(hours=1)},
         CONFIRM_SECRET,
         algorithm=ALGORITHM
     )
     confirm_url = f"http://localhost:8000/confirm-email/?token={confirm_token}"
-    background_tasks.add_task(send_email, new_email, confirm_url)
+    enqueue_email(db, new_email, *confirmation_email(confirm_url))
+    await db.commit()
+    invalidate_user(user.id)
 
     return {"message": f"Email обновлён. Подтвердите по ссылке, отправленной на {new_email}."}
 
-@app.get("/currency-rates/")
-async def get_currency_rates(db: Session = Depends(get_db)):
-    today = date.today()
-    existing_rate = db.query(ExchangeRate).filter(ExchangeRate.date == today).first()
+async def fetch_today_rate(db: AsyncSession, today: date):
+    """Курс за сегодня: из БД, если его уже записал другой воркер, иначе из openexchangerates."""
+    # fetch_lock в get_currency_rates — на процесс, эта блокировка — на все воркеры
+    await lock_rate_fetch(db)
+    result = await db.execute(select(ExchangeRate).where(ExchangeRate.date == today))
+    existing_rate = result.scalars().first()
+    if existing_rate:
+        rate_holder.set(existing_rate)
+        return rate_holder.current
 
-    if not existing_rate:
-        if not OPEN_EXCHANGE_APP_ID:
-            raise HTTPException(status_code=500, detail=f"Токен не найден {OPEN_EXCHANGE_APP_ID}")
+    if not OPEN_EXCHANGE_APP_ID:
+        raise HTTPException(status_code=500, detail=f"Токен не найден {OPEN_EXCHANGE_APP_ID}")
 
-        url = f"https://openexchangerates.org/api/latest.json?app_id={OPEN_EXCHANGE_APP_ID}&symbols=USD,RUB,EUR,KZT"
+    url = f"{OPEN_EXCHANGE_URL}?app_id={OPEN_EXCHANGE_APP_ID}&symbols=USD,RUB,EUR,KZT"
 
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
-                data = response.json()
-
-            rates = data.get("rates", {})
-            usd_rate = rates.get("USD", 1)
-            eur_rate = rates.get("EUR")
-            rub_rate = rates.get("RUB")
-            kzt_rate = rates.get("KZT")
-
-            if not all([eur_rate, rub_rate, kzt_rate]):
-                raise HTTPException(status_code=500, detail="Некорректные данные от API")
-
-            new_rate = ExchangeRate(
-                date=today,
-                usd=usd_rate,
-                eur=eur_rate,
-                rub=rub_rate,
-                kzt=kzt_rate
-            )
-            db.add(new_rate)
-            db.commit()
-            existing_rate = new_rate
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(url)
+            data = response.json()
+
+        rates = data.get("rates", {})
+        usd_rate = rates.get("USD", 1)
+        eur_rate = rates.get("EUR")
+        rub_rate = rates.get("RUB")
+        kzt_rate = rates.get("KZT")
+
+        if not all([eur_rate, rub_rate, kzt_rate]):
+            raise HTTPException(status_code=500, detail="Некорректные данные от API")
+
+        # Если курс за сегодня успел записать другой процесс, берём его строку
+        new_rate = await save_rate(db, {
+            "date": today,
+            "usd": usd_rate,
+            "eur": eur_rate,
+            "rub": rub_rate,
+            "kzt": kzt_rate
+        })
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении курса валют: {str(e)}")
+
+    # Новый курс сразу виден /predict/ и /find-credits/ этого процесса
+    rate_holder.set(new_rate)
+    return rate_holder.current
+
+
+@app.get("/currency-rates/")
+@query_budget(4)
+async def get_currency_rates(db: AsyncSession = Depends(get_async_db)):
+    today = date.today()
+    existing_rate = await rate_holder.aget(db)
 
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка при получении курса валют: {str(e)}")
+    if not existing_rate or existing_rate.date != today:
+        # Один запрос к API на процесс, даже если на смене дня пришла пачка запросов
+        async with rate_holder.fetch_lock:
+            existing_rate = await rate_holder.aget(db)
+            if not existing_rate or existing_rate.date != today:
+                existing_rate = await fetch_today_rate(db, today)
 
     BUY_SPREAD = 0.005  # 0.5% комиссия на покупку
     SELL_SPREAD = 0.01  # 1% комиссия на продажу
@@ -342,18 +527,18 @@ async def get_currency_rates(db: Session = Depends(get_db)):
     }
 
 @app.post("/register/", response_model=Token)
-def register_user(
-    background_tasks: BackgroundTasks,
+async def register_user(
     username: str = Form(...),
     password: str = Form(...),
     email: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    existing_user = get_user_by_username(db, username)
+    existing_user = await get_user_by_username(db, username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Пользователь уже существует")
 
-    hashed_password = get_password_hash(password)
+    # bcrypt считается в отдельном пуле процессов
+    hashed_password = await get_password_hash(password)
     new_user = User(
         username=username,
         password=hashed_password,
@@ -361,49 +546,49 @@ def register_user(
         email_confirmed=False
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
 
-    # 🔐 Токен доступа
-    access_token = create_access_token(data={"sub": new_user.username, "is_admin": new_user.is_admin})
-
-    # 📩 Запускаем отправку письма в фоне
+    # 📩 Письмо уходит в outbox в той же транзакции, отправит фоновый отправщик
     confirm_token = jwt.encode(
         {"sub": new_user.username, "email": new_user.email, "exp": datetime.utcnow() + timedelta(hours=1)},
         CONFIRM_SECRET,
         algorithm=ALGORITHM
     )
     confirm_url = f"http://localhost:8000/confirm-email/?token={confirm_token}"
-    background_tasks.add_task(send_email, new_user.email, confirm_url)
+    enqueue_email(db, new_user.email, *confirmation_email(confirm_url))
+
+    await db.commit()
+    await db.refresh(new_user)
+
+    # 🔐 Токен доступа
+    access_token = create_access_token(data={"sub": new_user.username, "is_admin": new_user.is_admin})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/update-password/")
-def update_password(
+async def update_password(
     old_password: str = Form(...),
     new_password: str = Form(...),
-    db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(get_async_db),
+    current: CurrentUser = Depends(current_user)
 ):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-
-    user = get_user_by_username(db, username)
+    user = await get_user_by_id(db, current.id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    if not verify_password(old_password, user.password):
+    if not await verify_password(old_password, user.password):
         raise HTTPException(status_code=403, detail="Старый пароль неверен")
 
-    user.password = get_password_hash(new_password)
-    db.commit()
+    user.password = await get_password_hash(new_password)
+    await db.commit()
+    invalidate_user(user.id)
 
     return {"message": "Пароль успешно обновлён"}
 
 
 @app.post("/token/", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_user_by_username(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.password):
+@query_budget(1)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_by_username(db, form_data.username)
+    if not user or not await verify_password(form_data.password, user.password):
         raise HTTPException(status_code=400, detail="Неверное имя пользователя или пароль")
     if not user.email_confirmed:
         raise HTTPException(status_code=403, detail="Email не подтвержден")
@@ -413,14 +598,8 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
 
 @app.get("/userinfo/")
-def get_user_info(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
-
-    if not user:
-        raise HTTPException(status_code=401, detail="Неавторизованный доступ")
-
+@query_budget(1)
+async def get_user_info(user: CurrentUser = Depends(current_user)):
     return {
         "user_id": user.id,
         "username": user.username,
@@ -428,47 +607,29 @@ def get_user_info(db: Session = Depends(get_db), token: str = Depends(oauth2_sch
     }
 
 @app.get("/personal-data/")
-def get_personal_data(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        user = get_user_by_username(db, username)
+@query_budget(1)
+async def get_personal_data(context: RequestContext = Depends(personal_context)):
+    user, personal_data = context.user, context.personal_data
 
-        if not user:
-            raise HTTPException(status_code=401, detail="Пользователь не найден")
-
-        personal_data = db.query(PersonalData).filter(PersonalData.user_id == user.id).first()
+    if not personal_data:
+        raise HTTPException(status_code=404, detail=f"Персональные данные не найдены для {user.username} с ID {user.id}")
 
-        if not personal_data:
-            raise HTTPException(status_code=404, detail=f"Персональные данные не найдены для {username} с ID {user.id}")
-
-        return {
-            "person_age": personal_data.person_age,
-            "person_income": personal_data.person_income,
-            "person_home_ownership": personal_data.person_home_ownership,
-            "person_emp_length": personal_data.person_emp_length
-        }
-    except ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Токен истек. Выполните повторный вход.")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Ошибка аутентификации")
+    return {
+        "person_age": personal_data.person_age,
+        "person_income": personal_data.person_income,
+        "person_home_ownership": personal_data.person_home_ownership,
+        "person_emp_length": personal_data.person_emp_length
+    }
 
 @app.post("/personal-data/")
-def add_or_update_personal_data(
+@query_budget(2)
+async def add_or_update_personal_data(
     personal_data: PersonalDataCreate,
-    db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(get_async_db),
+    context: RequestContext = Depends(personal_context)
 ):
-    # Получаем текущего пользователя по токену
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
-
-    if not user:
-        raise HTTPException(status_code=401, detail="Пользователь не найден")
-
-    # Проверяем, есть ли персональные данные для этого пользователя
-    existing_data = db.query(PersonalData).filter(PersonalData.user_id == user.id).first()
+    # Анкета пришла вместе с пользователем; сессия та же, что у db
+    user, existing_data = context.user, context.personal_data
 
     if existing_data:
         # Обновляем существующие данные
@@ -476,8 +637,8 @@ def add_or_update_personal_data(
         existing_data.person_income = personal_data.person_income
         existing_data.person_home_ownership = personal_data.person_home_ownership
         existing_data.person_emp_length = personal_data.person_emp_length
-        db.commit()
-        db.refresh(existing_data)
+        # expire_on_commit=False: значения остаются в объекте, refresh не нужен
+        await db.commit()
         return {"message": "Персональные данные обновлены", "data": {
             "person_age": existing_data.person_age,
             "person_income": existing_data.person_income,
@@ -494,8 +655,7 @@ def add_or_update_personal_data(
             person_emp_length=personal_data.person_emp_length
         )
         db.add(new_data)
-        db.commit()
-        db.refresh(new_data)
+        await db.commit()
         return {"message": "Персональные данные добавлены", "data": {
             "person_age": new_data.person_age,
             "person_income": new_data.person_income,
@@ -503,61 +663,126 @@ def add_or_update_personal_data(
             "person_emp_length": new_data.person_emp_length
         }}
 @app.post("/admin/credits/")
-def add_credit_history(credit_data: CreditCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
-    if not user or not user.is_admin:
-        raise HTTPException(status_code=403, detail="Доступ запрещен")
+async def add_credit_history(credit_data: CreditCreate, db: AsyncSession = Depends(get_async_db), admin: CurrentUser = Depends(current_admin)):
     new_credit = Credit(**credit_data.dict())
     db.add(new_credit)
-    db.commit()
-    db.refresh(new_credit)
+    await db.commit()
+    await db.refresh(new_credit)
     return new_credit
 
+
+@app.post("/admin/credits/bulk")
+async def bulk_import_credits(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    admin: CurrentUser = Depends(current_admin)
+):
+    """
+    Массовая загрузка кредитов из CSV или NDJSON (колонки как у /admin/credits/).
+    Кредиты с уже существующим hash пропускаются, в ответе — счётчики и ошибки разбора.
+    """
+    try:
+        fmt = format or detect_format(file.filename, file.content_type)
+    except BulkFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return await import_credits(lines, fmt)
+    except BulkFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/credits/export")
+async def bulk_export_credits(admin: CurrentUser = Depends(current_admin)):
+    """Вся таблица credits в CSV, потоком."""
+    return StreamingResponse(
+        export_credits(), media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="credits.csv"'},
+    )
+
+USER_LIST_COLUMNS = (User.id, User.username, User.is_admin)
+CREDIT_LIST_COLUMNS = (
+    Credit.id, Credit.user_id, Credit.loan_amount, Credit.interest_rate,
+    Credit.term_months, Credit.status, Credit.hash,
+)
+
+
+async def list_rows(db: AsyncSession, response: Response, columns, where=(), after_id=None, limit=None, stream=False):
+    """Общая логика списков: страница по after_id/limit или NDJSON-поток (stream=true)."""
+    if stream:
+        return stream_ndjson(columns, columns[0], where, after_id, limit)
+    return await fetch_page(db, response, columns, columns[0], where, after_id, limit)
+
+
 @app.get("/admin/users/")
-def get_all_users(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
+@query_budget(2)
+async def get_all_users(
+    response: Response,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    admin: CurrentUser = Depends(current_admin)
+):
+    return await list_rows(db, response, USER_LIST_COLUMNS, (), after_id, limit, stream)
 
-    if not user or not user.is_admin:
-        raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    users = db.query(User).all()
-    return [{"id": u.id, "username": u.username, "is_admin": u.is_admin} for u in users]
+@app.get("/admin/stats/")
+async def get_service_stats(admin: CurrentUser = Depends(current_admin)):
+    """Настройки и счётчики батчинга и кэшей этого процесса."""
+    return {
+        "pid": os.getpid(),
+        "inference_batcher": inference_batcher.stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "offer_catalog": offer_catalog.stats(),
+        "user_cache": user_cache.stats(),
+        "explain_image_cache": explain_image_cache.stats(),
+    }
 
 
-@app.delete("/admin/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
+def collect_service_metrics():
+    """Счётчики кэшей, батчера и пулов процессов на момент выдачи /metrics."""
+    metrics.observe_cache("prediction", prediction_cache.cache)
+    metrics.observe_cache("user", user_cache)
+    metrics.observe_cache("explain_image", explain_image_cache)
+    stats = inference_batcher.stats()
+    metrics.BATCHER_QUEUE_DEPTH.set(stats["queue_depth"])
+    metrics.BATCHER_BATCHES.set(stats["batches"])
+    metrics.BATCHER_REJECTED.set(stats["rejected"])
+    metrics.POOL_PENDING.set(render_pool.pending, "render")
+    metrics.POOL_PENDING.set(password_pool.pending, "password")
+    metrics.POOL_PENDING.set(batch_pool.pending, "batch")
+
+
+metrics.REGISTRY.add_collector(collect_service_metrics)
 
-    if not user or not user.is_admin:
-        raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    user_to_delete = db.query(User).filter(User.id == user_id).first()
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Метрики в текстовом формате Prometheus; при нескольких воркерах — сумма по всем."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.delete("/admin/users/{user_id}")
+@query_budget(7)
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db), admin: CurrentUser = Depends(current_admin)):
+    # Связи подгружаем заранее: в async-сессии каскад не может сделать lazy load
+    user_to_delete = await get_user_by_id(db, user_id, selectinload(User.personal_data), selectinload(User.credits))
 
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    db.delete(user_to_delete)
-    db.commit()
+    await db.delete(user_to_delete)
+    await db.commit()
+    invalidate_user(user_id)
 
     return {"message": "Пользователь удалён"}
 
 
 @app.put("/admin/users/{user_id}/make_admin")
-def make_user_admin(user_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    username = payload.get("sub")
-    user = get_user_by_username(db, username)
-
-    if not user or not user.is_admin:
-        raise HTTPException(status_code=403, detail="Доступ запрещен")
-
-    user_to_promote = db.query(User).filter(User.id == user_id).first()
+@query_budget(3)
+async def make_user_admin(user_id: int, db: AsyncSession = Depends(get_async_db), admin: CurrentUser = Depends(current_admin)):
+    user_to_promote = await get_user_by_id(db, user_id)
 
     if not user_to_promote:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -566,30 +791,19 @@ def make_user_admin(user_id: int, db: Session = Depends(get_db), token: str = De
         raise HTTPException(status_code=400, detail="Пользователь уже является администратором")
 
     user_to_promote.is_admin = True
-    db.commit()
+    await db.commit()
+    invalidate_user(user_id)
 
     return {"message": "Пользователь теперь администратор"}
 
 @app.post("/credits/")
-def submit_credit(
+async def submit_credit(
     credit_data: CreditRequest,
-    db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(get_async_db),
+    user: CurrentUser = Depends(current_user)
 ):
-    # Получаем пользователя по токену
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=403, detail="Пользователь не определён")
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Неверный токен")
-
-    user = get_user_by_username(db, username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    existing = db.query(Credit).filter(Credit.hash == credit_data.hash).first()
+    result = await db.execute(select(Credit).where(Credit.hash == credit_data.hash))
+    existing = result.scalars().first()
     if existing:
         raise HTTPException(status_code=409, detail="Такой кредит уже существует")
 
@@ -603,63 +817,68 @@ def submit_credit(
     )
 
     db.add(credit)
-    db.commit()
-    db.refresh(credit)
+    await db.commit()
+    await db.refresh(credit)
     return {"message": "Кредитная заявка подана", "credit_id": credit.id}
 
 @app.get("/credits/")
-def get_my_credits(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=403, detail="Пользователь не определён")
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Неверный токен")
-
-    user = get_user_by_username(db, username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    credits = db.query(Credit).filter(Credit.user_id == user.id).all()
-    return credits
+@query_budget(2)
+async def get_my_credits(
+    response: Response,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    user: CurrentUser = Depends(current_user)
+):
+    return await list_rows(db, response, CREDIT_LIST_COLUMNS, (Credit.user_id == user.id,), after_id, limit, stream)
 
 @app.get("/admin/credits/{user_id}")
-def get_user_credits(user_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    return db.query(Credit).filter(Credit.user_id == user_id).all()
+@query_budget(2)
+async def get_user_credits(
+    user_id: int,
+    response: Response,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    admin: CurrentUser = Depends(current_admin)
+):
+    return await list_rows(db, response, CREDIT_LIST_COLUMNS, (Credit.user_id == user_id,), after_id, limit, stream)
 
 @app.put("/admin/credits/{credit_id}")
-def update_credit(credit_id: int, updated_data: CreditCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credit = db.query(Credit).filter(Credit.id == credit_id).first()
+async def update_credit(credit_id: int, updated_data: CreditCreate, db: AsyncSession = Depends(get_async_db), admin: CurrentUser = Depends(current_admin)):
+    result = await db.execute(select(Credit).where(Credit.id == credit_id))
+    credit = result.scalars().first()
     for key, value in updated_data.dict().items():
         setattr(credit, key, value)
-    db.commit()
+    await db.commit()
     return credit
 
 @app.delete("/admin/credits/{credit_id}")
-def delete_credit(credit_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    db.query(Credit).filter(Credit.id == credit_id).delete()
-    db.commit()
+async def delete_credit(credit_id: int, db: AsyncSession = Depends(get_async_db), admin: CurrentUser = Depends(current_admin)):
+    await db.execute(delete(Credit).where(Credit.id == credit_id))
+    await db.commit()
     return {"message": "Кредит удалён"}
 
 
-df["loan_status"] = pd.to_numeric(df["loan_status"], errors="coerce")
-
-
-@app.post("/find-credits/")
+@app.post("/find-credits/", dependencies=[Depends(require_model)])
+@query_budget(2)
 def find_similar_credits(
         personal_data: PersonalDataCreate,
         db: Session = Depends(get_db),
-        token: str = Depends(oauth2_scheme),
-        filter_type: str = Query("ALL", regex="^(ALL|BEST)$")
+        user: CurrentUser = Depends(current_user),
+        filter_type: str = Query("ALL", regex="^(ALL|BEST)$"),
+        stream: bool = False,
+        mode: str = Query("window", pattern="^(window|knn)$"),
+        k: int = Query(KNN_K_DEFAULT, ge=1, le=KNN_K_MAX)
 ):
+    """
+    mode=window — кредиты в окне ±5 лет и 80–100% дохода с тем же типом жилья;
+    mode=knn — k кредитов с ближайшими заёмщиками (поле knn_distance), от ближнего к дальнему.
+    """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=403, detail="Недопустимый токен")
-
-        latest_rate = db.query(ExchangeRate).order_by(ExchangeRate.date.desc()).first()
+        latest_rate = rate_holder.get(db)
         if not latest_rate:
             raise HTTPException(status_code=500, detail="Нет доступных курсов валют")
 
@@ -668,220 +887,252 @@ def find_similar_credits(
         annual_income_kzt = monthly_income_kzt * 12
         annual_income_usd = annual_income_kzt / usd_to_kzt
 
-        filtered_df = df[
-            (df['loan_status'] == 0) &
-            (df['person_home_ownership'] == personal_data.person_home_ownership) &
-            (df['person_emp_length'].notnull()) &
-            (df['person_age'].between(personal_data.person_age - 5, personal_data.person_age + 5)) &
-            (df['person_income'].between(annual_income_usd * 0.8, annual_income_usd))
-            ]
+        if mode == "knn":
+            filtered_df = resources.credit_knn.find_nearest(
+                age=personal_data.person_age,
+                income_usd=annual_income_usd,
+                emp_length=personal_data.person_emp_length,
+                home_ownership=personal_data.person_home_ownership,
+                k=k
+            )
+        else:
+            filtered_df = resources.credit_index.find_similar(
+                loan_status=0,
+                home_ownership=personal_data.person_home_ownership,
+                age_min=personal_data.person_age - 5,
+                age_max=personal_data.person_age + 5,
+                income_min=annual_income_usd * 0.8,
+                income_max=annual_income_usd
+            )
+
+        client_income = {
+            "client_income_tenge_month": monthly_income_kzt,
+            "client_income_tenge_annual": annual_income_kzt,
+            "client_income_usd_annual": round(annual_income_usd, 2),
+        }
+
+        # Для ALL можно отдавать кредиты по мере оценки, BEST всё равно требует полного прохода
+        if stream and filter_type == "ALL":
+            chunks = iter_scored_chunks(scoring_model(), filtered_df, personal_data, annual_income_usd, usd_to_kzt)
+            # Первая пачка оценивается до начала ответа: неисправная модель даёт 500, а не поток ошибок
+            first = next(chunks, [])
+            return StreamingResponse(
+                stream_scored_credits(first, chunks, client_income),
+                media_type="application/x-ndjson"
+            )
 
         if filtered_df.empty:
             return {"message": "Не найдено похожих кредитов", "total_found": 0}
 
-        credits_list = filtered_df.replace({np.nan: None, np.inf: None, -np.inf: None}).to_dict(orient='records')
-
-        for credit in credits_list:
-            try:
-                if credit.get("person_income") is not None:
-                    income_kzt_annual = credit["person_income"] * usd_to_kzt
-                    credit["person_income_kzt_annual"] = round(income_kzt_annual, 2)
-                    credit["person_income_kzt_monthly"] = round(income_kzt_annual / 12, 2)
-                else:
-                    credit["person_income_kzt_annual"] = None
-                    credit["person_income_kzt_monthly"] = None
-
-                if credit.get("loan_amnt") is not None:
-                    credit["loan_amnt_kzt"] = round(credit["loan_amnt"] * usd_to_kzt, 2)
-
-                else:
-                    credit["loan_amnt_kzt"] = None
-
-                model_input = pd.DataFrame([{
-                    "person_age": personal_data.person_age,
-                    "person_income": annual_income_usd,
-                    "person_home_ownership": personal_data.person_home_ownership,
-                    "person_emp_length": personal_data.person_emp_length,
-                    "loan_intent": credit.get("loan_intent", "PERSONAL"),
-                    "loan_grade": credit.get("loan_grade", "C"),
-                    "loan_amnt": credit.get("loan_amnt", 5000),
-                    "loan_int_rate": credit.get("loan_int_rate", 15.0),
-                    "loan_percent_income": credit.get("loan_amnt", 5000)/annual_income_usd,
-                    "cb_person_default_on_file": "N",
-                    "cb_person_cred_hist_length": credit.get("cb_person_cred_hist_length",1)
-                }])
-
-                prediction = predict_model(model, data=model_input)
-                result = prediction[["prediction_label", "prediction_score"]].iloc[0].to_dict()
-
-                credit["client_prediction"] = {
-                    "prediction_label": result["prediction_label"],
-                    "prediction_score": round(result["prediction_score"], 4),
-                    "client_person_age": personal_data.person_age,
-                    "client_person_income_usd_annual": round(annual_income_usd, 2),
-                    "client_person_income_kzt_annual": round(annual_income_usd*usd_to_kzt, 2),
-                    "client_person_home_ownership": personal_data.person_home_ownership,
-                    "client_person_emp_length": personal_data.person_emp_length
-                }
-
-            except Exception as e:
-                credit["client_prediction"] = f"Ошибка прогноза: {str(e)}"
-
-        if filter_type == "BEST":
-            best_offers = []
-            seen_intents = set()
-
-            grouped = {}
-            for credit in credits_list:
-                pred = credit.get("client_prediction", {})
-                if isinstance(pred, dict) and pred.get("prediction_label") == 0.0 and pred.get("prediction_score",
-                                                                                               0) > 0.8:
-                    intent = credit.get("loan_intent")
-                    if intent not in grouped:
-                        grouped[intent] = []
-                    grouped[intent].append(credit)
-
-            for intent, offers in grouped.items():
-                best = max(offers, key=lambda x: (
-                    x.get("loan_amnt_kzt", 0),
-                    -(x.get("loan_int_rate") if x.get("loan_int_rate") is not None else 1000)
-                ))
-                best_offers.append(best)
-
-            credits_list = best_offers
+        credits_list = None
+        if filter_type == "BEST" and mode == "window":
+            # Обычно хватает каталога и оценки нескольких строк; иначе — полный перебор ниже
+            credits_list = offer_catalog.best_offers(scoring_model(), resources, personal_data, annual_income_usd, usd_to_kzt)
+
+        if credits_list is None:
+            # Оцениваем всех кандидатов одним батчем
+            credits_list = score_similar_credits(scoring_model(), filtered_df, personal_data, annual_income_usd, usd_to_kzt)
+            if filter_type == "BEST":
+                credits_list = best_per_intent(credits_list)
 
         return {
-            "client_income_tenge_month": monthly_income_kzt,
-            "client_income_tenge_annual": annual_income_kzt,
-            "client_income_usd_annual": round(annual_income_usd, 2),
+            **client_income,
             "total_found": len(credits_list),
             "credits": credits_list
         }
 
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Ошибка аутентификации")
+    except ScoringError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def ndjson_line(record: dict) -> str:
+    # numpy-скаляры из DataFrame приводим к обычным числам
+    return json.dumps(record, ensure_ascii=False, default=lambda v: v.item() if hasattr(v, "item") else str(v)) + "\n"
 
-@app.get("/sample_credit/{loan_status}")
+
+def stream_scored_credits(first: list, chunks, client_income):
+    """
+    NDJSON для /find-credits/?stream=true: по строке на кредит, пачками по
+    SCORE_CHUNK_SIZE, последней строкой — итог с total_found и доходом клиента.
+    Если модель отказала посреди потока, в итоге есть поле error.
+    """
+    total = 0
+    error = None
+    try:
+        for records in itertools.chain([first], chunks):
+            total += len(records)
+            yield "".join(ndjson_line(credit) for credit in records)
+    except ScoringError as e:
+        error = str(e)
+
+    trailer = {**client_income, "total_found": total}
+    if error:
+        trailer["error"] = error
+    elif not total:
+        trailer["message"] = "Не найдено похожих кредитов"
+    yield ndjson_line(trailer)
+
+@app.get("/sample_credit/{loan_status}", dependencies=[Depends(require_model)])
+@query_budget(0)
 def get_sample_credit(loan_status: int):
     if loan_status not in [0, 1]:
         raise HTTPException(status_code=400, detail="loan_status должен быть 0 или 1")
 
-    filtered_df = df[df["loan_status"] == loan_status]
-    if filtered_df.empty:
+    row = resources.credit_index.sample(loan_status)
+    if row is None:
         raise HTTPException(status_code=404, detail="Нет данных с таким loan_status")
 
-    sample = filtered_df.sample(1).iloc[0].to_dict()
+    # Пропуски в датасете (ставка, стаж) отдаём как null: NaN в JSON не сериализуется
+    sample = row.astype(object).where(row.notna(), None).to_dict()
 
     # Преобразуем в нужные форматы
     sample["loan_amnt"] = float(sample["loan_amnt"])
-    sample["loan_int_rate"] = float(sample["loan_int_rate"])
+    if sample["loan_int_rate"] is not None:
+        sample["loan_int_rate"] = float(sample["loan_int_rate"])
     sample["term_months"] = 36  # Стандартный срок
     sample["person_income"] = float(sample["person_income"])
     sample["person_age"] = int(sample["person_age"])
 
     return sample
 
-@app.post("/predict/")
-def predict_from_front(
+@app.post("/predict/", dependencies=[Depends(require_model)])
+@query_budget(1)
+async def predict_from_front(
     data: dict = Body(...),
      explain: bool = Query(False),
-     db: Session = Depends(get_db),
-     token: str = Depends(oauth2_scheme)
+     context: RequestContext = Depends(scoring_context)
  ):
-    loan_intent: str = data.get("loan_intent")
-    loan_grade: str = data.get("loan_grade")
-    loan_amount: float = data.get("loan_amount") or data.get("loan_amnt")
-    loan_int_rate: float = data.get("loan_int_rate")
-    loan_status: int = data.get("loan_status")
-    currency: str = data.get("currency")
-
     """
     Предсказание: если currency=="USD", loan_amount в USD/год;
     если currency=="KZT", loan_amount в KZT/год;
     model использует USD/год для всех.
     """
-    # Аутентификация
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise JWTError()
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Ошибка аутентификации")
-
-    # Личные данные пользователя
-    user = get_user_by_username(db, username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    personal = db.query(PersonalData).filter(PersonalData.user_id == user.id).first()
+    # Пользователь, анкета и курс USD->KZT загружены одним запросом в scoring_context
+    personal = context.personal_data
     if not personal:
         raise HTTPException(status_code=404, detail="Персональные данные не найдены")
 
-    # Курс USD->KZT
-    rate = db.query(ExchangeRate).order_by(ExchangeRate.date.desc()).first()
+    rate = context.rate
     if not rate:
         raise HTTPException(status_code=500, detail="Курс валют не доступен")
-    usd_to_kzt = rate.kzt
 
-    # Конвертация дохода personal: доход хранится в KZT/мес
-    annual_income_usd = personal.person_income * 12 / usd_to_kzt
-
-    # Конвертация суммы кредита из переданной валюты в USD/год
-    if currency.upper() == 'KZT':
-        annual_loan_usd = loan_amount / usd_to_kzt
-    elif currency.upper() == 'USD':
-        annual_loan_usd = loan_amount
+    # Доход анкеты хранится в KZT/мес, сумма кредита — в валюте currency; модели нужны USD/год
+    person = {field: getattr(personal, field) for field in PERSON_FIELDS}
+    try:
+        row = application_row(data, person, rate.kzt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Повторная анкета берётся из кэша, новая оценивается в общей пачке с другими запросами
+    cached = prediction_cache.lookup(resources.compiled_model, pd.DataFrame([row]), resources.version)
+    if cached is not None:
+        labels, scores = cached
     else:
-        raise HTTPException(status_code=400, detail="currency должен быть USD или KZT")
-
-    # Подготовка данных: читаем из JSON поля или по умолчанию
-    cb_default = data.get("cb_person_default_on_file", "N")
-    cb_hist = data.get("cb_person_cred_hist_length", 1)
-    df_input = pd.DataFrame([{
-        "person_age": personal.person_age,
-        "person_income": annual_income_usd,
-        "person_home_ownership": personal.person_home_ownership,
-        "person_emp_length": personal.person_emp_length,
-        "loan_intent": loan_intent,
-        "loan_grade": loan_grade,
-        "loan_amnt": annual_loan_usd,
-        "loan_int_rate": loan_int_rate,
-        "loan_percent_income": annual_loan_usd / annual_income_usd,
-        "cb_person_default_on_file": cb_default,
-        "cb_person_cred_hist_length": cb_hist
-    }])
-
-    # Feature engineering
-    df_input["loan_to_income_ratio"]       = df_input["loan_amnt"] / df_input["person_income"]
-    df_input["loan_to_emp_length_ratio"]   = df_input["loan_amnt"] / (df_input["person_emp_length"] + 1)
-    df_input["int_rate_to_loan_amt_ratio"] = df_input["loan_int_rate"] / df_input["loan_amnt"]
-    df_input["adjusted_age"]               = np.log1p(df_input["person_age"])
-
-    # Предсказание
-    result_df = predict_model(model, data=df_input)
-    row = result_df.iloc[0]
-    label = int(row["prediction_label"])
-    score = round(float(row["prediction_score"]), 4)
+        try:
+            labels, scores = await inference_batcher.predict([row])
+        except QueueFull:
+            raise HTTPException(status_code=503, detail="Сервис предсказаний перегружен, повторите позже")
+    label = int(labels[0])
+    score = round(float(scores[0]), 4)
 
     response = {"prediction_label": label, "prediction_score": score}
 
     # SHAP при explain
     if explain:
-        transformed = model.transform(df_input)
-        explainer = shap.TreeExplainer(catboost_model)
-        shap_vals = explainer.shap_values(transformed)
-        response["shap_explanation"] = dict(zip(transformed.columns, shap_vals[0]))
+        response["shap_explanation"] = await run_in_threadpool(explain_row, row)
 
     return response
 
-@app.post("/explain/image")
-def explain_image(credit_data: CreditExplanation, token: str = Depends(oauth2_scheme)):
-    import shap
-    import matplotlib.pyplot as plt
-    import io
-    import base64
-    from fastapi.responses import JSONResponse
 
+@app.post("/predict/batch", dependencies=[Depends(require_model)])
+@query_budget(2)
+async def predict_batch(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|arrow)$"),
+    db: AsyncSession = Depends(get_async_db),
+    user: CurrentUser = Depends(current_user)
+):
+    """
+    Предсказания для файла полных заявок (анкета + кредит в каждой строке), NDJSON-потоком.
+    Строки приходят по мере готовности кусков с номером row; ошибки — по строкам.
+    """
+    try:
+        fmt = format or detect_batch_format(file.filename, file.content_type)
+        chunks = open_chunks(file.file, fmt)
+    except BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rate = await rate_holder.aget(db)
+    if not rate:
+        raise HTTPException(status_code=500, detail="Курс валют не доступен")
+    if batch_pool.busy:
+        raise HTTPException(status_code=503, detail="Сервис пакетных предсказаний перегружен, повторите позже")
+
+    def observe(results):
+        metrics.MODEL_BATCH_ROWS.observe(len(results))
+
+    return StreamingResponse(
+        stream_predictions(batch_pool, chunks, resources.version, rate.kzt, on_chunk=observe),
+        media_type="application/x-ndjson"
+    )
+
+
+def explain_row(row: dict) -> dict:
+    """SHAP-вклады признаков для одной заявки /predict/."""
+    transformed = resources.compiled_model.transform(pd.DataFrame([row]))
+    with SHAP_DURATION.time("predict"):
+        shap_vals = resources.get_explainer().shap_values(transformed)
+    return dict(zip(transformed.columns, shap_vals[0]))
+
+
+def explanation_frame(items: List[CreditExplanation]) -> pd.DataFrame:
+    """Сырые заявки для пайплайна; колонки под пайплайн выбирает compiled_model."""
+    raw_data = pd.DataFrame([{
+        "person_age": item.person_age,
+        "person_income": item.person_income,
+        "person_home_ownership": item.person_home_ownership,
+        "person_emp_length": item.person_emp_length,
+        "loan_intent": item.loan_intent,
+        "loan_grade": item.loan_grade,
+        "loan_amnt": item.loan_amnt,
+        "loan_int_rate": item.loan_int_rate,
+        "loan_percent_income": item.loan_percent_income,
+        "cb_person_default_on_file": "Y" if item.cb_person_default_on_file else "N",
+        "cb_person_cred_hist_length": item.cb_person_cred_hist_length,
+    } for item in items])
+    return raw_data
+
+
+MAX_EXPLAIN_BATCH = int(os.getenv("MAX_EXPLAIN_BATCH", "1000"))
+
+
+@app.post("/explain/batch", dependencies=[Depends(require_model)])
+@query_budget(1)
+def explain_batch(items: List[CreditExplanation] = Body(...), user: CurrentUser = Depends(current_user)):
+    if len(items) > MAX_EXPLAIN_BATCH:
+        raise HTTPException(status_code=413, detail=f"Не более {MAX_EXPLAIN_BATCH} заявок за запрос")
+
+    explainer = resources.get_explainer()
+    expected_value = np.asarray(explainer.expected_value).tolist()
+    if not items:
+        return {"expected_value": expected_value, "features": [], "explanations": []}
+
+    # Один векторизованный вызов shap_values на всю пачку
+    transformed = resources.compiled_model.transform(explanation_frame(items))
+    with SHAP_DURATION.time("batch"):
+        shap_values = np.asarray(explainer.shap_values(transformed))
+    features = list(transformed.columns)
+
+    return {
+        "expected_value": expected_value,
+        "features": features,
+        "explanations": [dict(zip(features, row)) for row in shap_values.tolist()]
+    }
+
+
+@app.post("/explain/image", dependencies=[Depends(require_model)])
+@query_budget(1)
+async def explain_image(credit_data: CreditExplanation, user: CurrentUser = Depends(current_user)):
     FEATURE_TRANSLATIONS = {
         "person_age": "Возраст",
         "person_income": "Доход",
@@ -915,51 +1166,32 @@ def explain_image(credit_data: CreditExplanation, token: str = Depends(oauth2_sc
     }
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        if not payload.get("sub"):
-            raise HTTPException(status_code=403, detail="Недопустимый токен")
-
-        loan_amnt = credit_data.loan_amnt
-
-        raw_data = pd.DataFrame([{
-            "person_age": credit_data.person_age,
-            "person_income": credit_data.person_income,
-            "person_home_ownership": credit_data.person_home_ownership,
-            "person_emp_length": credit_data.person_emp_length,
-            "loan_intent": credit_data.loan_intent,
-            "loan_grade": credit_data.loan_grade,
-            "loan_amnt": loan_amnt,
-            "loan_int_rate": credit_data.loan_int_rate,
-            "loan_percent_income": credit_data.loan_percent_income,
-            "cb_person_default_on_file": "Y" if credit_data.cb_person_default_on_file else "N",
-            "cb_person_cred_hist_length": credit_data.cb_person_cred_hist_length,
-            "loan_to_income_ratio": loan_amnt / credit_data.person_income,
-            "loan_to_emp_length_ratio": loan_amnt / (credit_data.person_emp_length + 1),
-            "int_rate_to_loan_amt_ratio": credit_data.loan_int_rate / loan_amnt,
-            "adjusted_age": np.log1p(credit_data.person_age)
-        }])
-
-        transformed = model.transform(raw_data)
-        explainer = shap.TreeExplainer(catboost_model)
-        shap_values = explainer.shap_values(transformed)
-
-        display_df = transformed.copy()
-        display_df.columns = [FEATURE_TRANSLATIONS.get(col, col) for col in display_df.columns]
-
-        plt.clf()
-        shap.plots._waterfall.waterfall_legacy(
-            explainer.expected_value, shap_values[0], display_df.iloc[0], show=False
-        )
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight")
-        plt.close()
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode("utf-8")
-        buf.close()
+        # Одинаковые заявки отдаём из кэша без пересчёта
+        cache_key = hashlib.sha256(json.dumps(credit_data.dict(), sort_keys=True).encode("utf-8")).hexdigest()
+        img_base64 = explain_image_cache.get(cache_key)
+        if img_base64 is None:
+            raw_data = explanation_frame([credit_data])
+
+            # Первый вызов импортирует shap и строит explainer — не в event loop
+            explainer = await run_in_threadpool(resources.get_explainer)
+            transformed = await run_in_threadpool(resources.compiled_model.transform, raw_data)
+            with SHAP_DURATION.time("image"):
+                shap_values = await run_in_threadpool(explainer.shap_values, transformed)
+
+            # Рендер в отдельном процессе: matplotlib не потокобезопасен и держит GIL
+            with RENDER_DURATION.time():
+                img_base64 = await render_pool.render(
+                    explainer.expected_value,
+                    shap_values[0],
+                    transformed.iloc[0].tolist(),
+                    [FEATURE_TRANSLATIONS.get(col, col) for col in transformed.columns]
+                )
+            explain_image_cache.set(cache_key, img_base64)
 
         return JSONResponse(content={"image_base64": img_base64})
 
+    except PoolBusy:
+        raise HTTPException(status_code=503, detail="Сервис объяснений перегружен, повторите позже")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка генерации изображения: {str(e)}")
 
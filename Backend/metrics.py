@@ -0,0 +1,478 @@
+"""
+Метрики сервиса в текстовом формате Prometheus (GET /metrics).
+
+Счётчики, гистограммы и gauge хранятся в памяти процесса; запись — это
+словарь и bisect под короткой блокировкой, поэтому инструментирование можно
+держать включённым под полной нагрузкой. Значения, которые уже считаются
+в других объектах (кэши, батчер, пулы), снимаются сборщиками в момент
+выдачи, а не на каждом запросе.
+
+Источники:
+    MetricsMiddleware        задержка и число запросов по маршрутам, запросы в работе,
+                             SQL-запросы и время БД на один HTTP-запрос
+    instrument_engine        число и длительность SQL-запросов (события SQLAlchemy)
+    timed_pool_class         ожидание соединения из пула
+    query_budget             допустимое число SQL-запросов эндпоинта (защита от N+1)
+    Histogram.time()         инференс, SHAP, рендер картинок
+
+При нескольких воркерах (serve.py) каждый процесс раз в METRICS_FLUSH_INTERVAL
+сек пишет свой снимок в METRICS_DIR, а /metrics складывает снимки всех
+воркеров. Счётчики завершившихся воркеров сохраняются, их gauge — нет.
+"""
+import bisect
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# В тестах: превышение бюджета запросов — ответ 500, а не предупреждение в логе
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+ROWS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._values.items()]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels):
+        """Для сборщиков: счётчик, который уже ведёт другой объект."""
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [счётчики по корзинам (последняя — +Inf), сумма, количество]
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """collector() вызывается перед каждым снимком и обновляет свои метрики."""
+        self.collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"[⚠️] Сборщик метрик {getattr(collector, '__name__', collector)}: {e}")
+        return {
+            metric.name: {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": metric.samples(),
+            }
+            for metric in self.metrics
+        }
+
+
+REGISTRY = Registry()
+
+
+# --- общие снимки воркеров ---
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush():
+    """Сохраняет снимок метрик процесса для /metrics других воркеров."""
+    if not METRICS_DIR:
+        return
+    data = {"pid": os.getpid(), "metrics": REGISTRY.snapshot()}
+    fd, tmp_path = tempfile.mkstemp(prefix=".metrics-", dir=METRICS_DIR)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, _snapshot_path(os.getpid()))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(into: dict, snapshot: dict, with_gauges: bool):
+    for name, metric in snapshot.items():
+        if metric["kind"] == "gauge" and not with_gauges:
+            continue
+        target = into.setdefault(name, {**metric, "samples": {}})
+        for labels, value in metric["samples"]:
+            key = tuple(labels)
+            current = target["samples"].get(key)
+            if current is None:
+                target["samples"][key] = value
+            elif metric["kind"] == "histogram":
+                current[0] = [a + b for a, b in zip(current[0], value[0])]
+                current[1] += value[1]
+                current[2] += value[2]
+            else:
+                target["samples"][key] = current + value
+
+
+def collect() -> dict:
+    """Метрики этого процесса, сложенные со снимками остальных воркеров."""
+    merged = {}
+    _merge(merged, REGISTRY.snapshot(), with_gauges=True)
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for file_name in os.listdir(METRICS_DIR):
+            if not file_name.endswith(".json"):
+                continue
+            pid = int(file_name[:-5])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, file_name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            _merge(merged, data["metrics"], with_gauges=_alive(pid))
+    return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(metrics: dict = None) -> str:
+    """Текстовый формат Prometheus 0.0.4."""
+    metrics = collect() if metrics is None else metrics
+    lines = []
+    for name, metric in metrics.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labelnames"]
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(metric["buckets"]) + [float("inf")], counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(names, labels, f"le={chr(34)}{_number(bound)}{chr(34)}")} {cumulative}')
+            lines.append(f"{name}_sum{_labels(names, labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(names, labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# --- метрики сервиса ---
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP-запросы по маршрутам и кодам ответа", ("method", "route", "status"))
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Время обработки HTTP-запроса, включая тело ответа", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP-запросы в работе")
+
+DB_QUERIES = Counter("db_queries_total", "SQL-запросы")
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Время одного SQL-запроса", buckets=FAST_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL-запросов на один HTTP-запрос", ("route",), buckets=QUERIES_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram("db_request_seconds", "Суммарное время SQL-запросов на один HTTP-запрос", ("route",), buckets=FAST_BUCKETS)
+DB_POOL_CHECKOUT = Histogram("db_pool_checkout_seconds", "Ожидание соединения из пула (включая новое подключение)", buckets=FAST_BUCKETS)
+DB_QUERY_BUDGET_EXCEEDED = Counter("db_query_budget_exceeded_total", "HTTP-запросы сверх бюджета SQL-запросов", ("route",))
+DB_POOL_IN_USE = Gauge("db_pool_connections_in_use", "Соединения, выданные из пула", ("engine",))
+
+MODEL_INFERENCE = Histogram("model_inference_seconds", "Вызов модели на пачку строк", buckets=FAST_BUCKETS)
+MODEL_BATCH_ROWS = Histogram("model_batch_rows", "Строк в одном вызове модели", buckets=ROWS_BUCKETS)
+SHAP_DURATION = Histogram("shap_seconds", "Расчёт SHAP-значений", ("endpoint",))
+RENDER_DURATION = Histogram("render_seconds", "Рендер картинки SHAP в пуле процессов")
+
+CACHE_HITS = Counter("cache_hits_total", "Попадания в кэш", ("cache",))
+CACHE_MISSES = Counter("cache_misses_total", "Промахи кэша", ("cache",))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Вытеснения из кэша", ("cache",))
+CACHE_SIZE = Gauge("cache_entries", "Записей в кэше", ("cache",))
+
+BATCHER_QUEUE_DEPTH = Gauge("inference_queue_depth", "Запросов /predict/ в очереди батчера")
+BATCHER_BATCHES = Counter("inference_batches_total", "Пачек, оценённых батчером")
+BATCHER_REJECTED = Counter("inference_rejected_total", "Запросов, отклонённых из-за полной очереди")
+POOL_PENDING = Gauge("process_pool_pending", "Задач в пуле процессов (в работе и в очереди)", ("pool",))
+
+
+# --- запросы ---
+
+class _RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Эндпоинт сделал больше SQL-запросов, чем объявил в query_budget."""
+
+
+def query_budget(limit: int):
+    """
+    Декоратор эндпоинта (ставится под @app.get/post): не больше limit
+    SQL-запросов на один HTTP-запрос. Превышение попадает в метрики и лог,
+    а при QUERY_BUDGET_STRICT=1 запрос завершается ошибкой: клиент получает
+    500 вместо ответа обработчика. Запросы после начала потокового ответа
+    проверяются в конце — тогда исключение QueryBudgetExceeded.
+    """
+    def decorator(endpoint):
+        endpoint.query_budget = limit
+        return endpoint
+    return decorator
+
+
+@contextmanager
+def count_queries():
+    """Считает SQL-запросы внутри блока (для скриптов и проверок вне HTTP)."""
+    stats = _RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def _budget_error(scope, queries: int):
+    """Текст ошибки, если запрос превысил бюджет своего эндпоинта, иначе None."""
+    budget = getattr(getattr(scope.get("route"), "endpoint", None), "query_budget", None)
+    if budget is None or queries <= budget:
+        return None
+    return f"{scope['method']} {_route_label(scope)}: {queries} SQL-запросов при бюджете {budget}"
+
+
+def _check_budget(scope, route: str, queries: int, rejected: bool = False):
+    message = _budget_error(scope, queries)
+    if message is None:
+        return
+    DB_QUERY_BUDGET_EXCEEDED.inc(route)
+    if QUERY_BUDGET_STRICT and not rejected:
+        raise QueryBudgetExceeded(message)
+    print(f"[⚠️] {message}")
+
+
+async def _send_budget_error(send, message: str):
+    body = message.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 500,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    # Шаблон маршрута, а не сам путь: id пользователей не раздувают число рядов
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI-middleware без BaseHTTPMiddleware: не буферизует ответ и не создаёт лишних задач."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        rejected = False
+
+        async def send_with_status(message):
+            nonlocal status, rejected
+            if rejected:
+                # Вместо ответа уже ушла ошибка бюджета, тело обработчика не отправляем
+                return
+            if message["type"] == "http.response.start":
+                # Строгий режим: ответ ещё не начат, поэтому превышение видно клиенту как 500
+                error = _budget_error(scope, stats.queries) if QUERY_BUDGET_STRICT else None
+                if error is not None:
+                    rejected = True
+                    status = 500
+                    await _send_budget_error(send, error)
+                    return
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            route = _route_label(scope)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status))
+            HTTP_DURATION.observe(duration, scope["method"], route)
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, route)
+            DB_TIME_PER_REQUEST.observe(stats.db_seconds, route)
+            _request_stats.reset(token)
+            _check_budget(scope, route, stats.queries, rejected)
+
+
+# --- SQLAlchemy ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    DB_QUERIES.inc()
+    DB_QUERY_DURATION.observe(duration)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += duration
+
+
+def instrument_engine(engine, name: str):
+    """Подписывается на события движка (sync или async); name — метка engine у метрик пула."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+    def collect():
+        # Пул читается при каждом сборе: engine.dispose() заменяет его новым
+        pool = sync_engine.pool
+        DB_POOL_IN_USE.set(pool.checkedout() if hasattr(pool, "checkedout") else 0, name)
+
+    REGISTRY.add_collector(collect)
+
+
+def timed_pool_class(base):
+    """Подкласс пула, который замеряет получение соединения. Переживает engine.dispose()."""
+
+    class TimedPool(base):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                DB_POOL_CHECKOUT.observe(time.perf_counter() - start)
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def observe_cache(name: str, cache):
+    """Переносит счётчики LRUCache в метрики; вызывается из сборщика."""
+    CACHE_HITS.set(cache.hits, name)
+    CACHE_MISSES.set(cache.misses, name)
+    CACHE_EVICTIONS.set(cache.evictions, name)
+    CACHE_SIZE.set(len(cache), name)
+
+
+async def flush_periodically(interval: float = METRICS_FLUSH_INTERVAL):
+    """Фоновая задача воркера: держит свой снимок в METRICS_DIR свежим."""
+    import asyncio
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush)
+        except OSError as e:
+            print(f"[⚠️] Не удалось сохранить снимок метрик: {e}")
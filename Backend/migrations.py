@@ -0,0 +1,252 @@
+"""
+Версионные миграции схемы.
+
+Применённые версии записываются в таблицу schema_migrations, каждая
+миграция выполняется один раз. Индексы на PostgreSQL строятся через
+CREATE INDEX CONCURRENTLY вне транзакции, поэтому их можно добавлять на
+живой базе без блокировки записи. Недостроенный (INVALID) индекс от
+прерванной попытки удаляется и строится заново. Параллельные запуски
+(несколько реплик) сериализуются advisory-блокировкой.
+
+    python migrations.py upgrade   применить недостающие миграции
+    python migrations.py status    показать применённые и ожидающие
+    python migrations.py check     EXPLAIN ключевых запросов: ошибка, если где-то полный скан
+
+Новые изменения схемы добавляются в конец MIGRATIONS. Миграция 1 создаёт
+схему по текущим моделям, поэтому последующие шаги должны быть
+идемпотентными (IF NOT EXISTS).
+"""
+import argparse
+import json
+import re
+import sys
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from models import Base, Credit, EmailOutbox, ExchangeRate, engine
+
+# Ключ pg_advisory_lock для миграций, одинаковый во всех процессах
+MIGRATION_LOCK_ID = 720_114_021
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+    # False — выполняется в autocommit (CREATE INDEX CONCURRENTLY нельзя в транзакции)
+    transactional: bool = True
+
+
+def _is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def _model_index(table, name: str):
+    return next(index for index in table.indexes if index.name == name)
+
+
+def create_index_concurrently(conn: Connection, index):
+    """Индекс из модели: на PostgreSQL — CONCURRENTLY, на остальных БД — обычный."""
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    if _is_postgres(conn):
+        valid = conn.exec_driver_sql(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %(name)s",
+            {"name": index.name},
+        ).scalar()
+        if valid is False:
+            # Остаток прерванного CONCURRENTLY: IF NOT EXISTS его бы пропустил
+            print(f"[⚠️] Индекс {index.name} недостроен, пересоздаём")
+            conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+        ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+    conn.exec_driver_sql(ddl)
+
+
+def drop_index_concurrently(conn: Connection, name: str):
+    """Удаляет индекс, если он есть: на PostgreSQL — CONCURRENTLY, на остальных БД — обычным DROP."""
+    concurrently = " CONCURRENTLY" if _is_postgres(conn) else ""
+    conn.exec_driver_sql(f'DROP INDEX{concurrently} IF EXISTS "{name}"')
+
+
+def _initial_schema(conn: Connection):
+    # Для существующих баз, созданных через create_all, ничего не меняет
+    Base.metadata.create_all(conn)
+
+
+def _hot_path_indexes(conn: Connection):
+    # /credits/ и /admin/credits/{user_id}: WHERE user_id = ? ORDER BY id (keyset-пагинация)
+    create_index_concurrently(conn, _model_index(Credit.__table__, "ix_credits_user_id_id"))
+    # Очередь писем: в частичный индекс попадают только pending, отправленные его не раздувают
+    create_index_concurrently(conn, _model_index(EmailOutbox.__table__, "ix_email_outbox_pending"))
+
+
+def _unique_rate_date(conn: Connection):
+    # Воркеры на смене дня могли записать курс за одну дату несколько раз: оставляем первую запись
+    conn.exec_driver_sql("DELETE FROM exchange_rates WHERE id NOT IN (SELECT min(id) FROM exchange_rates GROUP BY date)")
+    create_index_concurrently(conn, _model_index(ExchangeRate.__table__, "uq_exchange_rates_date"))
+    # Поиск по дате теперь идёт по уникальному индексу
+    drop_index_concurrently(conn, "ix_exchange_rates_date")
+
+
+def _drop_outbox_column_indexes(conn: Connection):
+    # Опрос очереди идёт по частичному ix_email_outbox_pending, эти индексы только замедляли запись
+    drop_index_concurrently(conn, "ix_email_outbox_status")
+    drop_index_concurrently(conn, "ix_email_outbox_next_attempt_at")
+
+
+MIGRATIONS = [
+    Migration(1, "initial_schema", _initial_schema),
+    Migration(2, "hot_path_indexes", _hot_path_indexes, transactional=False),
+    Migration(3, "unique_rate_date", _unique_rate_date, transactional=False),
+    Migration(4, "drop_outbox_column_indexes", _drop_outbox_column_indexes, transactional=False),
+]
+
+
+def _applied(conn: Connection) -> dict:
+    rows = conn.execute(select(schema_migrations.c.version, schema_migrations.c.applied_at))
+    return {version: applied_at for version, applied_at in rows}
+
+
+def _record(conn: Connection, migration: Migration):
+    conn.execute(schema_migrations.insert().values(
+        version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+    ))
+
+
+def upgrade(bind: Engine = engine) -> list:
+    """Применяет недостающие миграции по порядку. Возвращает номера применённых."""
+    applied_now = []
+    with bind.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if _is_postgres(conn):
+            conn.exec_driver_sql(f"SELECT pg_advisory_lock({MIGRATION_LOCK_ID})")
+        try:
+            _meta.create_all(conn)
+            applied = _applied(conn)
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                print(f"⏳ Миграция {migration.version:04d} {migration.name}...")
+                if migration.transactional:
+                    with bind.begin() as tx:
+                        migration.apply(tx)
+                        _record(tx, migration)
+                else:
+                    migration.apply(conn)
+                    _record(conn, migration)
+                applied_now.append(migration.version)
+            print(f"✅ Схема актуальна (версия {MIGRATIONS[-1].version})")
+        finally:
+            if _is_postgres(conn):
+                conn.exec_driver_sql(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_ID})")
+    return applied_now
+
+
+def status(bind: Engine = engine) -> list:
+    with bind.connect() as conn:
+        _meta.create_all(conn)
+        applied = _applied(conn)
+        conn.commit()
+    return [(m.version, m.name, applied.get(m.version)) for m in MIGRATIONS]
+
+
+# --- проверка планов ---
+
+def key_queries() -> dict:
+    """Запросы горячих путей в том виде, в каком их строит приложение."""
+    from pagination import keyset_query
+    from request_context import context_query
+
+    credit_columns = (Credit.id, Credit.user_id, Credit.loan_amount, Credit.status)
+    return {
+        "credits by user (keyset page)": keyset_query(credit_columns, Credit.id, (Credit.user_id == 1,), limit=100),
+        "predict context by user id": context_query(user_id=1),
+        "predict context by username": context_query(username="admin"),
+        "exchange rate by date": select(ExchangeRate.id).where(ExchangeRate.date == date.today()),
+        "email outbox poll": (
+            select(EmailOutbox.id)
+            .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= datetime.utcnow())
+            .order_by(EmailOutbox.id)
+            .limit(50)
+        ),
+    }
+
+
+def _explain(conn: Connection, query) -> list:
+    compiled = query.compile(dialect=conn.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if _is_postgres(conn):
+        plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params).scalar()
+        return plan if isinstance(plan, list) else json.loads(plan)
+    return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
+
+def _postgres_seq_scans(node: dict) -> list:
+    found = [node.get("Relation Name")] if node.get("Node Type") == "Seq Scan" else []
+    for child in node.get("Plans", []):
+        found += _postgres_seq_scans(child)
+    return found
+
+
+def _sqlite_full_scans(details: list) -> list:
+    # "SCAN t" — полный проход; "SCAN t USING INDEX" и "SEARCH ..." — по индексу.
+    # Скан материализованного подзапроса (одна строка latest_rate) таблицу не читает
+    materialized = {detail.split()[1] for detail in details if detail.startswith("MATERIALIZE")}
+    return [
+        detail for detail in details
+        if detail.startswith("SCAN") and "USING" not in detail and detail.split()[1] not in materialized
+    ]
+
+
+def check_plans(bind: Engine = engine) -> dict:
+    """
+    {запрос: [таблицы с полным сканом]} для key_queries. На PostgreSQL
+    enable_seqscan выключается на время проверки: на маленьких таблицах
+    планировщик и так выбрал бы полный скан, а с ним он остаётся только там,
+    где подходящего индекса нет.
+    """
+    failures = {}
+    with bind.connect() as conn:
+        if _is_postgres(conn):
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        for name, query in key_queries().items():
+            plan = _explain(conn, query)
+            scans = _postgres_seq_scans(plan[0]["Plan"]) if _is_postgres(conn) else _sqlite_full_scans(plan)
+            print(f"{'❌' if scans else '✅'} {name}" + (f": полный скан {', '.join(scans)}" if scans else ""))
+            if scans:
+                failures[name] = scans
+        conn.rollback()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("command", choices=["upgrade", "status", "check"], nargs="?", default="upgrade")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        upgrade()
+    elif args.command == "status":
+        for version, name, applied_at in status():
+            print(f"{version:04d} {name:24s} {applied_at or 'не применена'}")
+    else:
+        sys.exit(1 if check_plans() else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,58 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey, Date
+import os
+
+from datetime import datetime
+
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey, Date, DateTime, Text, Index, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from metrics import timed_pool_class
 
 # Настройка подключения к базе данных PostgreSQL
-DATABASE_URL = "postgresql://user:password@db:5432/mydb"
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/mydb")
+# Тот же сервер через asyncpg
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1))
+
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"  # SQL_ECHO=1 для отладки
 
 # Базовый класс для создания моделей
 Base = declarative_base()
 
 # Создание подключения к базе данных
-engine = create_engine(DATABASE_URL, echo=True)  # echo=True для отладки
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронное подключение с настраиваемым пулом
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=SQL_ECHO,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    pool_pre_ping=True,
+    # Замер ожидания соединения для /metrics
+    poolclass=timed_pool_class(AsyncAdaptedQueuePool),
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 #Курсы валют
 class ExchangeRate(Base):
     __tablename__ = 'exchange_rates'
     id = Column(Integer, primary_key=True, index=True)
-    date = Column(Date, index=True, nullable=False)
+    date = Column(Date, nullable=False)
     usd = Column(Float, nullable=False)
     eur = Column(Float, nullable=False)
     rub = Column(Float, nullable=False)
     kzt = Column(Float, nullable=False)
 
+    __table_args__ = (
+        # Один курс на дату, даже если его загрузили несколько воркеров сразу; добавлен миграцией 3
+        Index("uq_exchange_rates_date", "date", unique=True),
+    )
+
 # Модель пользователя
 class User(Base):
     __tablename__ = 'users'
@@ -67,11 +98,41 @@ class Credit(Base):
 
     user = relationship("User", back_populates="credits")
 
-# Функция для создания таблиц в базе данных
+    __table_args__ = (
+        # Кредиты пользователя по порядку id (keyset-пагинация); добавлен миграцией 2
+        Index("ix_credits_user_id_id", "user_id", "id"),
+    )
+
+# Очередь исходящих писем (outbox), разбирается фоновым отправщиком
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False)  # pending / sent / failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Только ожидающие отправки письма, в порядке разбора очереди; добавлен миграцией 2.
+        # Отдельных индексов по status и next_attempt_at нет (удалены миграцией 4)
+        Index("ix_email_outbox_pending", "id",
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
+
+# Полный сброс схемы для разработки: все таблицы удаляются и создаются миграциями заново
 def init_db():
+    from migrations import schema_migrations, upgrade
+
     print("Пересоздание таблиц...")
     Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    schema_migrations.drop(bind=engine, checkfirst=True)
+    upgrade(engine)
     print("Таблицы успешно пересозданы!")
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+"""
+Каталог лучших предложений для /find-credits/?filter_type=BEST.
+
+Клиенты разбиты на корзины (тип жилья, возраст с шагом OFFER_AGE_STEP лет,
+годовой доход в USD в геометрических интервалах с множителем
+OFFER_INCOME_RATIO). Для каждой корзины и цели кредита хранится короткий
+список кандидатов в порядке, в котором BEST выбирает лучший: сумма по
+убыванию, затем ставка по возрастанию, затем порядок в датасете. Список
+обрезается после OFFER_MIN_APPROVED кредитов, одобренных моделью для
+типичного клиента корзины, но не длиннее OFFER_TOP_ROWS.
+
+На запрос заново оцениваются только строки списка, попавшие в окно клиента
+(его точный возраст и доход). Первый одобренный в каждом списке и есть
+ответ полного перебора: всё, что дальше по списку, ранжируется ниже. Если
+одобренного нет, а список обрезан, ответ считается полным перебором.
+
+Каталог строится в фоне и перестраивается при смене resources.version
+(новая модель или датасет). Неудачная сборка повторяется с экспоненциальной
+задержкой от OFFER_RETRY_BASE до OFFER_RETRY_MAX секунд, до тех пор BEST
+работает полным перебором. Корзины по доходу в USD, суммы в тенге
+считаются на запрос, поэтому от курса валют каталог не зависит.
+"""
+import math
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from scoring import APPROVAL_SCORE, best_per_intent, build_candidate_features, is_approved, score_similar_credits
+
+OFFER_AGE_STEP = int(os.getenv("OFFER_AGE_STEP", "5"))
+OFFER_INCOME_RATIO = float(os.getenv("OFFER_INCOME_RATIO", "1.25"))
+OFFER_TOP_ROWS = int(os.getenv("OFFER_TOP_ROWS", "96"))
+OFFER_MIN_APPROVED = int(os.getenv("OFFER_MIN_APPROVED", "24"))
+# Сколько строк оценивается за один вызов модели при построении
+OFFER_BUILD_CHUNK = int(os.getenv("OFFER_BUILD_CHUNK", "20000"))
+# Задержка повторной сборки после ошибки: удваивается с каждой неудачей подряд
+OFFER_RETRY_BASE = float(os.getenv("OFFER_RETRY_BASE", "30"))
+OFFER_RETRY_MAX = float(os.getenv("OFFER_RETRY_MAX", "1800"))
+
+# Окно похожих кредитов, как в /find-credits/
+AGE_WINDOW = 5
+INCOME_FLOOR = 0.8
+
+
+class OfferCatalog:
+    def __init__(self, age_step: int = OFFER_AGE_STEP, income_ratio: float = OFFER_INCOME_RATIO,
+                 top_rows: int = OFFER_TOP_ROWS, min_approved: int = OFFER_MIN_APPROVED):
+        self.age_step = age_step
+        self.income_ratio = income_ratio
+        self.top_rows = top_rows
+        self.min_approved = min_approved
+        # (тип жилья, корзина возраста, корзина дохода) -> {цель: (позиции, список полный)}
+        self.entries = {}
+        self.version = None
+        self.build_seconds = None
+        self.hits = 0
+        self.fallbacks = 0
+        # Сколько строк переоценено на запросах, ответивших из каталога
+        self.rescored_rows = 0
+        self._df = None
+        self._ages = None
+        self._incomes = None
+        self._lock = threading.Lock()
+        self._building = False
+        # Неудачных сборок подряд и time.monotonic(), раньше которого не пробовать снова
+        self.failures = 0
+        self._retry_at = 0.0
+
+    # --- корзины ---
+
+    def age_bucket(self, age: float) -> int:
+        return int(age // self.age_step)
+
+    def income_bucket(self, income_usd: float) -> int:
+        return math.floor(math.log(max(income_usd, 1.0)) / math.log(self.income_ratio))
+
+    def _bucket_window(self, age_bucket: int, income_bucket: int):
+        """Окно кандидатов, покрывающее окна всех клиентов корзины (с запасом на округление)."""
+        age_lo = age_bucket * self.age_step
+        income_lo = self.income_ratio ** income_bucket
+        return (age_lo - AGE_WINDOW, age_lo + self.age_step + AGE_WINDOW,
+                income_lo * INCOME_FLOOR * 0.9999, income_lo * self.income_ratio * 1.0001)
+
+    # --- построение ---
+
+    def build(self, resources):
+        """Синхронно строит каталог для текущих модели и датасета."""
+        start = time.perf_counter()
+        version, index, model = resources.version, resources.credit_index, resources.compiled_model
+        df = index.df
+        emp_length = float(df["person_emp_length"].median())
+
+        entries = {}
+        pending = []  # (ключ, [(цель, позиции, всего кандидатов у цели)], признаки)
+        pending_rows = 0
+        for ownership in index.home_ownerships(0):
+            age_min, age_max, income_min, income_max = index.bounds(0, ownership)
+            for age_bucket in range(self.age_bucket(age_min - AGE_WINDOW), self.age_bucket(age_max + AGE_WINDOW) + 1):
+                for income_bucket in range(self.income_bucket(income_min) - 1,
+                                           self.income_bucket(income_max / INCOME_FLOOR) + 1):
+                    positions = index.similar_positions(0, ownership, *self._bucket_window(age_bucket, income_bucket))
+                    if not len(positions):
+                        continue
+                    shortlists = self._shortlists(df, positions)
+                    # Типичный клиент корзины: середина по возрасту и доходу, медианный стаж
+                    client = SimpleNamespace(
+                        person_age=age_bucket * self.age_step + self.age_step // 2,
+                        person_home_ownership=ownership,
+                        person_emp_length=emp_length,
+                    )
+                    rows = df.iloc[np.concatenate([ranked for _, ranked, _ in shortlists])]
+                    features = build_candidate_features(rows, client, self.income_ratio ** (income_bucket + 0.5))
+                    pending.append(((ownership, age_bucket, income_bucket), shortlists, features))
+                    pending_rows += len(features)
+                    if pending_rows >= OFFER_BUILD_CHUNK:
+                        self._score_pending(model, pending, entries)
+                        pending, pending_rows = [], 0
+        self._score_pending(model, pending, entries)
+
+        with self._lock:
+            self.entries = entries
+            self._df = df
+            self._ages = df["person_age"].to_numpy(dtype=float)
+            self._incomes = df["person_income"].to_numpy(dtype=float)
+            self.version = version
+            self.build_seconds = round(time.perf_counter() - start, 3)
+        print(f"✅ Каталог предложений: {len(entries)} корзин за {self.build_seconds} сек")
+
+    def _shortlists(self, df: pd.DataFrame, positions: np.ndarray) -> list:
+        """[(цель, первые top_rows позиций в порядке выбора BEST, всего кандидатов)]."""
+        intents = df["loan_intent"].to_numpy()[positions].astype(str)
+        amounts = df["loan_amnt"].to_numpy(dtype=float)[positions]
+        rates = np.nan_to_num(df["loan_int_rate"].to_numpy(dtype=float)[positions], nan=1000.0)
+        order = np.lexsort((positions, rates, -amounts, intents))
+        intents, ranked = intents[order], positions[order]
+        names, starts, counts = np.unique(intents, return_index=True, return_counts=True)
+        return [(name, ranked[start:start + min(count, self.top_rows)], count)
+                for name, start, count in zip(names.tolist(), starts, counts)]
+
+    def _score_pending(self, model, pending: list, entries: dict):
+        if not pending:
+            return
+        labels, scores = model.predict(pd.concat([features for _, _, features in pending], ignore_index=True))
+        approved = (np.asarray(labels, dtype=float) == 0.0) & (np.asarray(scores, dtype=float) > APPROVAL_SCORE)
+        offset = 0
+        for key, shortlists, _ in pending:
+            entry = entries[key] = {}
+            for intent, ranked, total in shortlists:
+                hits = np.flatnonzero(approved[offset:offset + len(ranked)])
+                offset += len(ranked)
+                # Дальше min_approved-го одобренного типичному клиенту кандидата список не нужен
+                cut = hits[self.min_approved - 1] + 1 if len(hits) >= self.min_approved else len(ranked)
+                entry[intent] = (ranked[:cut], cut == total)
+
+    def rebuild_in_background(self, resources):
+        """Один фоновый поток на перестройку; повторные вызовы во время сборки игнорируются."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.build(resources)
+            except Exception as e:
+                # Пока каталога нет, BEST работает полным перебором
+                self.failures += 1
+                delay = min(OFFER_RETRY_BASE * 2 ** (self.failures - 1), OFFER_RETRY_MAX)
+                self._retry_at = time.monotonic() + delay
+                print(f"[⚠️] Ошибка построения каталога предложений: {e}, повтор через {delay:.0f} сек")
+            else:
+                self.failures = 0
+                self._retry_at = 0.0
+            finally:
+                self._building = False
+
+        threading.Thread(target=run, name="offer-catalog", daemon=True).start()
+
+    # --- запрос ---
+
+    def best_offers(self, model, resources, personal_data, annual_income_usd: float, usd_to_kzt: float):
+        """
+        Ответ BEST по каталогу или None, если нужен полный перебор: каталог
+        ещё не построен для текущей модели, корзины нет или список обрезан
+        раньше, чем нашёлся одобренный кредит.
+        """
+        if self.version != resources.version:
+            if resources.ready and time.monotonic() >= self._retry_at:
+                self.rebuild_in_background(resources)
+            self.fallbacks += 1
+            return None
+        with self._lock:
+            df, ages, incomes = self._df, self._ages, self._incomes
+            entry = self.entries.get((
+                personal_data.person_home_ownership,
+                self.age_bucket(personal_data.person_age),
+                self.income_bucket(annual_income_usd),
+            ))
+        if entry is None:
+            self.fallbacks += 1
+            return None
+
+        age_min, age_max = personal_data.person_age - AGE_WINDOW, personal_data.person_age + AGE_WINDOW
+        income_min, income_max = annual_income_usd * INCOME_FLOOR, annual_income_usd
+        shortlists = {}
+        for intent, (ranked, complete) in entry.items():
+            in_window = ranked[(ages[ranked] >= age_min) & (ages[ranked] <= age_max)
+                               & (incomes[ranked] >= income_min) & (incomes[ranked] <= income_max)]
+            shortlists[intent] = (in_window, complete)
+
+        positions = np.unique(np.concatenate([ranked for ranked, _ in shortlists.values()]))
+        records = score_similar_credits(model, df.iloc[positions], personal_data, annual_income_usd, usd_to_kzt)
+        by_position = dict(zip(positions.tolist(), records))
+
+        offers = []
+        for intent, (ranked, complete) in shortlists.items():
+            best = next((by_position[p] for p in ranked.tolist() if is_approved(by_position[p])), None)
+            if best is None and not complete:
+                self.fallbacks += 1
+                return None
+            if best is not None:
+                offers.append(best)
+        self.hits += 1
+        self.rescored_rows += len(positions)
+        # Тот же порядок и выбор, что у полного перебора
+        return best_per_intent(offers)
+
+    def stats(self) -> dict:
+        return {
+            "model_version": self.version,
+            "buckets": len(self.entries),
+            "rows": sum(len(ranked) for entry in self.entries.values() for ranked, _ in entry.values()),
+            "build_seconds": self.build_seconds,
+            "building": self._building,
+            "failures": self.failures,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "rescored_rows_per_hit": round(self.rescored_rows / self.hits, 1) if self.hits else None,
+        }
@@ -0,0 +1,62 @@
+"""
+Keyset-пагинация и NDJSON-стриминг для списков.
+
+Страница выбирается по условию id > after_id с сортировкой по id, поэтому
+стоимость запроса не растёт с номером страницы (в отличие от OFFSET).
+Выбираются только нужные колонки, ORM-объекты не создаются.
+
+Если страница заполнена целиком, id её последней строки возвращается в
+заголовке X-Next-After-Id — его нужно передать как after_id следующего запроса.
+"""
+import json
+import os
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import AsyncSessionLocal
+
+PAGE_LIMIT_MAX = int(os.getenv("PAGE_LIMIT_MAX", "1000"))
+# Сколько строк за раз забирается из курсора при стриминге
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
+
+def keyset_query(columns, id_column, where=(), after_id: int = None, limit: int = None):
+    query = select(*columns).where(*where)
+    if after_id is not None:
+        query = query.where(id_column > after_id)
+    query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+async def fetch_page(db: AsyncSession, response: Response, columns, id_column, where=(), after_id: int = None, limit: int = None):
+    """Одна страница в виде списка словарей. Без limit — все строки после after_id."""
+    result = await db.execute(keyset_query(columns, id_column, where, after_id, limit))
+    rows = [dict(row) for row in result.mappings()]
+    if limit is not None and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1][id_column.key])
+    return rows
+
+
+def stream_ndjson(columns, id_column, where=(), after_id: int = None, limit: int = None) -> StreamingResponse:
+    """
+    Отдаёт строки в формате NDJSON (одна JSON-строка на запись) по мере чтения
+    из серверного курсора, так что память не зависит от размера таблицы.
+
+    Сессия открывается внутри генератора: сессия из Depends к моменту
+    отправки тела ответа может быть уже закрыта.
+    """
+    query = keyset_query(columns, id_column, where, after_id, limit).execution_options(yield_per=STREAM_CHUNK_SIZE)
+
+    async def generate():
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query)
+            async for rows in result.mappings().partitions():
+                yield "".join(json.dumps(dict(row), ensure_ascii=False, default=str) + "\n" for row in rows)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
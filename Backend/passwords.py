@@ -0,0 +1,36 @@
+import os
+
+from passlib.context import CryptContext
+
+from process_pool import BoundedProcessPool
+
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+# Сколько операций bcrypt может ждать в очереди, сверх этого — 503
+PASSWORD_QUEUE_SIZE = int(os.getenv("PASSWORD_QUEUE_SIZE", str(PASSWORD_WORKERS * 16)))
+PASSWORD_TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", "5"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordPool(BoundedProcessPool):
+    """
+    Отдельный пул процессов для bcrypt. Всплеск логинов нагружает только
+    его, а не общий threadpool, на котором живут остальные эндпоинты.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_size: int = PASSWORD_QUEUE_SIZE, timeout: float = PASSWORD_TIMEOUT):
+        super().__init__(workers, queue_size, timeout)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(check_password, plain_password, hashed_password)
@@ -0,0 +1,114 @@
+"""
+Кэш предсказаний модели.
+
+Ключ — значения строки, которую получает пайплайн (model_input): уже в
+долларах и только с его колонками. Одинаковые анкеты с /predict/ и одинаковые пары
+(клиент, кредит из датасета) в /find-credits/ не оцениваются повторно;
+модель вызывается одним пакетом только для промахов.
+
+Кэш сбрасывается сам при смене версии модели (resources.version) и при
+смене курса валют (clear подписывается на RateHolder).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+from metrics import MODEL_BATCH_ROWS, MODEL_INFERENCE
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "50000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "600"))
+
+
+def row_keys(X: pd.DataFrame) -> list:
+    """
+    Ключ строки — кортеж её значений по всем колонкам, NaN заменяется на None
+    (NaN не равен сам себе, и такие строки никогда не попадали бы в кэш).
+    Кортеж, а не хэш строки: у разных строк разные ключи, коллизия не может
+    отдать чужое предсказание. Колонки переводятся в списки целиком, без
+    обхода DataFrame по строкам.
+    """
+    columns = []
+    for name in X.columns:
+        column = X[name]
+        values = column.tolist()
+        if column.hasnans:
+            values = [None if missing else value for value, missing in zip(values, column.isna().tolist())]
+        columns.append(values)
+    return list(zip(*columns))
+
+
+class PredictionCache:
+    def __init__(self, maxsize: int = PREDICTION_CACHE_SIZE, ttl: float = PREDICTION_CACHE_TTL):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.model_version = None
+        self.invalidations = 0
+
+    def clear(self, *_):
+        """Сбрасывает кэш; сигнатура подходит для RateHolder.add_listener."""
+        self.cache.clear()
+        self.invalidations += 1
+
+    def _check_version(self, version):
+        if version != self.model_version:
+            if self.model_version is not None:
+                self.clear()
+            self.model_version = version
+
+    def lookup(self, model, raw: pd.DataFrame, version):
+        """(labels, scores), если все строки есть в кэше, иначе None."""
+        self._check_version(version)
+        hits = self.cache.get_many(row_keys(model.model_input(raw)))
+        if any(hit is None for hit in hits):
+            return None
+        labels, scores = zip(*hits)
+        return np.asarray(labels, dtype=model.classes.dtype), np.asarray(scores, dtype=float)
+
+    def predict(self, model, raw: pd.DataFrame, version, lookup: bool = True):
+        """
+        То же, что model.predict(raw), но строки из кэша в модель не попадают.
+        lookup=False — только досчитать и сохранить (кэш уже проверен через lookup).
+        """
+        self._check_version(version)
+        X = model.model_input(raw)
+        keys = row_keys(X)
+
+        labels = np.empty(len(keys), dtype=model.classes.dtype)
+        scores = np.empty(len(keys), dtype=float)
+        hits = self.cache.get_many(keys) if lookup else [None] * len(keys)
+        missing = []
+        for i, hit in enumerate(hits):
+            if hit is None:
+                missing.append(i)
+            else:
+                labels[i], scores[i] = hit
+
+        if missing:
+            with MODEL_INFERENCE.time():
+                new_labels, new_scores = model.predict_input(X.iloc[missing])
+            MODEL_BATCH_ROWS.observe(len(missing))
+            for i, label, score in zip(missing, new_labels, new_scores):
+                labels[i] = label
+                scores[i] = score
+                self.cache.set(keys[i], (label, score))
+        return labels, scores
+
+    def bind(self, model, version) -> "CachedModel":
+        return CachedModel(self, model, version)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "ttl": self.cache.ttl, "invalidations": self.invalidations,
+                "model_version": self.model_version}
+
+
+class CachedModel:
+    """Обёртка с интерфейсом CompiledPipeline.predict для scoring.py."""
+
+    def __init__(self, cache: PredictionCache, model, version):
+        self.cache = cache
+        self.model = model
+        self.version = version
+
+    def predict(self, raw: pd.DataFrame):
+        return self.cache.predict(self.model, raw, self.version)
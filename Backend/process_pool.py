@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class PoolBusy(Exception):
+    """Очередь пула переполнена или задача не уложилась в таймаут."""
+
+
+def _ping():
+    return os.getpid()
+
+
+def _watch_parent(parent_pid: int):
+    # Воркер пула не переживает родителя: иначе после SIGKILL воркера uvicorn
+    # он остаётся сиротой и держит унаследованный слушающий сокет
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(0)
+
+
+def _init_pool_worker(parent_pid: int, initializer):
+    threading.Thread(target=_watch_parent, args=(parent_pid,), daemon=True).start()
+    if initializer is not None:
+        initializer()
+
+
+class BoundedProcessPool:
+    """
+    Пул процессов с ограниченной очередью и таймаутом на задачу.
+
+    Если в очереди уже queue_size задач, новая сразу получает PoolBusy —
+    перегрузка одного пула не растекается на остальные эндпоинты.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float, initializer=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.initializer = initializer
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._executor is not None:
+            return
+        # Пул стартует на старте приложения, до появления потоков, поэтому fork безопасен
+        # и не требует повторного импорта main.py в воркерах
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(os.getenv("POOL_MP_CONTEXT", "fork")),
+            initializer=_init_pool_worker,
+            initargs=(os.getpid(), self.initializer),
+        )
+        # Прогрев: поднимаем все процессы заранее, чтобы первый запрос не ждал импортов
+        for _ in range(self.workers):
+            self._executor.submit(_ping)
+
+    def shutdown(self):
+        if self._executor is not None:
+            # Ждём выхода воркеров, чтобы они не пережили процесс приложения
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        if self._pending >= self.queue_size:
+            raise PoolBusy()
+        self.start()
+        task = self._executor.submit(fn, *args)
+        self._pending += 1
+        # Место в очереди освобождается, когда задача действительно завершилась:
+        # после таймаута она продолжает работать в воркере и занимает его
+        future = asyncio.wrap_future(task)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolBusy()
+        finally:
+            # Ещё не начатая задача (таймаут или отмена запроса) снимается с очереди
+            task.cancel()
+
+    def _release(self, future):
+        self._pending -= 1
+        if not future.cancelled():
+            # Результат задачи, дождавшейся конца после таймаута, уже никому не нужен
+            future.exception()
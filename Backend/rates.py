@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import ExchangeRate
+
+# Как часто перечитывать БД, если закэшированный курс не сегодняшний (сек)
+RATE_REFRESH_INTERVAL = float(os.getenv("RATE_REFRESH_INTERVAL", "300"))
+# Ключ pg_advisory_xact_lock для загрузки курса, одинаковый во всех воркерах
+RATE_FETCH_LOCK_ID = 720_114_007
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """Неизменяемая копия строки ExchangeRate, не привязанная к сессии."""
+    date: date
+    usd: float
+    eur: float
+    rub: float
+    kzt: float
+
+    @classmethod
+    def from_row(cls, row: ExchangeRate):
+        return cls(date=row.date, usd=row.usd, eur=row.eur, rub=row.rub, kzt=row.kzt)
+
+
+class RateHolder:
+    """
+    Последний курс валют в памяти процесса.
+
+    Загружается из БД один раз и подменяется, когда /currency-rates/
+    сохраняет новый курс. Если в памяти курс не за сегодня, БД
+    перечитывается не чаще RATE_REFRESH_INTERVAL — так процесс увидит
+    курс, который записал другой воркер.
+    """
+
+    def __init__(self, refresh_interval: float = RATE_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._rate = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+        # single-flight для запроса к openexchangerates
+        self.fetch_lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        if self._rate is None:
+            return False
+        if self._rate.date >= date.today():
+            return True
+        return time.monotonic() - self._checked_at < self.refresh_interval
+
+    @property
+    def stale(self) -> bool:
+        """Курс пора перечитать из БД (например, вместе с другими данными запроса)."""
+        return not self._fresh()
+
+    @property
+    def current(self):
+        """Курс в памяти без обращения к БД."""
+        return self._rate
+
+    def get(self, db: Session):
+        """Последний курс для синхронных обработчиков (None, если курсов нет)."""
+        if self._fresh():
+            return self._rate
+        with self._lock:
+            if not self._fresh():
+                row = db.query(ExchangeRate).order_by(ExchangeRate.date.desc()).first()
+                self._store(row)
+        return self._rate
+
+    async def aget(self, db: AsyncSession):
+        """То же для async-обработчиков."""
+        if self._fresh():
+            return self._rate
+        result = await db.execute(select(ExchangeRate).order_by(ExchangeRate.date.desc()).limit(1))
+        self._store(result.scalars().first())
+        return self._rate
+
+    def set(self, row: ExchangeRate):
+        """Вызывается после вставки нового курса или загрузки последнего курса из БД."""
+        self._store(row)
+
+    def invalidate(self):
+        self._rate = None
+        self._checked_at = 0.0
+
+    def add_listener(self, callback):
+        """callback(snapshot) вызывается при смене курса."""
+        self._listeners.append(callback)
+
+    def _store(self, row):
+        snapshot = RateSnapshot.from_row(row) if row is not None else None
+        changed = snapshot != self._rate
+        self._rate = snapshot
+        self._checked_at = time.monotonic()
+        if changed and snapshot is not None:
+            for callback in self._listeners:
+                callback(snapshot)
+
+
+async def lock_rate_fetch(db: AsyncSession):
+    """
+    На PostgreSQL — блокировка до конца транзакции db: курс за день
+    загружает из API один воркер, остальные дожидаются его строки в БД.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(text(f"SELECT pg_advisory_xact_lock({RATE_FETCH_LOCK_ID})"))
+
+
+async def save_rate(db: AsyncSession, values: dict) -> ExchangeRate:
+    """
+    Записывает курс за values["date"] и коммитит. Если курс за эту дату уже
+    есть (уникальный индекс по date), возвращает существующий.
+    """
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = (
+        insert(ExchangeRate).values(**values)
+        .on_conflict_do_nothing(index_elements=[ExchangeRate.date])
+        .returning(ExchangeRate)
+    )
+    row = (await db.execute(statement)).scalars().first()
+    if row is None:
+        row = (await db.execute(select(ExchangeRate).where(ExchangeRate.date == values["date"]))).scalars().first()
+    await db.commit()
+    return row
@@ -0,0 +1,46 @@
+import base64
+import io
+import os
+
+from process_pool import BoundedProcessPool
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+# Сколько картинок может ждать рендера одновременно, сверх этого — 503
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", str(RENDER_WORKERS * 8)))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "30"))
+
+
+def _init_worker():
+    # Тяжёлые импорты делаются один раз при старте воркера, а не на каждый запрос
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import shap  # noqa: F401
+
+
+def render_waterfall(expected_value, shap_values, feature_values, feature_names) -> str:
+    """Рисует waterfall-график SHAP и возвращает PNG в base64. Выполняется в воркере."""
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import pandas as pd
+    import shap
+
+    plt.clf()
+    shap.plots._waterfall.waterfall_legacy(
+        expected_value, np.asarray(shap_values), pd.Series(feature_values, index=feature_names), show=False
+    )
+
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png", bbox_inches="tight")
+    plt.close("all")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+class RenderPool(BoundedProcessPool):
+    """Пул процессов для matplotlib/shap с прогретыми воркерами."""
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE, timeout: float = RENDER_TIMEOUT):
+        super().__init__(workers, queue_size, timeout, initializer=_init_worker)
+
+    async def render(self, expected_value, shap_values, feature_values, feature_names) -> str:
+        return await self.run(render_waterfall, expected_value, shap_values, feature_values, feature_names)
@@ -0,0 +1,65 @@
+"""
+Контекст запроса для эндпоинтов скоринга одним SQL-запросом.
+
+Пользователь, его анкета и последний курс валют выбираются одним
+SELECT с LEFT JOIN, а не тремя запросами подряд. Курс подтягивается,
+только если в RateHolder он устарел; свежий курс берётся из памяти.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from models import ExchangeRate, PersonalData, User
+from rates import RateHolder, RateSnapshot
+
+
+@dataclass
+class RequestContext:
+    user: Optional[User]
+    personal_data: Optional[PersonalData]
+    rate: Optional[RateSnapshot]
+
+
+def context_query(user_id: int = None, username: str = None, with_personal: bool = True, with_rate: bool = True):
+    entities = [User]
+    if with_personal:
+        entities.append(PersonalData)
+    latest_rate = None
+    if with_rate:
+        latest_rate = aliased(
+            ExchangeRate, select(ExchangeRate).order_by(ExchangeRate.date.desc()).limit(1).subquery("latest_rate")
+        )
+        entities.append(latest_rate)
+
+    query = select(*entities)
+    if with_personal:
+        query = query.outerjoin(PersonalData, PersonalData.user_id == User.id)
+    if with_rate:
+        # Курсов может не быть вовсе, пользователь всё равно должен найтись
+        query = query.outerjoin(latest_rate, true())
+    if user_id is not None:
+        query = query.where(User.id == user_id)
+    else:
+        query = query.where(User.username == username)
+    return query
+
+
+async def load_context(db: AsyncSession, rate_holder: RateHolder, user_id: int = None, username: str = None,
+                       with_personal: bool = True, with_rate: bool = True) -> RequestContext:
+    """
+    Пользователь по id или имени, его PersonalData и курс валют.
+    Отсутствующие части — None. Загруженный курс сохраняется в rate_holder.
+    """
+    fetch_rate = with_rate and rate_holder.stale
+    result = await db.execute(context_query(user_id, username, with_personal, fetch_rate))
+    row = result.first()
+    if row is None:
+        return RequestContext(user=None, personal_data=None, rate=rate_holder.current if with_rate else None)
+
+    personal_data = row[1] if with_personal else None
+    if fetch_rate:
+        rate_holder.set(row[-1])
+    return RequestContext(user=row[0], personal_data=personal_data, rate=rate_holder.current if with_rate else None)
@@ -0,0 +1,106 @@
+"""
+Тяжёлые ресурсы процесса: пайплайн модели, датасет кредитов и SHAP-explainer.
+
+Модель и датасет грузятся в фоновом потоке после старта (load_in_background),
+поэтому сервис сразу отвечает на /healthz и эндпоинты, которым модель не нужна.
+Когда всё загружено, /readyz начинает отвечать 200. shap импортируется только
+при первом обращении к explainer.
+"""
+import os
+import threading
+import time
+
+MODEL_NAME = os.getenv("MODEL_NAME", "my_pipeline")
+CREDIT_CSV_PATH = os.getenv("CREDIT_CSV_PATH", "credit_risk_dataset.csv")
+
+
+class Resources:
+    def __init__(self, model_name: str = MODEL_NAME, csv_path: str = CREDIT_CSV_PATH):
+        self.model_name = model_name
+        self.csv_path = csv_path
+        self.model = None
+        self.compiled_model = None
+        self.df = None
+        self.credit_index = None
+        self.credit_knn = None
+        self.error = None
+        self.load_seconds = None
+        # Растёт при каждой (пере)загрузке модели
+        self.version = 0
+        self._explainer = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def load(self, force: bool = False):
+        """
+        Загружает модель и датасет. Повторный вызов ничего не делает, с force=True
+        перечитывает их заново; при ошибке остаются прежние объекты.
+        """
+        with self._lock:
+            if self.ready and not force:
+                return
+            start = time.perf_counter()
+
+            from pycaret.classification import load_model
+            from credit_index import CreditIndex
+            from knn import CreditKNN
+            from dataset import load_credit_dataset
+            from inference import CompiledPipeline
+
+            model = load_model(self.model_name)
+            # Memory-mapped снимок вместо разбора CSV в каждом процессе
+            df = load_credit_dataset(self.csv_path)
+
+            self.model = model
+            # Быстрый путь инференса без накладных расходов predict_model
+            self.compiled_model = CompiledPipeline(model)
+            self.df = df
+            # Индекс для поиска похожих кредитов и случайных примеров
+            self.credit_index = CreditIndex(df)
+            # KD-дерево для mode=knn
+            self.credit_knn = CreditKNN(df)
+            self._explainer = None
+            self.version += 1
+            self.error = None
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            self._ready.set()
+        print(f"✅ Модель и датасет загружены за {self.load_seconds} сек")
+
+    def load_in_background(self):
+        if self.ready:
+            # Уже загружено, например мастером serve.py до форка воркеров
+            return
+
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                self.error = str(e)
+                print(f"[⚠️] Ошибка загрузки модели: {e}")
+
+        threading.Thread(target=run, name="resources-loader", daemon=True).start()
+
+    def get_explainer(self):
+        """TreeExplainer строится при первом запросе объяснения и переиспользуется."""
+        if self._explainer is None:
+            with self._lock:
+                if self._explainer is None:
+                    import shap
+                    self._explainer = shap.TreeExplainer(self.compiled_model.estimator)
+        return self._explainer
+
+    def status(self) -> dict:
+        return {
+            "model_loaded": self.ready,
+            "model_version": self.version,
+            "load_seconds": self.load_seconds,
+            "explainer_loaded": self._explainer is not None,
+            "error": self.error,
+        }
+
+
+resources = Resources()
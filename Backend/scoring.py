@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from features import BASE_FEATURES
+
+# Размер пачки при потоковой выдаче /find-credits/?stream=true
+SCORE_CHUNK_SIZE = int(os.getenv("SCORE_CHUNK_SIZE", "500"))
+# Сколько строк проверяется поштучно после ошибки пачки, прежде чем признать ошибку общей
+SCORE_PROBE_ROWS = int(os.getenv("SCORE_PROBE_ROWS", "16"))
+# Минимальная уверенность модели в отсутствии дефолта для выдачи в BEST
+APPROVAL_SCORE = 0.8
+
+
+class ScoringError(RuntimeError):
+    """Модель не оценила ни одной строки: запрос должен завершиться ошибкой, а не пустыми прогнозами."""
+
+
+def build_candidate_features(candidates: pd.DataFrame, personal_data, annual_income_usd: float) -> pd.DataFrame:
+    """Одна матрица признаков: данные клиента + параметры кредита каждого кандидата."""
+    n = len(candidates)
+    return pd.DataFrame({
+        "person_age": np.full(n, personal_data.person_age),
+        "person_income": np.full(n, annual_income_usd),
+        "person_home_ownership": np.full(n, personal_data.person_home_ownership, dtype=object),
+        "person_emp_length": np.full(n, personal_data.person_emp_length),
+        "loan_intent": candidates["loan_intent"].to_numpy(),
+        "loan_grade": candidates["loan_grade"].to_numpy(),
+        "loan_amnt": candidates["loan_amnt"].to_numpy(),
+        "loan_int_rate": candidates["loan_int_rate"].to_numpy(),
+        "loan_percent_income": candidates["loan_amnt"].to_numpy() / annual_income_usd,
+        "cb_person_default_on_file": np.full(n, "N", dtype=object),
+        "cb_person_cred_hist_length": candidates["cb_person_cred_hist_length"].to_numpy(),
+    }, columns=BASE_FEATURES)
+
+
+def score_candidates(model, features: pd.DataFrame):
+    """Один вызов пайплайна на всю пачку. Возвращает (labels, scores) как numpy-массивы."""
+    labels, scores = model.predict(features)
+    return np.asarray(labels, dtype=float), np.asarray(scores, dtype=float)
+
+
+def score_rows(model, features: pd.DataFrame):
+    """
+    (labels, scores, errors), где errors — {номер строки: текст ошибки}.
+    Если пачка целиком упала, строки оцениваются по одной: ошибку получают
+    только те, на которых она воспроизводится. Если не прошла ни одна из
+    первых SCORE_PROBE_ROWS строк, модель неисправна — ScoringError.
+    """
+    try:
+        labels, scores = score_candidates(model, features)
+        return labels, scores, {}
+    except Exception as e:
+        batch_error = e
+        print(f"[⚠️] Ошибка прогноза для пачки из {len(features)} строк: {e!r}")
+
+    n = len(features)
+    labels, scores, errors = np.full(n, np.nan), np.full(n, np.nan), {}
+    for i in range(n):
+        try:
+            row_labels, row_scores = score_candidates(model, features.iloc[[i]])
+            labels[i], scores[i] = row_labels[0], row_scores[0]
+        except Exception as e:
+            errors[i] = f"Ошибка прогноза: {str(e)}"
+            if len(errors) == i + 1 and (i + 1 >= SCORE_PROBE_ROWS or i + 1 == n):
+                raise ScoringError(f"Ошибка прогноза: {str(batch_error)}") from batch_error
+    print(f"[⚠️] Ошибка прогноза в {len(errors)} из {n} строк, остальные оценены")
+    return labels, scores, errors
+
+
+def attach_kzt_amounts(frame: pd.DataFrame, usd_to_kzt: float) -> pd.DataFrame:
+    """Пересчёт дохода и суммы кредита в тенге по столбцам."""
+    income_kzt_annual = frame["person_income"] * usd_to_kzt
+    frame["person_income_kzt_annual"] = income_kzt_annual.round(2)
+    frame["person_income_kzt_monthly"] = (income_kzt_annual / 12).round(2)
+    frame["loan_amnt_kzt"] = (frame["loan_amnt"] * usd_to_kzt).round(2)
+    return frame
+
+
+def score_similar_credits(model, candidates: pd.DataFrame, personal_data, annual_income_usd: float, usd_to_kzt: float) -> list:
+    """
+    Оценивает все найденные кредиты за один проход модели и собирает
+    ответ в том же формате, что и поштучная версия /find-credits/.
+    Строка, которую модель не смогла оценить, получает текст ошибки вместо
+    прогноза; если не оценена ни одна — ScoringError.
+    """
+    frame = attach_kzt_amounts(candidates.copy(), usd_to_kzt)
+    records = frame.replace({np.nan: None, np.inf: None, -np.inf: None}).to_dict(orient="records")
+    if not records:
+        return records
+
+    labels, scores, errors = score_rows(model, build_candidate_features(candidates, personal_data, annual_income_usd))
+
+    client = {
+        "client_person_age": personal_data.person_age,
+        "client_person_income_usd_annual": round(annual_income_usd, 2),
+        "client_person_income_kzt_annual": round(annual_income_usd * usd_to_kzt, 2),
+        "client_person_home_ownership": personal_data.person_home_ownership,
+        "client_person_emp_length": personal_data.person_emp_length,
+    }
+    for i, (credit, label, score) in enumerate(zip(records, labels.tolist(), np.round(scores, 4).tolist())):
+        if i in errors:
+            credit["client_prediction"] = errors[i]
+        else:
+            credit["client_prediction"] = {"prediction_label": label, "prediction_score": score, **client}
+
+    return records
+
+
+def iter_scored_chunks(model, candidates: pd.DataFrame, personal_data, annual_income_usd: float, usd_to_kzt: float,
+                       chunk_size: int = SCORE_CHUNK_SIZE):
+    """
+    То же, что score_similar_credits, но по кускам из chunk_size строк:
+    в памяти одновременно только одна пачка готовых словарей.
+    """
+    for start in range(0, len(candidates), chunk_size):
+        yield score_similar_credits(
+            model, candidates.iloc[start:start + chunk_size], personal_data, annual_income_usd, usd_to_kzt
+        )
+
+
+def is_approved(credit: dict) -> bool:
+    """Кредит подходит клиенту: модель уверенно предсказывает отсутствие дефолта."""
+    pred = credit.get("client_prediction", {})
+    return isinstance(pred, dict) and pred.get("prediction_label") == 0.0 and pred.get("prediction_score", 0) > APPROVAL_SCORE
+
+
+def offer_rank(credit: dict):
+    """Ключ для max: сумма больше, при равной сумме — ставка ниже (без ставки — в конец)."""
+    rate = credit.get("loan_int_rate")
+    return credit.get("loan_amnt_kzt", 0), -(rate if rate is not None else 1000)
+
+
+def best_per_intent(credits_list: list) -> list:
+    """filter_type=BEST: лучший одобренный кредит для каждой цели, по алфавиту целей."""
+    grouped = {}
+    for credit in credits_list:
+        if is_approved(credit):
+            grouped.setdefault(credit.get("loan_intent"), []).append(credit)
+    return [max(grouped[intent], key=offer_rank) for intent in sorted(grouped, key=str)]
@@ -0,0 +1,381 @@
+"""
+Pre-fork сервер для нескольких ядер.
+
+Мастер один раз готовит БД, загружает модель и датасет, замораживает их
+для GC и форкает WEB_CONCURRENCY воркеров uvicorn на общем сокете. Воркеры
+получают модель через copy-on-write и сами её не грузят.
+
+    WEB_CONCURRENCY=4 python serve.py [--host 0.0.0.0] [--port 8000]
+
+Сигналы мастеру:
+    SIGHUP          перечитать модель и датасет и по одному заменить воркеры
+    SIGTERM/SIGINT  мягко остановить воркеры и выйти
+
+У каждого воркера свои пулы процессов (рендер, bcrypt, пакетный скоринг).
+Если их размер не задан явно, POOL_PROCESSES процессов каждого пула
+делятся между воркерами, но не меньше одного на воркер.
+
+Каждый воркер отмечает heartbeat из своего event loop. Если отметки нет
+дольше WORKER_TIMEOUT, мастер убивает воркер и поднимает новый; упавшие
+воркеры тоже перезапускаются.
+"""
+import os
+
+# Параллелизм даёт число воркеров, BLAS/OpenMP внутри каждого не должны плодить потоки
+for _name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_name, "1")
+
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import traceback
+
+import uvicorn
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Воркер без heartbeat дольше этого времени считается зависшим (сек)
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT", "30"))
+# Сколько ждать первого heartbeat от нового воркера
+WORKER_BOOT_TIMEOUT = float(os.getenv("WORKER_BOOT_TIMEOUT", "60"))
+# Сколько ждать мягкой остановки воркера перед SIGKILL
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Построить SHAP-explainer в мастере, чтобы он тоже был общим
+PRELOAD_EXPLAINER = os.getenv("PRELOAD_EXPLAINER", "0") == "1"
+# Процессов каждого пула на все воркеры вместе, если *_WORKERS пула не заданы
+POOL_PROCESSES = int(os.getenv("POOL_PROCESSES", "2"))
+POOL_SIZE_VARS = ("RENDER_WORKERS", "PASSWORD_WORKERS", "BATCH_WORKERS")
+RESPAWN_BACKOFF_MAX = 30.0
+
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn.Server, который раз в секунду отмечает heartbeat из своего event loop."""
+
+    def __init__(self, config: uvicorn.Config, heartbeats, slot: int):
+        super().__init__(config)
+        self.heartbeats = heartbeats
+        self.slot = slot
+
+    async def on_tick(self, counter: int) -> bool:
+        # on_tick вызывается каждые 0.1 с и только после того, как сервер запущен
+        if counter % 10 == 0:
+            self.heartbeats[self.slot] = time.time()
+        return await super().on_tick(counter)
+
+
+class Worker:
+    def __init__(self, pid: int, slot: int):
+        self.pid = pid
+        self.slot = slot
+        self.started_at = time.time()
+        self.stop_requested_at = None
+
+    @property
+    def stopping(self) -> bool:
+        return self.stop_requested_at is not None
+
+
+async def _hash_in_master(password: str) -> str:
+    from passwords import hash_password
+    return hash_password(password)
+
+
+async def _bootstrap():
+    from db_init import bootstrap_db
+    from models import async_engine, engine
+
+    await bootstrap_db(_hash_in_master)
+    # Соединения мастера (в том числе от миграций) не должны достаться воркерам
+    await async_engine.dispose()
+    engine.dispose()
+
+
+def _build_offer_catalog(resources):
+    """Каталог BEST строится в мастере и достаётся воркерам при форке."""
+    import main
+
+    try:
+        main.offer_catalog.build(resources)
+    except Exception as e:
+        # Без каталога BEST отвечает полным перебором, воркеры перестроят его сами
+        print(f"[⚠️] Каталог предложений не построен в мастере: {e}")
+
+
+class Master:
+    def __init__(self, host: str, port: int, workers: int, log_level: str):
+        self.host = host
+        self.port = port
+        self.num_workers = max(workers, 1)
+        self.log_level = log_level
+        self.app = None
+        self.sock = None
+        self.workers = {}
+        # Слотов вдвое больше: при перезапуске старый и новый воркер живут одновременно
+        self.heartbeats = multiprocessing.RawArray("d", self.num_workers * 2)
+        self.running = True
+        self._signals = []
+        self._failures = 0
+        self._respawn_at = 0.0
+        self._wakeup = None
+        self._metrics_dir = None
+
+    # --- подготовка ---
+
+    def _prepare_metrics_dir(self):
+        # Воркеры складывают сюда снимки метрик, /metrics любого воркера суммирует их
+        path = os.environ.get("METRICS_DIR")
+        if not path:
+            path = self._metrics_dir = tempfile.mkdtemp(prefix="metrics-")
+            os.environ["METRICS_DIR"] = path
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                os.remove(os.path.join(path, name))
+
+    def _size_pools(self):
+        # Пулы создаются при импорте main в каждом воркере: без этого их было бы
+        # по умолчанию 2+2+2 процесса на воркер
+        per_worker = str(max(1, POOL_PROCESSES // self.num_workers))
+        for name in POOL_SIZE_VARS:
+            os.environ.setdefault(name, per_worker)
+
+    def prepare(self):
+        start = time.perf_counter()
+        # До импорта main: metrics читает METRICS_DIR, пулы — *_WORKERS при импорте
+        self._prepare_metrics_dir()
+        self._size_pools()
+        import main
+        from resources import resources
+
+        asyncio.run(_bootstrap())
+        resources.load()
+        _build_offer_catalog(resources)
+        if PRELOAD_EXPLAINER:
+            resources.get_explainer()
+        self.app = main.app
+        self._freeze()
+        print(f"✅ Мастер [{os.getpid()}] готов за {time.perf_counter() - start:.1f} сек, воркеров: {self.num_workers}")
+
+    @staticmethod
+    def _freeze():
+        # Объекты мастера уходят в постоянное поколение GC: сборщик в воркерах
+        # не трогает их заголовки, и страницы остаются общими
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def bind(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        self.sock = sock
+
+    # --- воркеры ---
+
+    def _free_slot(self) -> int:
+        used = {worker.slot for worker in self.workers.values()}
+        return next(slot for slot in range(len(self.heartbeats)) if slot not in used)
+
+    def spawn(self) -> Worker:
+        slot = self._free_slot()
+        self.heartbeats[slot] = 0.0
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+        worker = Worker(pid, slot)
+        self.workers[pid] = worker
+        return worker
+
+    def _run_worker(self, slot: int):
+        code = 0
+        try:
+            for sig in (signal.SIGHUP, signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            for fd in self._wakeup:
+                os.close(fd)
+
+            config = uvicorn.Config(self.app, log_level=self.log_level, lifespan="on")
+            WorkerServer(config, self.heartbeats, slot).run(sockets=[self.sock])
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop_worker(self, worker: Worker):
+        """Мягкая остановка: uvicorn дообслуживает текущие запросы и выходит."""
+        if not worker.stopping:
+            worker.stop_requested_at = time.time()
+        self.kill(worker, signal.SIGTERM)
+
+    @staticmethod
+    def kill(worker: Worker, sig=signal.SIGKILL):
+        try:
+            os.kill(worker.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def active_workers(self):
+        return [worker for worker in self.workers.values() if not worker.stopping]
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None or worker.stopping or not self.running:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            print(f"[⚠️] Воркер {pid} завершился (код {code}), поднимаем новый")
+            if not self.heartbeats[worker.slot]:
+                # Упал, не успев стартовать: не перезапускаем в цикле без паузы
+                self._failures += 1
+                self._respawn_at = time.monotonic() + min(2 ** self._failures, RESPAWN_BACKOFF_MAX)
+
+    def check_health(self):
+        now = time.time()
+        for worker in list(self.workers.values()):
+            if worker.stopping:
+                if now - worker.stop_requested_at > GRACEFUL_TIMEOUT:
+                    self.kill(worker)
+                continue
+
+            beat = self.heartbeats[worker.slot]
+            if not beat:
+                if now - worker.started_at > WORKER_BOOT_TIMEOUT:
+                    print(f"[⚠️] Воркер {worker.pid} не запустился за {WORKER_BOOT_TIMEOUT:.0f} сек, убиваем")
+                    self.kill(worker)
+            elif now - beat > WORKER_TIMEOUT:
+                print(f"[⚠️] Воркер {worker.pid} не отвечает {now - beat:.0f} сек, убиваем")
+                self.kill(worker)
+            else:
+                self._failures = 0
+
+    def maintain(self):
+        if not self.running or time.monotonic() < self._respawn_at:
+            return
+        for _ in range(self.num_workers - len(self.active_workers())):
+            self.spawn()
+
+    # --- сигналы и основной цикл ---
+
+    def _on_signal(self, sig, frame):
+        self._signals.append(sig)
+
+    def _sleep(self, timeout: float):
+        ready, _, _ = select.select([self._wakeup[0]], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self._wakeup[0], 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _handle_signals(self):
+        while self._signals:
+            sig = self._signals.pop(0)
+            if sig in (signal.SIGTERM, signal.SIGINT):
+                self.running = False
+            elif sig == signal.SIGHUP and self.running:
+                self.rolling_restart()
+
+    def _wait_ready(self, worker: Worker) -> bool:
+        deadline = time.time() + WORKER_BOOT_TIMEOUT
+        while time.time() < deadline:
+            self.reap()
+            if worker.pid not in self.workers:
+                return False
+            if self.heartbeats[worker.slot]:
+                return True
+            self._sleep(0.1)
+        return False
+
+    def rolling_restart(self):
+        """Перечитывает модель и по одному заменяет воркеры: новый стартует раньше, чем уходит старый."""
+        from resources import resources
+
+        print("🔄 Перезапуск воркеров")
+        try:
+            resources.load(force=True)
+            if PRELOAD_EXPLAINER:
+                resources.get_explainer()
+        except Exception as e:
+            print(f"[⚠️] Не удалось перечитать модель, воркеры остаются прежними: {e}")
+            return
+        # Как в prepare: новые воркеры получают готовый каталог, а не строят его каждый сам
+        _build_offer_catalog(resources)
+        self._freeze()
+
+        for old in self.active_workers():
+            new = self.spawn()
+            if not self._wait_ready(new):
+                print(f"[⚠️] Новый воркер {new.pid} не запустился, перезапуск остановлен")
+                self.kill(new)
+                return
+            self.stop_worker(old)
+        print("✅ Воркеры перезапущены")
+
+    def run(self):
+        self.prepare()
+        self.bind()
+
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self._wakeup[1])
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, self._on_signal)
+
+        print(f"🚀 Слушаем http://{self.host}:{self.port}")
+        self.maintain()
+        while self.running:
+            self._sleep(1.0)
+            self._handle_signals()
+            self.reap()
+            self.check_health()
+            self.maintain()
+
+        self.shutdown()
+
+    def shutdown(self):
+        for worker in list(self.workers.values()):
+            self.stop_worker(worker)
+        deadline = time.time() + GRACEFUL_TIMEOUT
+        while self.workers and time.time() < deadline:
+            self.reap()
+            self._sleep(0.1)
+        for worker in list(self.workers.values()):
+            self.kill(worker)
+        self.reap()
+        self.sock.close()
+        if self._metrics_dir:
+            shutil.rmtree(self._metrics_dir, ignore_errors=True)
+        print("👋 Мастер остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork сервер: модель загружается один раз и делится между воркерами")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+    Master(args.host, args.port, args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бэкенда лежат плоско в Backend/ и импортируются по имени, как в main.py
+sys.path.insert(0, BACKEND_DIR)
+
+# Тесты работают с отдельной SQLite-базой, а не с DATABASE_URL окружения.
+# Переменные читаются при импорте models, поэтому задаются до любого теста
+_TEST_DB = os.path.join(tempfile.mkdtemp(prefix="backend-tests-"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DB}"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{_TEST_DB}"
+os.environ.setdefault("MODEL_NAME", os.path.join(BACKEND_DIR, "my_pipeline"))
+
+# Сколько ждать фоновой загрузки модели и датасета
+MODEL_LOAD_TIMEOUT = float(os.getenv("TEST_MODEL_LOAD_TIMEOUT", "120"))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient приложения с полным lifespan (миграции, админ, пулы) и курсом за сегодня."""
+    try:
+        import aiosqlite  # noqa: F401
+    except ImportError:
+        # Без драйвера тесты с БД не должны молча пропускаться
+        pytest.fail("Для тестов нужен aiosqlite: pip install -r requirements-dev.txt")
+    from fastapi.testclient import TestClient
+
+    import main
+    from models import ExchangeRate, SessionLocal
+
+    with TestClient(main.app) as test_client:
+        with SessionLocal() as db:
+            # Без курса /predict/ и /find-credits/ не работают, а API курсов в тестах недоступен
+            db.add(ExchangeRate(date=date.today(), usd=1.0, eur=0.92, rub=92.0, kzt=480.0))
+            db.commit()
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    response = client.post("/token/", data={"username": "admin", "password": "admin"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="session")
+def model_ready(client):
+    """Ждёт загрузки модели и датасета; без pycaret или CSV тест пропускается."""
+    from resources import resources
+
+    deadline = time.monotonic() + MODEL_LOAD_TIMEOUT
+    while not resources.ready and resources.error is None and time.monotonic() < deadline:
+        time.sleep(0.2)
+    if not resources.ready:
+        pytest.skip(f"Модель или датасет не загружены: {resources.error or 'таймаут'}")
+    return resources
+
+
+@pytest.fixture
+def query_budget_strict(monkeypatch):
+    """
+    Превышение query_budget эндпоинта — ответ 500 вместо ответа обработчика
+    (как при QUERY_BUDGET_STRICT=1), поэтому достаточно проверять статус.
+    """
+    import metrics
+
+    monkeypatch.setattr(metrics, "QUERY_BUDGET_STRICT", True)
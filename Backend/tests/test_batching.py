@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from batching import InferenceBatcher, QueueFull
+
+
+def rows(*ages) -> list:
+    return [{"person_age": age} for age in ages]
+
+
+class Recorder:
+    """score_fn: метка — возраст из строки, скор — возраст / 100; запоминает размеры пачек."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, frame):
+        self.calls.append(len(frame))
+        if self.error is not None:
+            raise self.error
+        ages = frame["person_age"].to_numpy(dtype=float)
+        return ages.astype(int), ages / 100
+
+
+def run(coroutine_fn, batcher: InferenceBatcher):
+    async def main():
+        try:
+            return await coroutine_fn()
+        finally:
+            await batcher.stop()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_share_one_call():
+    score_fn = Recorder()
+    batcher = InferenceBatcher(score_fn, max_batch_size=64, max_wait_ms=50)
+
+    results = run(lambda: asyncio.gather(
+        batcher.predict(rows(20)), batcher.predict(rows(30, 31)), batcher.predict(rows(40, 41, 42)),
+    ), batcher)
+
+    assert score_fn.calls == [6]
+    # Каждый получает свой срез в порядке своих строк
+    for (labels, scores), expected in zip(results, ([20], [30, 31], [40, 41, 42])):
+        assert labels.tolist() == expected
+        np.testing.assert_allclose(scores, np.array(expected) / 100)
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["requests"] == 3
+
+
+def test_batch_is_cut_at_max_batch_size():
+    score_fn = Recorder()
+    batcher = InferenceBatcher(score_fn, max_batch_size=2, max_wait_ms=50)
+
+    results = run(lambda: asyncio.gather(*(batcher.predict(rows(age)) for age in range(5))), batcher)
+
+    assert score_fn.calls == [2, 2, 1]
+    assert [labels.tolist() for labels, _ in results] == [[0], [1], [2], [3], [4]]
+
+
+def test_score_error_reaches_every_caller():
+    error = RuntimeError("модель упала")
+    batcher = InferenceBatcher(Recorder(error), max_wait_ms=50)
+
+    results = run(lambda: asyncio.gather(
+        batcher.predict(rows(20)), batcher.predict(rows(30)), return_exceptions=True,
+    ), batcher)
+
+    assert results == [error, error]
+
+
+def test_full_queue_raises_queue_full():
+    batcher = InferenceBatcher(Recorder(), queue_size=2, max_wait_ms=50)
+
+    async def scenario():
+        waiting = [asyncio.create_task(batcher.predict(rows(age))) for age in (20, 30)]
+        # Обе заявки в очереди, фоновая задача её ещё не разбирала
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await batcher.predict(rows(40))
+        assert batcher.rejected == 1
+        # Принятые заявки при этом оцениваются
+        return await asyncio.gather(*waiting)
+
+    results = run(scenario, batcher)
+    assert [labels.tolist() for labels, _ in results] == [[20], [30]]
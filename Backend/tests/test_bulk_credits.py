@@ -0,0 +1,23 @@
+import io
+
+import pytest
+
+from bulk_credits import BulkFormatError, iter_batches
+
+
+def test_non_utf8_file_is_a_format_error():
+    lines = io.TextIOWrapper(io.BytesIO("hash,loan_amount\nкредит,1000\n".encode("cp1251")), encoding="utf-8-sig")
+    with pytest.raises(BulkFormatError, match="UTF-8"):
+        list(iter_batches(lines, "csv"))
+
+
+def test_non_utf8_upload_returns_400(client, admin_headers):
+    credits = "loan_amount,interest_rate,term_months,hash\n1000,12.5,36,cp1251-ok\n1000,12.5,36,кредит-1\n"
+    response = client.post("/admin/credits/bulk?format=csv",
+                           files={"file": ("c.csv", io.BytesIO(credits.encode("cp1251")))}, headers=admin_headers)
+
+    assert response.status_code == 400
+    assert "UTF-8" in response.json()["detail"]
+    # Файл не импортирован даже частично
+    export = client.get("/admin/credits/export", headers=admin_headers)
+    assert "cp1251-ok" not in export.text
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+import pytest
+from jose import jwt
+
+import main
+
+APPLICATION = {
+    "person_age": 30, "person_income": 50000, "person_home_ownership": "RENT", "person_emp_length": 5,
+    "loan_intent": "EDUCATION", "loan_grade": "A", "loan_amnt": 5000, "loan_int_rate": 10.5,
+    "loan_percent_income": 0.1, "cb_person_default_on_file": False, "cb_person_cred_hist_length": 3,
+}
+
+
+def token_headers(claims: dict) -> dict:
+    token = jwt.encode({"exp": datetime.utcnow() + timedelta(minutes=5), **claims}, main.SECRET_KEY, algorithm=main.ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize("path, body", [("/explain/image", APPLICATION), ("/explain/batch", [APPLICATION])])
+def test_token_without_subject_is_rejected(client, model_ready, path, body):
+    response = client.post(path, json=body, headers=token_headers({}))
+
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Недопустимый токен"
+
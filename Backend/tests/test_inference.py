@@ -0,0 +1,62 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_dataset
+from features import BASE_FEATURES, MODEL_FEATURES, TARGET
+from inference import CompiledPipeline, check_parity
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Estimator:
+    classes_ = np.array([0, 1])
+
+
+def _pipeline(feature_names: list) -> SimpleNamespace:
+    return SimpleNamespace(
+        steps=[("trained_model", _Estimator())],
+        named_steps={"trained_model": _Estimator()},
+        feature_names_in_=feature_names,
+    )
+
+
+def test_target_is_not_a_model_input():
+    # Как у пайплайна pycaret: целевая колонка последней в feature_names_in_
+    compiled = CompiledPipeline(_pipeline(BASE_FEATURES + [TARGET]))
+    raw = synthetic_dataset(5)[BASE_FEATURES]
+
+    assert compiled.feature_names == BASE_FEATURES
+    assert list(compiled.model_input(raw).columns) == BASE_FEATURES
+
+
+def test_engineered_features_only_for_pipelines_that_use_them():
+    raw = synthetic_dataset(5)[BASE_FEATURES]
+
+    base_only = CompiledPipeline(_pipeline(BASE_FEATURES + [TARGET]))
+    assert not base_only.engineered
+    base_only.model_input(raw)
+    assert list(raw.columns) == BASE_FEATURES
+
+    with_engineered = CompiledPipeline(_pipeline(MODEL_FEATURES))
+    assert list(with_engineered.model_input(raw.copy()).columns) == MODEL_FEATURES
+
+
+@pytest.fixture(scope="module")
+def shipped_pipeline():
+    classification = pytest.importorskip("pycaret.classification")
+    return classification.load_model(os.path.join(BACKEND_DIR, "my_pipeline"), verbose=False)
+
+
+def test_compiled_pipeline_matches_predict_model(shipped_pipeline):
+    raw = synthetic_dataset(3000, seed=7)[BASE_FEATURES]
+    assert check_parity(shipped_pipeline, raw) == 3000
+
+
+def test_compiled_pipeline_ignores_engineered_features(shipped_pipeline):
+    compiled = CompiledPipeline(shipped_pipeline)
+    assert TARGET not in compiled.feature_names
+    assert set(compiled.feature_names) <= set(BASE_FEATURES)
+    assert not compiled.engineered
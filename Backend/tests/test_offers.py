@@ -0,0 +1,68 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import offers
+from offers import OfferCatalog
+from scoring import best_per_intent, score_similar_credits
+
+USD_TO_KZT = 480.0
+
+
+def wait_built(catalog: OfferCatalog, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while catalog._building and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_build_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(offers, "OFFER_RETRY_BASE", 60.0)
+    catalog = OfferCatalog()
+    builds = []
+
+    def build(resources):
+        builds.append(resources.version)
+        raise RuntimeError("модель недоступна")
+
+    monkeypatch.setattr(catalog, "build", build)
+    resources = SimpleNamespace(version=1, ready=True)
+    client = SimpleNamespace(person_home_ownership="RENT", person_age=30, person_emp_length=5)
+
+    assert catalog.best_offers(None, resources, client, 50000, USD_TO_KZT) is None
+    wait_built(catalog)
+    assert builds == [1] and catalog.failures == 1
+
+    # До конца задержки новых попыток нет, BEST работает полным перебором
+    assert catalog.best_offers(None, resources, client, 50000, USD_TO_KZT) is None
+    wait_built(catalog)
+    assert builds == [1]
+
+    catalog._retry_at = time.monotonic()
+    catalog.best_offers(None, resources, client, 50000, USD_TO_KZT)
+    wait_built(catalog)
+    assert builds == [1, 1] and catalog.failures == 2
+    # Задержка удваивается
+    assert catalog._retry_at - time.monotonic() > 60.0
+
+
+def test_catalog_matches_full_pass(model_ready):
+    """На загруженной модели (my_pipeline.pkl) каталог отвечает так же, как полный перебор BEST."""
+    catalog = OfferCatalog()
+    catalog.build(model_ready)
+    index, model = model_ready.credit_index, model_ready.compiled_model
+
+    clients = index.df.dropna(subset=["person_emp_length"]).sample(200, random_state=0)
+    for row in clients.itertuples():
+        client = SimpleNamespace(person_age=int(row.person_age), person_home_ownership=row.person_home_ownership,
+                                 person_emp_length=int(row.person_emp_length))
+        income_usd = float(row.person_income)
+        answer = catalog.best_offers(model, model_ready, client, income_usd, USD_TO_KZT)
+        if answer is None:
+            continue
+        window = index.find_similar(0, client.person_home_ownership, client.person_age - 5, client.person_age + 5,
+                                    income_usd * 0.8, income_usd)
+        assert answer == best_per_intent(score_similar_credits(model, window, client, income_usd, USD_TO_KZT))
+
+    if not catalog.hits:
+        pytest.fail(f"Каталог не ответил ни на один запрос: {catalog.stats()}")
@@ -0,0 +1,119 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic_dataset
+from features import BASE_FEATURES
+from prediction_cache import PredictionCache, row_keys
+from rates import RateHolder
+
+
+class CountingModel:
+    """Интерфейс CompiledPipeline для кэша; метка и скор зависят от значений строки."""
+
+    classes = np.array([0, 1])
+
+    def __init__(self):
+        self.scored_rows = 0
+
+    def model_input(self, raw: pd.DataFrame) -> pd.DataFrame:
+        return raw[BASE_FEATURES]
+
+    def predict_input(self, X: pd.DataFrame):
+        self.scored_rows += len(X)
+        amounts = X["loan_amnt"].to_numpy(dtype=float)
+        return (amounts > 15000).astype(int), np.round(amounts / 40000, 4)
+
+    def predict(self, raw: pd.DataFrame):
+        return self.predict_input(self.model_input(raw))
+
+
+def frame(rows: int = 50, seed: int = 1) -> pd.DataFrame:
+    return synthetic_dataset(rows, seed=seed)[BASE_FEATURES]
+
+
+def test_repeated_rows_come_from_the_cache():
+    model, cache = CountingModel(), PredictionCache()
+    raw = frame()
+    expected_labels, expected_scores = model.predict(raw)
+    model.scored_rows = 0
+
+    first = cache.predict(model, raw, version=1)
+    second = cache.predict(model, raw, version=1)
+
+    assert model.scored_rows == len(raw)
+    for labels, scores in (first, second):
+        assert np.array_equal(labels, expected_labels) and np.array_equal(scores, expected_scores)
+    assert cache.lookup(model, raw, version=1) is not None
+
+
+def test_only_missing_rows_are_scored():
+    model, cache = CountingModel(), PredictionCache()
+    known, new = frame(seed=1), frame(10, seed=2)
+    cache.predict(model, known, version=1)
+    model.scored_rows = 0
+
+    mixed = pd.concat([new, known], ignore_index=True)
+    labels, scores = cache.predict(model, mixed, version=1)
+
+    assert model.scored_rows == len(new)
+    assert cache.lookup(model, new.iloc[:1], version=1) is not None
+    expected_labels, expected_scores = model.predict(mixed)
+    assert np.array_equal(labels, expected_labels) and np.array_equal(scores, expected_scores)
+
+
+def test_model_version_change_clears_the_cache():
+    model, cache = CountingModel(), PredictionCache()
+    raw = frame()
+    cache.predict(model, raw, version=1)
+
+    assert cache.lookup(model, raw, version=2) is None
+    assert cache.invalidations == 1
+
+
+def test_rate_change_clears_the_cache():
+    model, cache = CountingModel(), PredictionCache()
+    holder = RateHolder()
+    holder.add_listener(cache.clear)
+    raw = frame()
+    cache.predict(model, raw, version=1)
+
+    holder.set(_Rate(kzt=480.0))
+    assert cache.lookup(model, raw, version=1) is None
+
+    cache.predict(model, raw, version=1)
+    # Тот же курс повторно — не смена, кэш остаётся
+    holder.set(_Rate(kzt=480.0))
+    assert cache.lookup(model, raw, version=1) is not None
+
+
+def test_keys_are_the_row_values():
+    raw = frame(3)
+    raw.loc[1, "loan_int_rate"] = np.nan
+    keys = row_keys(raw)
+
+    assert keys[0] == tuple(raw.iloc[0].tolist())
+    assert keys[1][BASE_FEATURES.index("loan_int_rate")] is None
+    # NaN в одних и тех же колонках не мешает совпадению
+    assert row_keys(raw.iloc[[1]]) == [keys[1]]
+    assert len(set(keys)) == 3
+
+
+def test_rows_differing_in_one_value_get_their_own_predictions():
+    model, cache = CountingModel(), PredictionCache()
+    raw = frame(1)
+    raw.loc[0, "loan_amnt"] = 10000.0
+    other = raw.copy()
+    other.loc[0, "loan_amnt"] = 20000.0
+
+    cache.predict(model, raw, version=1)
+    labels, scores = cache.predict(model, other, version=1)
+
+    assert labels.tolist() == [1] and scores.tolist() == [0.5]
+
+
+class _Rate:
+    def __init__(self, kzt: float):
+        self.date = date.today()
+        self.usd, self.eur, self.rub, self.kzt = 1.0, 0.92, 92.0, kzt
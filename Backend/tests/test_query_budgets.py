@@ -0,0 +1,90 @@
+import io
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.usefixtures("query_budget_strict")
+
+PROFILE = {"person_age": 35, "person_income": 600000, "person_home_ownership": "RENT", "person_emp_length": 6}
+
+
+def register(client, username: str) -> int:
+    response = client.post("/register/", data={"username": username, "password": "secret", "email": f"{username}@example.com"})
+    assert response.status_code == 200, response.text
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return client.get("/userinfo/", headers=headers).json()["user_id"]
+
+
+def test_over_budget_request_fails_before_response(client, admin_headers, monkeypatch):
+    client.post("/personal-data/", json=PROFILE, headers=admin_headers)
+    monkeypatch.setattr(main.get_personal_data, "query_budget", 0)
+
+    response = client.get("/personal-data/", headers=admin_headers)
+
+    assert response.status_code == 500
+    assert "при бюджете 0" in response.text
+
+
+def test_profile_endpoints(client, admin_headers):
+    assert client.post("/token/", data={"username": "admin", "password": "admin"}).status_code == 200
+    assert client.get("/userinfo/", headers=admin_headers).status_code == 200
+    assert client.post("/personal-data/", json=PROFILE, headers=admin_headers).status_code == 200
+    assert client.post("/personal-data/", json=PROFILE, headers=admin_headers).status_code == 200
+    assert client.get("/personal-data/", headers=admin_headers).status_code == 200
+    assert client.get("/currency-rates/").status_code == 200
+
+
+def test_listing_endpoints(client, admin_headers):
+    user_id = register(client, "budget_lister")
+    credits = "user_id,loan_amount,interest_rate,term_months,hash\n" + "".join(
+        f"{user_id},{1000 + i},12.5,36,budget-{i}\n" for i in range(30)
+    )
+    response = client.post("/admin/credits/bulk?format=csv", files={"file": ("c.csv", io.BytesIO(credits.encode()))},
+                           headers=admin_headers)
+    assert response.json()["inserted"] == 30
+
+    assert client.get("/admin/users/?limit=5", headers=admin_headers).status_code == 200
+    page = client.get(f"/admin/credits/{user_id}?limit=10", headers=admin_headers)
+    assert page.status_code == 200 and len(page.json()) == 10
+    after_id = page.headers["X-Next-After-Id"]
+    assert client.get(f"/admin/credits/{user_id}?limit=10&after_id={after_id}", headers=admin_headers).status_code == 200
+    assert client.get("/credits/", headers=admin_headers).status_code == 200
+
+
+def test_admin_user_changes(client, admin_headers):
+    user_id = register(client, "budget_target")
+    assert client.put(f"/admin/users/{user_id}/make_admin", headers=admin_headers).status_code == 200
+    assert client.delete(f"/admin/users/{user_id}", headers=admin_headers).status_code == 200
+
+
+def test_model_endpoints(client, admin_headers, model_ready):
+    client.post("/personal-data/", json=PROFILE, headers=admin_headers)
+    application = {"loan_amount": 1500000, "currency": "KZT", "loan_intent": "EDUCATION", "loan_grade": "B",
+                   "loan_int_rate": 11.5}
+
+    assert client.post("/predict/", json=application, headers=admin_headers).status_code == 200
+    for query in ("", "?filter_type=BEST", "?stream=true", "?mode=knn&k=10"):
+        response = client.post(f"/find-credits/{query}", json=PROFILE, headers=admin_headers)
+        assert response.status_code == 200, (query, response.text)
+    assert client.get("/sample_credit/1").status_code == 200
+
+    rows = "person_age,person_income,person_home_ownership,person_emp_length,loan_amount,currency,loan_intent,loan_grade,loan_int_rate\n"
+    rows += "30,500000,RENT,4,2000,USD,MEDICAL,A,9.5\n" * 5
+    response = client.post("/predict/batch?format=csv", files={"file": ("a.csv", io.BytesIO(rows.encode()))},
+                           headers=admin_headers)
+    assert response.status_code == 200
+    assert '"errors": 0' in response.text.splitlines()[-1]
+
+
+def test_sample_credit_with_missing_values(client, model_ready, monkeypatch):
+    index = model_ready.credit_index
+    gaps = index.df[index.df["loan_int_rate"].isna() & (index.df["loan_status"] == 1)]
+    if gaps.empty:
+        pytest.skip("В датасете нет кредитов без ставки")
+    monkeypatch.setattr(index, "sample", lambda loan_status: gaps.iloc[0])
+
+    response = client.get("/sample_credit/1")
+
+    assert response.status_code == 200, response.text
+    assert response.json()["loan_int_rate"] is None
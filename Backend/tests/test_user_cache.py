@@ -0,0 +1,101 @@
+import pytest
+
+import main
+
+APPLICATION = {
+    "person_age": 30, "person_income": 50000, "person_home_ownership": "RENT", "person_emp_length": 5,
+    "loan_intent": "EDUCATION", "loan_grade": "A", "loan_amnt": 5000, "loan_int_rate": 10.5,
+    "loan_percent_income": 0.1, "cb_person_default_on_file": False, "cb_person_cred_hist_length": 3,
+}
+PROFILE = {"person_age": 35, "person_income": 600000, "person_home_ownership": "RENT", "person_emp_length": 6}
+
+
+def register(client, username: str):
+    """(user_id, заголовки с токеном) нового пользователя; токен уже в кэше после /userinfo/."""
+    response = client.post("/register/", data={"username": username, "password": "secret", "email": f"{username}@example.com"})
+    assert response.status_code == 200, response.text
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/userinfo/", headers=headers).json()["user_id"]
+    assert main.cached_user(token) is not None
+    return user_id, headers
+
+
+def token_of(headers: dict) -> str:
+    return headers["Authorization"].split()[1]
+
+
+def test_deleted_user_token_is_rejected(client, admin_headers):
+    user_id, headers = register(client, "cache_deleted")
+
+    assert client.delete(f"/admin/users/{user_id}", headers=admin_headers).status_code == 200
+
+    assert main.cached_user(token_of(headers)) is None
+    assert client.get("/userinfo/", headers=headers).status_code == 403
+    assert client.get("/personal-data/", headers=headers).status_code == 403
+    assert client.get("/credits/", headers=headers).status_code == 403
+
+
+def test_deleted_user_token_is_rejected_on_model_endpoints(client, admin_headers, model_ready):
+    user_id, headers = register(client, "cache_deleted_model")
+    assert client.post("/find-credits/", json=PROFILE, headers=headers).status_code == 200
+
+    assert client.delete(f"/admin/users/{user_id}", headers=admin_headers).status_code == 200
+
+    assert client.post("/find-credits/", json=PROFILE, headers=headers).status_code == 403
+    assert client.post("/explain/batch", json=[APPLICATION], headers=headers).status_code == 403
+    assert client.post("/explain/image", json=APPLICATION, headers=headers).status_code == 403
+
+
+def test_promoted_user_sees_admin_rights(client, admin_headers):
+    user_id, headers = register(client, "cache_promoted")
+    assert client.get("/admin/users/", headers=headers).status_code == 403
+
+    assert client.put(f"/admin/users/{user_id}/make_admin", headers=admin_headers).status_code == 200
+
+    assert client.get("/userinfo/", headers=headers).json()["is_admin"] is True
+    assert client.get("/admin/users/", headers=headers).status_code == 200
+
+
+def test_updated_email_is_seen_by_the_old_token(client):
+    _, headers = register(client, "cache_email")
+
+    response = client.post("/update-email/", data={"new_email": "cache_email_new@example.com"}, headers=headers)
+    assert response.status_code == 200, response.text
+
+    assert main.cached_user(token_of(headers)) is None
+    assert client.get("/userinfo/", headers=headers).status_code == 200
+    user = main.cached_user(token_of(headers))
+    assert user.email == "cache_email_new@example.com" and not user.email_confirmed
+
+
+def test_updated_password_drops_the_cached_user(client):
+    _, headers = register(client, "cache_password")
+
+    response = client.post("/update-password/", data={"old_password": "secret", "new_password": "secret2"},
+                           headers=headers)
+    assert response.status_code == 200, response.text
+
+    # Следующий запрос со старым токеном снова сверяется с БД
+    assert main.cached_user(token_of(headers)) is None
+    assert client.get("/userinfo/", headers=headers).status_code == 200
+    assert client.post("/update-password/", data={"old_password": "secret", "new_password": "secret3"},
+                       headers=headers).status_code == 403
+
+
+def test_invalidation_from_another_worker(client):
+    user_id, headers = register(client, "cache_other_worker")
+
+    # Другой воркер serve.py меняет только общее поколение, локальный кэш он не видит
+    main.user_generations.bump(user_id)
+
+    assert main.cached_user(token_of(headers)) is None
+
+
+@pytest.mark.usefixtures("query_budget_strict")
+def test_warm_userinfo_issues_no_queries(client, monkeypatch):
+    _, headers = register(client, "cache_warm")
+
+    monkeypatch.setattr(main.get_user_info, "query_budget", 0)
+
+    assert client.get("/userinfo/", headers=headers).status_code == 200
@@ -1,3 +1,5 @@
+const PAGE_SIZE = 500;
+
 document.addEventListener("DOMContentLoaded", function () {
     async function loadUsers() {
         const token = localStorage.getItem("access_token");
@@ -7,16 +9,25 @@ document.addEventListener("DOMContentLoaded", function () {
         }
 
         try {
-            const response = await fetch("api/admin/users/", {
-                method: "GET",
-                headers: { "Authorization": `Bearer ${token}` }
-            });
+            // Забираем пользователей страницами, пока сервер отдаёт X-Next-After-Id
+            const users = [];
+            let afterId = null;
+            do {
+                const params = new URLSearchParams({ limit: PAGE_SIZE });
+                if (afterId !== null) params.set("after_id", afterId);
+
+                const response = await fetch(`api/admin/users/?${params}`, {
+                    method: "GET",
+                    headers: { "Authorization": `Bearer ${token}` }
+                });
 
-            if (!response.ok) {
-                throw new Error("Ошибка загрузки пользователей");
-            }
+                if (!response.ok) {
+                    throw new Error("Ошибка загрузки пользователей");
+                }
 
-            const users = await response.json();
+                users.push(...await response.json());
+                afterId = response.headers.get("X-Next-After-Id");
+            } while (afterId !== null);
             const tableBody = document.querySelector("#usersTable tbody");
 
             // Очищаем таблицу перед добавлением новых данных
@@ -23,7 +23,8 @@ document.addEventListener("DOMContentLoaded", async function () {
 
     // --- Информация о пользователе ---
     try {
-        const res = await fetch("/api/admin/users/", { headers });
+        // Keyset-страница из одной записи: первый пользователь с id > userId - 1
+        const res = await fetch(`/api/admin/users/?after_id=${userId - 1}&limit=1`, { headers });
         const users = await res.json();
         const user = users.find(u => u.id == userId);
 